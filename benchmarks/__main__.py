@@ -0,0 +1,132 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from benchmarks.importtime import check
+from benchmarks.suite import run_size
+from benchmarks.vault import SIZES, STORAGES, parse_size
+
+
+def run(args) -> int:
+    rng = random.Random(args.seed)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "storage": args.storage,
+        },
+        "results": {},
+    }
+    for label in args.sizes.split(","):
+        print(f"vAUTH> benchmarking {label} services", file=sys.stderr)
+        results = run_size(parse_size(label), rng, args.storage)
+        report["results"][label] = results
+        for name, metrics in results.items():
+            line = ", ".join(f"{metric}={value:,.1f}" for metric, value in metrics.items())
+            print(f"  {name:<14} {line}", file=sys.stderr)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"vAUTH> results written to {args.out}", file=sys.stderr)
+    return 0
+
+
+def _flatten(report: dict) -> dict:
+    return {
+        (size, name, metric): value
+        for size, results in report["results"].items()
+        for name, metrics in results.items()
+        for metric, value in metrics.items()
+        if metric == "ops_per_sec" or metric.endswith("_us")
+    }
+
+
+def compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = _flatten(json.load(f))
+    with open(args.candidate) as f:
+        candidate = _flatten(json.load(f))
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[key], candidate[key]
+        # Throughput regresses when it drops, latency when it grows.
+        if key[2] == "ops_per_sec":
+            change = old / new - 1 if new else float("inf")
+        else:
+            change = new / old - 1 if old else 0.0
+        regressed = change > args.threshold
+        regressions += regressed
+        print(
+            f"{'REGRESSION' if regressed else 'ok':<10} {'.'.join(key):<40} "
+            f"{old:>14,.1f} -> {new:>14,.1f} ({change:+.1%} slower)"
+        )
+    print(f"vAUTH> {regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def importtime(args) -> int:
+    failures = check(args.module, args.budget_ms, args.runs)
+    for failure in failures:
+        print(f"FAILED     {failure}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="vAUTH benchmarks",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "--sizes",
+        default="1k,10k",
+        help=f"Comma separated vault sizes, one of {', '.join(SIZES)} or an integer",
+    )
+    run_parser.add_argument("--out", default="bench_output.json", help="JSON report")
+    run_parser.add_argument("--seed", type=int, default=0, help="Sampling seed")
+    run_parser.add_argument(
+        "--storage", choices=STORAGES, default="sqlite", help="Storage backend"
+    )
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two reports, fails on regressions"
+    )
+    compare_parser.add_argument("baseline", help="Baseline JSON report")
+    compare_parser.add_argument("candidate", help="Candidate JSON report")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown before failing, 0.2 = 20%%",
+    )
+    compare_parser.set_defaults(func=compare)
+
+    importtime_parser = subparsers.add_parser(
+        "importtime", help="Check the CLI import time, fails over budget"
+    )
+    importtime_parser.add_argument(
+        "--module", default="vauth.__main__", help="Module to import"
+    )
+    importtime_parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=120,
+        help="Allowed median cumulative import time in milliseconds",
+    )
+    importtime_parser.add_argument(
+        "--runs", type=int, default=5, help="Number of fresh interpreters"
+    )
+    importtime_parser.set_defaults(func=importtime)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
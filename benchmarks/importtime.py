@@ -0,0 +1,83 @@
+import os
+import statistics
+import subprocess
+import sys
+
+# Optional at startup, these are imported by the commands that need them.
+LAZY_MODULES = ("cryptography", "pyotp", "qrcode", "logging")
+
+
+def measure(module: str) -> dict[str, int]:
+    """
+    Imports a module in a fresh interpreter with python -X importtime
+
+    Parameters
+    ----------
+    module : str
+        Module to import
+
+    Returns
+    -------
+    dict[str, int]
+        Cumulative import time in microseconds of every imported module
+    """
+    env = dict(os.environ)
+    lib = os.path.join(os.path.dirname(os.path.dirname(__file__)), "lib")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [lib, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def check(module: str, budget_ms: float, runs: int = 5) -> list[str]:
+    """
+    Checks the import time of a module against a budget
+
+    Parameters
+    ----------
+    module : str
+        Module to import
+    budget_ms : float
+        Allowed median cumulative import time in milliseconds
+    runs : int
+        Number of fresh interpreters to measure
+
+    Returns
+    -------
+    list[str]
+        Failures, empty when the module is within budget
+    """
+    samples = [measure(module) for _ in range(runs)]
+    failures = []
+    eager = sorted(
+        {
+            name
+            for name in samples[0]
+            if name.split(".")[0] in LAZY_MODULES and name.split(".")[0] != module
+        }
+    )
+    if eager:
+        failures.append(f"imported at startup: {', '.join(eager)}")
+    median_ms = statistics.median(s.get(module, 0) for s in samples) / 1000
+    print(
+        f"vAUTH> import {module}: {median_ms:.1f} ms (budget {budget_ms:.0f} ms)",
+        file=sys.stderr,
+    )
+    if median_ms > budget_ms:
+        slowest = sorted(samples[0].items(), key=lambda item: item[1], reverse=True)
+        for name, micros in slowest[1:11]:
+            print(f"  {name:<40} {micros / 1000:>8.1f} ms", file=sys.stderr)
+        failures.append(f"{median_ms:.1f} ms is over the {budget_ms:.0f} ms budget")
+    return failures
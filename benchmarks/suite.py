@@ -0,0 +1,169 @@
+import contextlib
+import io
+import random
+import time
+from typing import Callable, Iterable
+
+from vauth.otp import OTPEngine
+
+from benchmarks.vault import SyntheticVault
+
+# Latency benchmarks sample at most this many calls per size.
+SAMPLES = 2000
+
+
+class _NullWriter(io.RawIOBase):
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return len(data)
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[round(q * (len(ordered) - 1))]
+
+
+def latency(func: Callable, calls: Iterable[tuple]) -> dict:
+    """
+    Times every call and summarises the latencies
+
+    Parameters
+    ----------
+    func : Callable
+        Function under test
+    calls : Iterable[tuple]
+        Positional arguments of each call
+
+    Returns
+    -------
+    dict
+        ops_per_sec, p50_us and p99_us
+    """
+    timings = []
+    clock = time.perf_counter
+    for args in calls:
+        start = clock()
+        func(*args)
+        timings.append(clock() - start)
+    return {
+        "ops_per_sec": len(timings) / sum(timings),
+        "p50_us": percentile(timings, 0.50) * 1e6,
+        "p99_us": percentile(timings, 0.99) * 1e6,
+    }
+
+
+def throughput(count: int, func: Callable, *args) -> dict:
+    """
+    Times a single bulk call processing count items
+
+    Returns
+    -------
+    dict
+        ops_per_sec and seconds
+    """
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    return {"ops_per_sec": count / seconds, "seconds": seconds}
+
+
+def run_size(size: int, rng: random.Random, storage: str = "sqlite") -> dict:
+    """
+    Runs every benchmark against a fresh synthetic vault of the given size
+
+    Parameters
+    ----------
+    size : int
+        Number of services
+    rng : random.Random
+        Source of the sampled keys
+    storage : str
+        Storage backend, one of STORAGES
+
+    Returns
+    -------
+    dict
+        Results keyed by benchmark name
+    """
+    results = {}
+    vault = SyntheticVault(storage=storage)
+    commands = vault.commands
+    db = commands.db
+    user_id, key = vault.user_id, vault.password
+    try:
+        rows = vault.rows(size)
+        samples = rng.sample(range(size), min(size, SAMPLES))
+
+        start = time.perf_counter()
+        encrypted = commands.enc.encrypt_many(rows, key)
+        results["encrypt"] = {"ops_per_sec": size / (time.perf_counter() - start)}
+
+        def insert():
+            with db.transaction():
+                for i in range(0, size, 10_000):
+                    db.insert_many(encrypted[i : i + 10_000])
+
+        results["insert"] = throughput(size, insert)
+        del rows, encrypted
+
+        results["lookup"] = latency(
+            db.find_service,
+            ((user_id, f"user{i}", f"service{i}") for i in samples),
+        )
+
+        def scan():
+            for batch in db.iter_services(user_id, 1000):
+                for row in batch:
+                    row.seed
+
+        results["scan"] = throughput(size, scan)
+
+        stored = [db.find_service(user_id, f"user{i}", f"service{i}") for i in samples]
+        results["decrypt"] = latency(
+            commands.enc.decrypt_data, ((dict(row), key) for row in stored)
+        )
+        seeds = [commands.enc.decrypt_data(row, key)["seed"] for row in stored]
+
+        commands.seed_cache.clear()
+        results["find_seed"] = latency(
+            commands.find_seed,
+            ((user_id, key, f"user{i}", f"service{i}") for i in samples),
+        )
+
+        engine = OTPEngine()
+        engine.load({str(i): seed for i, seed in enumerate(seeds)})
+        now = time.time()
+        results["otp_recompute"] = latency(
+            engine.codes, ((now + 30 * step,) for step in range(200))
+        )
+        results["otp_recompute"]["seeds"] = len(seeds)
+        results["otp_tick"] = latency(engine.codes, ((now,) for _ in range(SAMPLES)))
+        for seed in seeds:
+            commands.show_service(seed, user_id, "service")
+        results["show_service"] = latency(
+            commands.show_service, ((seed, user_id, "service") for seed in seeds)
+        )
+
+        # Wrong codes, so the replay cache never short-circuits a check.
+        checks = [(user_id, f"service{i}", f"user{i}", "0000000") for i in samples]
+        checks *= max(1, 50_000 // len(checks))
+        results["verify"] = throughput(len(checks), commands.verify, key, checks)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["export"] = throughput(
+                size, commands.export_services, user_id, key, _NullWriter(), "bench"
+            )
+            uris = io.StringIO(
+                "\n".join(
+                    f"otpauth://totp/imported{i}:user?secret={seed}"
+                    for i, seed in enumerate(vault.seeds(size))
+                )
+            )
+            results["import"] = throughput(
+                size, commands.import_services, user_id, key, uris
+            )
+    finally:
+        vault.close()
+    return results
@@ -0,0 +1,102 @@
+import base64
+import random
+import shutil
+import tempfile
+
+from vauth.commands import Commands
+from vauth.encryption import Encryption
+from vauth.storage import MemoryStorage, SQLiteStorage
+from vauth.vault import VaultStorage
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# Storage backends by name, each built from the vault directory.
+STORAGES = {
+    "sqlite": SQLiteStorage,
+    "memory": lambda path: MemoryStorage(),
+    "vault": VaultStorage,
+}
+
+
+def parse_size(label: str) -> int:
+    """
+    Converts a size label such as 10k or 1m into a number of services
+
+    Parameters
+    ----------
+    label : str
+        Size label or plain integer
+
+    Returns
+    -------
+    int
+        Number of services
+    """
+    label = label.strip().lower()
+    if label in SIZES:
+        return SIZES[label]
+    return int(label)
+
+
+class SyntheticVault:
+    """
+    Temporary vault for a single user, stored in its own directory.
+    - storage names one of STORAGES, "memory" leaves only the crypto and OTP
+      costs in the results.
+    - Seeds are generated from a fixed random seed so runs are comparable.
+    - Nothing touches ~/.vauth or the network.
+
+    Methods
+    -------
+    seeds(count: int) -> list[str]:
+        Generates deterministic base32 seeds
+    rows(count: int, offset: int = 0) -> list[dict]:
+        Generates plaintext service rows
+    close() -> None:
+        Closes and deletes the vault
+    """
+
+    def __init__(
+        self,
+        user_id: str = "bench",
+        password: str = "bench-password",
+        seed: int = 0,
+        storage: str = "sqlite",
+    ) -> None:
+        self.user_id = user_id
+        self.password = password
+        self.path = tempfile.mkdtemp(prefix="vauth-bench-")
+        self._random = random.Random(seed)
+        db = STORAGES[storage](self.path)
+        db.insert_one(
+            {
+                "user_id": user_id,
+                "key": Encryption().hash_key(password.encode()),
+                "recovery_codes": [],
+            },
+            db.auth_table,
+        )
+        # Built after registration so login_state is "login".
+        self.commands = Commands(storage=db)
+        self.commands.enc.unlock(password)
+
+    def seeds(self, count: int) -> list[str]:
+        return [
+            base64.b32encode(self._random.randbytes(20)).decode() for _ in range(count)
+        ]
+
+    def rows(self, count: int, offset: int = 0) -> list[dict]:
+        return [
+            {
+                "user_id": self.user_id,
+                "username": f"user{i}",
+                "service": f"service{i}",
+                "seed": seed,
+            }
+            for i, seed in enumerate(self.seeds(count), start=offset)
+        ]
+
+    def close(self) -> None:
+        self.commands.logout()
+        self.commands.db.close()
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -1,11 +1,17 @@
 import argparse
 import cmd
+import glob
 import os
-import threading
-import time
+import sys
 
-import keyboard
+from vauth import qr
 from vauth.commands import Commands
+from vauth.metrics import METRICS
+from vauth.terminal import ESC, KeyReader, Screen, seconds_to_next_tick
+
+VAUTH_DIR = os.path.join(os.path.expanduser("~"), ".vauth")
+# vauth.vault.VAULT_FILE, kept here so commands without a vault skip the import.
+VAULT_FILE = "vauth.vault"
 
 
 class VAuthShell(cmd.Cmd):
@@ -14,10 +20,12 @@ class VAuthShell(cmd.Cmd):
 
     Parameters
     ----------
-    cmd : Commands
-        Commands object
-        user_id : str
+    user_id : str
         User ID
+    key : str
+        Password
+    cmd : Commands | None
+        Commands object of the login, a new one is created when omitted
     """
 
     intro = r""" 
@@ -35,18 +43,14 @@ Welcome to vAUTH CLI TOOL v0.0.6. Enter 'exit' to exit at any time.
     """
     prompt = "vAUTH> "
 
-    def __init__(self, user_id, key):
+    def __init__(self, user_id, key, cmd=None):
         super().__init__()
         self.user_id = user_id
         self.key = key
-        self.cmd = Commands()
-        self.quit_flag = False
-
-    def check_quit_show_service(self):
-        while True:
-            if keyboard.is_pressed("esc"):
-                self.quit_flag = True
-                break
+        self.cmd = Commands() if cmd is None else cmd
+        if not self.cmd.enc.is_session_key(key):
+            self.cmd.enc.unlock(key)
+        self.cmd.warm_up(user_id, key)
 
     def do_add_service(self, args):
         """
@@ -74,26 +78,55 @@ Welcome to vAUTH CLI TOOL v0.0.6. Enter 'exit' to exit at any time.
         service, username = args
         seed = self.cmd.find_seed(self.user_id, self.key, username, service)
         if seed:
-            self.quit_flag = False
-            t = threading.Thread(target=self.check_quit_show_service)
-            t.start()
-            while not self.quit_flag:
-                service = self.cmd.show_service(seed, self.user_id, service)
-                otp = service[0]
-                remaining = int(service[1])
-                os.system("cls" if os.name == "nt" else "clear")
-                progress = "█" * remaining + "░" * (30 - remaining)
-                print(
-                    f"Service: {args[0]}\nUsername: {username}\nOTP: {otp}\n{progress} {remaining}s"
-                )
-                print("Press 'ESC' to quit")
-                time.sleep(1)
-                remaining -= 1
-                if remaining == 0:
-                    remaining = 30
-            t.join()
-            os.system("cls" if os.name == "nt" else "clear")
+            # Sleeps until the next second or a keypress, so an idle view uses no CPU.
+            with KeyReader() as keys, Screen(self.stdout) as screen:
+                while True:
+                    result = self.cmd.show_service(seed, self.user_id, service)
+                    if not isinstance(result, tuple):
+                        return
+                    otp, remaining = result[0], int(result[1])
+                    progress = "█" * remaining + "░" * (30 - remaining)
+                    screen.draw(
+                        [
+                            f"Service: {service}",
+                            f"Username: {username}",
+                            f"OTP: {otp}",
+                            f"{progress} {remaining}s",
+                            "Press 'ESC' to quit",
+                        ]
+                    )
+                    if keys.read_key(seconds_to_next_tick()) == ESC:
+                        break
+            return
+
+    def do_dashboard(self, args):
+        """
+        Display the OTPs of every service, or of those matching a pattern.
+        The pattern is matched against the service and the username,
+        * and ? are wildcards.
+
+        Usage: dashboard [<pattern>]
+        """
+        args = args.split()
+        if len(args) > 1:
+            print("Usage: dashboard [<pattern>]")
+            return
+        pattern = args[0] if args else None
+        if pattern is not None and not any(c in pattern for c in "*?["):
+            pattern = f"*{pattern}*"
+        seeds = self.cmd.find_seeds(self.user_id, self.key, pattern)
+        if not isinstance(seeds, dict):
+            return
+        if not seeds:
+            print(">>NO SERVICES FOUND")
             return
+        # asyncio pulls in logging and concurrent.futures, keep it off startup.
+        import asyncio
+
+        from vauth.dashboard import Dashboard
+
+        with KeyReader() as keys, Screen(self.stdout) as screen:
+            asyncio.run(Dashboard(seeds, screen, keys).run())
 
     def do_show_qr(self, args):
         """
@@ -107,8 +140,30 @@ Welcome to vAUTH CLI TOOL v0.0.6. Enter 'exit' to exit at any time.
             print("Usage: show_qr <service> <username>")
             return
         service, username = args
-        qr = self.cmd.show_qr(self.user_id, self.key, username, service)
-        qr.print_ascii()
+        modules = self.cmd.show_qr(self.user_id, self.key, username, service)
+        if isinstance(modules, tuple):
+            print(qr.render_ascii(modules))
+
+    def do_export_qr(self, args):
+        """
+        Save the QR code of a service to a .txt, .svg or .png file, or the
+        QR codes of every service to a directory.
+
+        Usage: export_qr <service> <username> <file>
+               export_qr --all <directory> [txt/svg/png]
+        """
+        args = args.split()
+        if len(args) in (2, 3) and args[0] == "--all":
+            fmt = args[2] if len(args) == 3 else "png"
+            self.cmd.export_qr(self.user_id, self.key, args[1], fmt)
+            return
+        if len(args) != 3:
+            print("Usage: export_qr <service> <username> <file>")
+            print("       export_qr --all <directory> [txt/svg/png]")
+            return
+        service, username, path = args
+        if self.cmd.save_qr(self.user_id, self.key, username, service, path) == path:
+            print(f">>QR CODE WRITTEN TO {path}")
 
     def do_remove_service(self, args):
         """
@@ -140,17 +195,157 @@ Welcome to vAUTH CLI TOOL v0.0.6. Enter 'exit' to exit at any time.
             self.user_id, self.key, username, service, type, new_value
         )
 
+    def do_list_services(self, args):
+        """
+        List the services of the account, or those starting with a prefix.
+
+        Usage: list_services [<prefix>]
+        """
+        args = args.split()
+        if len(args) > 1:
+            print("Usage: list_services [<prefix>]")
+            return
+        pairs = self.cmd.list_services(self.user_id, args[0] if args else None)
+        self._print_pairs(pairs)
+
+    def do_search(self, args):
+        """
+        Search services and usernames, ignoring case.
+        Prefix matches come first, then names containing the text.
+
+        Usage: search <text>
+        """
+        args = args.split()
+        if len(args) != 1:
+            print("Usage: search <text>")
+            return
+        self._print_pairs(self.cmd.search_services(self.user_id, args[0]))
+
+    def do_build_search_index(self, args):
+        """
+        Build the trigram index that speeds up search on large vaults.
+
+        Usage: build_search_index
+        """
+        if self.cmd.build_search_index() is True:
+            print(">>SEARCH INDEX BUILT")
+        else:
+            print(">>SEARCH INDEX NOT SUPPORTED BY THIS SQLITE")
+
+    def do_regenerate_codes(self, args):
+        """
+        Replace every recovery code with a new set, the old codes stop working.
+
+        Usage: regenerate_codes
+        """
+        recovery_codes = self.cmd.regenerate_recovery_codes(self.user_id, self.key)
+        if isinstance(recovery_codes, list):
+            print(f"Recovery Codes: {recovery_codes}")
+
+    def do_stats(self, args):
+        """
+        Show call counts, latencies, errors and SQLite statements of this session.
+        Writes them in the Prometheus text format when a file is given.
+
+        Usage: stats [<prometheus_file>]
+        """
+        args = args.split()
+        if len(args) > 1:
+            print("Usage: stats [<prometheus_file>]")
+            return
+        if args:
+            if dump_metrics(args[0]):
+                print(f">>METRICS WRITTEN TO {args[0]}")
+            return
+        print(METRICS.summary())
+
     def do_exit(self, args):
         """
         Exit vAUTH.
         """
+        self.cmd.logout()
         return True
 
     def do_clear(self, args):
         """
         Clear the screen.
         """
-        os.system("cls" if os.name == "nt" else "clear")
+        Screen(self.stdout).clear()
+
+    def _print_pairs(self, pairs) -> None:
+        if not isinstance(pairs, list):
+            return
+        if not pairs:
+            print(">>NO SERVICES FOUND")
+            return
+        width = max(len(service) for service, _ in pairs)
+        for service, username in pairs:
+            print(f"{service:<{width}}  {username}")
+
+    def _complete_pair(self, text, line, begidx, endidx):
+        # Completes <service> <username>, the first two arguments.
+        position = len(line[:begidx].split())
+        index = self.cmd.service_index(self.user_id)
+        if position == 1:
+            return index.services(text)
+        if position == 2:
+            return index.usernames(line.split()[1], text)
+        return []
+
+    def _complete_name(self, text, line, begidx, endidx):
+        # Completes a single service name or username.
+        if len(line[:begidx].split()) != 1:
+            return []
+        return self.cmd.service_index(self.user_id).names(text)
+
+    def _complete_nothing(self, text, line, begidx, endidx):
+        return []
+
+    complete_show_service = _complete_pair
+    complete_show_qr = _complete_pair
+    complete_remove_service = _complete_pair
+    complete_dashboard = _complete_name
+    complete_list_services = _complete_name
+    complete_search = _complete_name
+    complete_build_search_index = _complete_nothing
+    complete_regenerate_codes = _complete_nothing
+    complete_exit = _complete_nothing
+    complete_clear = _complete_nothing
+
+    def complete_add_service(self, text, line, begidx, endidx):
+        # Only the service can exist already, the username and seed are new.
+        if len(line[:begidx].split()) == 1:
+            return self.cmd.service_index(self.user_id).services(text)
+        return []
+
+    def complete_modify_service(self, text, line, begidx, endidx):
+        if len(line[:begidx].split()) == 3:
+            return [name for name in ("username", "seed") if name.startswith(text)]
+        return self._complete_pair(text, line, begidx, endidx)
+
+    def complete_export_qr(self, text, line, begidx, endidx):
+        args = line[:begidx].split()
+        if args[1:2] == ["--all"]:
+            if len(args) == 2:
+                return self._complete_path(text)
+            return [fmt for fmt in qr.FORMATS if fmt.startswith(text)]
+        if len(args) == 3:
+            return self._complete_path(text)
+        completions = self._complete_pair(text, line, begidx, endidx)
+        if len(args) == 1 and "--all".startswith(text):
+            completions = ["--all"] + completions
+        return completions
+
+    def complete_stats(self, text, line, begidx, endidx):
+        if len(line[:begidx].split()) != 1:
+            return []
+        return self._complete_path(text)
+
+    def _complete_path(self, text):
+        return [
+            path + os.sep if os.path.isdir(path) else path
+            for path in glob.glob(glob.escape(text) + "*")
+        ]
 
     def default(self, line: str) -> None:
         """
@@ -159,6 +354,98 @@ Welcome to vAUTH CLI TOOL v0.0.6. Enter 'exit' to exit at any time.
         self.stdout.write("x⸑x unknown syntax: %s\n" % line)
 
 
+def agent_client(parser, args):
+    """
+    Client side of 'vauth otp'
+    """
+    from vauth.agent import AgentClient
+
+    client = AgentClient(args.socket)
+    try:
+        if args.list:
+            services = client.list()
+            for service, username in services or []:
+                print(f"{service} {username}")
+            return
+        if args.service is None or args.username is None:
+            parser.error("service and username are required")
+        if args.qr:
+            uri = client.uri(args.service, args.username)
+            if uri:
+                print(qr.render_ascii(qr.matrix(uri)))
+            return
+        result = client.otp(args.service, args.username)
+        if isinstance(result, tuple):
+            print(result[0])
+    finally:
+        client.close()
+
+
+def non_negative(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is negative")
+    return number
+
+
+def dump_metrics(path: str) -> bool:
+    """
+    Writes the metrics to a Prometheus file, reporting an unwritable path
+    instead of raising
+    """
+    try:
+        METRICS.dump(path)
+    except OSError as error:
+        print(f">>CANNOT WRITE METRICS TO {path}: {error.strerror or error}")
+        return False
+    return True
+
+
+def open_storage():
+    """
+    Opens the vault file when it exists, None selects the SQLite database.
+    vauth.vault is only imported for an existing vault file.
+    Returns False when the vault cannot be opened.
+    """
+    if not os.path.exists(os.path.join(VAUTH_DIR, VAULT_FILE)):
+        return None
+    from vauth.vault import VaultError, VaultStorage
+
+    try:
+        return VaultStorage(VAUTH_DIR)
+    except VaultError as error:
+        print(f"vAUTH> {error}")
+        return False
+
+
+def convert_vault():
+    """
+    Copies vauth.db into a new vault file, which every command uses from then on
+    """
+    from vauth.database import Database
+    from vauth.vault import VaultError, VaultStorage, convert
+
+    if os.path.exists(os.path.join(VAUTH_DIR, VAULT_FILE)):
+        print(f"vAUTH> {os.path.join(VAUTH_DIR, VAULT_FILE)} already exists")
+        return
+    source = Database(VAUTH_DIR)
+    try:
+        target = VaultStorage(VAUTH_DIR)
+        try:
+            count = convert(source, target)
+        except BaseException as error:
+            target.close()
+            os.unlink(target.file)
+            if not isinstance(error, VaultError):
+                raise
+            print(f"vAUTH> {error}")
+            return
+        target.close()
+    finally:
+        source.close()
+    print(f"vAUTH> {count} services copied to {target.file}")
+
+
 def main():
     """
     Main function
@@ -178,6 +465,10 @@ def main():
         required=True,
         help="User ID",
     )
+    login_parser.add_argument(
+        "--metrics-file",
+        help="Write session metrics in the Prometheus text format on exit",
+    )
 
     recover_parser = subparsers.add_parser("recover", help="Recover account")
     recover_parser.add_argument(
@@ -186,6 +477,15 @@ def main():
         help="User ID",
     )
 
+    passwd_parser = subparsers.add_parser(
+        "passwd", help="Change the password and re-encrypt every service"
+    )
+    passwd_parser.add_argument(
+        "-u",
+        required=True,
+        help="User ID",
+    )
+
     remove_parser = subparsers.add_parser("remove", help="Remove account")
     remove_parser.add_argument(
         "-u",
@@ -193,9 +493,128 @@ def main():
         help="User ID",
     )
 
+    import_parser = subparsers.add_parser(
+        "import",
+        help="Import services from otpauth URIs, Google Authenticator,\nAegis or andOTP exports",
+    )
+    import_parser.add_argument(
+        "-u",
+        required=True,
+        help="User ID",
+    )
+    import_parser.add_argument(
+        "-f",
+        type=argparse.FileType("r", encoding="utf-8"),
+        default="-",
+        help="Export file, reads stdin when omitted or '-'",
+    )
+
+    export_parser = subparsers.add_parser(
+        "export", help="Export services to an encrypted archive"
+    )
+    export_parser.add_argument(
+        "-u",
+        required=True,
+        help="User ID",
+    )
+    export_parser.add_argument(
+        "-f",
+        type=argparse.FileType("wb"),
+        default="-",
+        help="Archive file, writes stdout when omitted or '-'",
+    )
+
+    restore_parser = subparsers.add_parser(
+        "restore", help="Restore services from an encrypted archive"
+    )
+    restore_parser.add_argument(
+        "-u",
+        required=True,
+        help="User ID",
+    )
+    restore_parser.add_argument(
+        "-f",
+        type=argparse.FileType("rb"),
+        default="-",
+        help="Archive file, reads stdin when omitted or '-'",
+    )
+
+    agent_parser = subparsers.add_parser(
+        "agent", help="Unlock once and serve codes to 'vauth otp' over a socket"
+    )
+    agent_parser.add_argument(
+        "-u",
+        required=True,
+        help="User ID",
+    )
+    agent_parser.add_argument(
+        "--socket",
+        help="Socket path, defaults to ~/.vauth/agent.sock",
+    )
+    agent_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=900,
+        help="Seconds without requests before the agent locks and exits",
+    )
+
+    otp_parser = subparsers.add_parser(
+        "otp", help="Get a code from a running agent, without a password"
+    )
+    otp_parser.add_argument("service", nargs="?", help="Service name")
+    otp_parser.add_argument("username", nargs="?", help="Username")
+    otp_parser.add_argument(
+        "--list", action="store_true", help="List the services of the vault"
+    )
+    otp_parser.add_argument(
+        "--qr", action="store_true", help="Show the QR code instead of the code"
+    )
+    otp_parser.add_argument(
+        "--socket",
+        help="Socket path, defaults to $VAUTH_AGENT_SOCK or ~/.vauth/agent.sock",
+    )
+
+    subparsers.add_parser(
+        "convert-vault", help="Copy the database to a single-file vault and use it"
+    )
+
+    verify_parser = subparsers.add_parser(
+        "verify-server", help="Serve code verification over local HTTP/JSON"
+    )
+    verify_parser.add_argument(
+        "-u",
+        required=True,
+        help="User ID",
+    )
+    verify_parser.add_argument("--host", default="127.0.0.1", help="Bind address")
+    verify_parser.add_argument("--port", type=int, default=8731, help="Bind port")
+    verify_parser.add_argument(
+        "--drift",
+        type=non_negative,
+        default=1,
+        help="Time steps accepted before and after the current one",
+    )
+    verify_parser.add_argument(
+        "--token-file",
+        default=os.path.join(VAUTH_DIR, "verify.token"),
+        help="File the bearer token is written to, removed on exit",
+    )
+
     args = parser.parse_args()
 
-    cmd = Commands()
+    if args.command == "otp":
+        # Answered by the agent, the database is never opened.
+        return agent_client(otp_parser, args)
+
+    if args.command == "convert-vault":
+        return convert_vault()
+
+    storage = open_storage()
+    if storage is False:
+        return
+    # The agent and the verification server look seeds up from many threads.
+    pooled = args.command in ("agent", "verify-server")
+    cmd = Commands(pooled=pooled, storage=storage)
 
     if args.command == "register":
         recovery_codes = cmd.register(args.u)
@@ -204,13 +623,80 @@ def main():
         key = cmd.login(args.u)
         if key is None:
             return
-        shell = VAuthShell(args.u, key)
-        shell.cmdloop()
+        shell = VAuthShell(args.u, key, cmd)
+        try:
+            shell.cmdloop()
+        finally:
+            cmd.logout()
+            if args.metrics_file:
+                dump_metrics(args.metrics_file)
+    elif args.command == "agent":
+        from vauth.agent import Agent
+
+        key = cmd.login(args.u)
+        if key is None:
+            return
+        Agent(cmd, args.u, key, args.socket, args.idle_timeout).serve()
+    elif args.command == "verify-server":
+        from vauth.verify import VerifyServer, write_token
+
+        key = cmd.login(args.u)
+        if key is None:
+            return
+        cmd.warm_up(args.u, key)
+        token = write_token(args.token_file)
+        try:
+            address = (args.host, args.port)
+            server = VerifyServer(cmd, key, address, token, args.drift)
+            print(f"vAUTH> Verifying on http://{args.host}:{args.port}/verify")
+            print(f"vAUTH> Bearer token written to {args.token_file}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+        finally:
+            cmd.logout()
+            if os.path.exists(args.token_file):
+                os.unlink(args.token_file)
     elif args.command == "recover":
         _key = cmd.recover(args.u)
-        print(f"vAUTH> Account recovered successfully")
+        if _key is not None:
+            print(f"vAUTH> Account recovered successfully")
+    elif args.command == "passwd":
+        cmd.change_password(args.u)
     elif args.command == "remove":
         cmd.remove_user(args.u)
+    elif args.command == "import":
+        key = cmd.login(args.u)
+        if key is None:
+            return
+        try:
+            cmd.import_services(args.u, key, args.f)
+        finally:
+            args.f.close()
+            cmd.logout()
+    elif args.command == "export":
+        key = cmd.login(args.u)
+        if key is None:
+            return
+        try:
+            count = cmd.export_services(args.u, key, args.f)
+        finally:
+            args.f.close()
+            cmd.logout()
+        if isinstance(count, int):
+            print(f">>{count} SERVICES EXPORTED", file=sys.stderr)
+    elif args.command == "restore":
+        key = cmd.login(args.u)
+        if key is None:
+            return
+        try:
+            cmd.restore_services(args.u, key, args.f)
+        finally:
+            args.f.close()
+            cmd.logout()
     else:
         parser.print_help()
 
@@ -0,0 +1,341 @@
+import asyncio
+import json
+import os
+import socket
+import struct
+
+from vauth.cache import SeedCache
+from vauth.commands import Commands
+from vauth.handlers import ErrorHandler
+
+FRAME = struct.Struct(">I")
+MAX_FRAME = 1024 * 1024
+SOCKET_ENV = "VAUTH_AGENT_SOCK"
+
+
+def default_socket_path() -> str:
+    """
+    Returns the agent socket, $VAUTH_AGENT_SOCK or ~/.vauth/agent.sock
+    """
+    return os.environ.get(SOCKET_ENV) or os.path.join(
+        os.path.expanduser("~"), ".vauth", "agent.sock"
+    )
+
+
+def encode_frame(message: dict) -> bytes:
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    return FRAME.pack(len(payload)) + payload
+
+
+class Agent:
+    """
+    Holds an unlocked session and serves codes over a Unix domain socket.
+    - The password is asked once, the session key and the decrypted seeds
+      stay in memory until the agent has been idle for idle_timeout seconds.
+    - The socket is created with 0600 permissions and clients running as
+      another user are refused where the peer credentials are available.
+    - Requests and responses are JSON objects, each framed by a u32 big endian
+      length. A connection can carry any number of requests.
+    - Requests are answered on the default executor, the commands must use a
+      pooled database.
+
+    Requests
+    --------
+    {"op": "otp", "service": str, "username": str}:
+        {"ok": true, "otp": str, "remaining": float}
+    {"op": "uri", "service": str, "username": str}:
+        {"ok": true, "uri": str}, the provisioning URI shown as a QR code
+    {"op": "list"}:
+        {"ok": true, "services": [[service, username], ...]}
+    {"op": "ping"}:
+        {"ok": true}
+    Failures return {"ok": false, "error": int | str}.
+
+    Methods
+    -------
+    serve() -> None:
+        Serves clients until the idle timeout expires
+    handle(request: dict) -> dict:
+        Answers a single request
+    """
+
+    def __init__(
+        self,
+        commands: Commands,
+        user_id: str,
+        key: str,
+        path: str | None = None,
+        idle_timeout: float = 900.0,
+    ) -> None:
+        self.commands = commands
+        self.user_id = user_id
+        self.key = key
+        if path is None and commands.db.path is None:
+            path = default_socket_path()
+        self.path = path or os.path.join(commands.db.path, "agent.sock")
+        self.idle_timeout = idle_timeout
+        self._last_request = 0.0
+
+    @ErrorHandler()
+    def serve(self) -> None:
+        """
+        Unlocks the session and serves clients until the idle timeout expires.
+        - Keep decrypted seeds for as long as the agent lives.
+        - Refuse to start when another agent answers on the socket.
+        - Wipe the session and remove the socket on exit.
+
+        Raises:
+            Exception: 112 - Agent already running.
+        """
+        if os.path.exists(self.path):
+            if _answers(self.path):
+                raise Exception(112)
+            os.unlink(self.path)
+        commands = self.commands
+        if not commands.enc.is_session_key(self.key):
+            commands.enc.unlock(self.key)
+        commands.seed_cache.clear()
+        commands.seed_cache = SeedCache(ttl=self.idle_timeout)
+        commands.warm_up(self.user_id, self.key)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            commands.logout()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def handle(self, request: dict) -> dict:
+        """
+        Answers a single request
+
+        Parameters
+        ----------
+        request : dict
+            Decoded request
+
+        Returns
+        -------
+        dict
+            Response
+        """
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "list":
+            services = [
+                [row.service, row.username]
+                for batch in self.commands.db.iter_services(self.user_id)
+                for row in batch
+            ]
+            return {"ok": True, "services": sorted(services)}
+        if op not in ("otp", "uri"):
+            return {"ok": False, "error": "unknown op"}
+        service, username = request.get("service"), request.get("username")
+        if not isinstance(service, str) or not isinstance(username, str):
+            return {"ok": False, "error": "service and username are required"}
+        commands = self.commands
+        # Errors are returned to the client, and nothing is ever deleted.
+        try:
+            if op == "uri":
+                import pyotp
+
+                seed = commands.lookup_seed(self.user_id, self.key, username, service)
+                totp = pyotp.TOTP(seed)
+                uri = totp.provisioning_uri(username, issuer_name=service)
+                return {"ok": True, "uri": uri}
+            otp, remaining = commands.current_code(
+                self.user_id, self.key, username, service
+            )
+        except Exception as e:
+            if e.args and isinstance(e.args[0], int):
+                return {"ok": False, "error": e.args[0]}
+            raise
+        return {"ok": True, "otp": otp, "remaining": remaining}
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._client, self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        print(f"{SOCKET_ENV}={self.path}; export {SOCKET_ENV};", flush=True)
+        self._last_request = loop.time()
+        async with server:
+            while True:
+                idle = loop.time() - self._last_request
+                if idle >= self.idle_timeout:
+                    break
+                await asyncio.sleep(self.idle_timeout - idle)
+
+    async def _client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            if not _same_user(writer.get_extra_info("socket")):
+                return
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME.size)
+                except asyncio.IncompleteReadError:
+                    return
+                (length,) = FRAME.unpack(header)
+                if length > MAX_FRAME:
+                    return
+                try:
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    return
+                except ValueError:
+                    request = None
+                self._last_request = loop.time()
+                if not isinstance(request, dict):
+                    response = {"ok": False, "error": "invalid request"}
+                else:
+                    try:
+                        # Lookups and decryption run off the event loop.
+                        response = await loop.run_in_executor(
+                            None, self.handle, request
+                        )
+                    except Exception as e:
+                        response = {"ok": False, "error": type(e).__name__}
+                writer.write(encode_frame(response))
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+class AgentClient:
+    """
+    Client of a running agent.
+    The connection is opened on the first request and reused by the next ones.
+
+    Methods
+    -------
+    otp(service: str, username: str) -> tuple[str, float]:
+        Returns the current code and the seconds it remains valid
+    uri(service: str, username: str) -> str:
+        Returns the provisioning URI of a service
+    list() -> list[tuple[str, str]]:
+        Returns the (service, username) pairs of the vault
+    close() -> None:
+        Closes the connection
+    """
+
+    def __init__(self, path: str | None = None, timeout: float = 5.0) -> None:
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self._sock = None
+
+    @ErrorHandler()
+    def otp(self, service: str, username: str) -> tuple[str, float]:
+        """
+        Returns the current code of a service
+
+        Raises:
+            Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
+            Exception: 105 - Invalid seed.
+            Exception: 111 - Agent not running.
+        """
+        response = self.request(
+            {"op": "otp", "service": service, "username": username}
+        )
+        return response["otp"], response["remaining"]
+
+    @ErrorHandler()
+    def uri(self, service: str, username: str) -> str:
+        """
+        Returns the provisioning URI of a service
+
+        Raises:
+            Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
+            Exception: 111 - Agent not running.
+        """
+        response = self.request(
+            {"op": "uri", "service": service, "username": username}
+        )
+        return response["uri"]
+
+    @ErrorHandler()
+    def list(self) -> list[tuple[str, str]]:
+        """
+        Returns the (service, username) pairs of the vault
+
+        Raises:
+            Exception: 111 - Agent not running.
+        """
+        return [tuple(pair) for pair in self.request({"op": "list"})["services"]]
+
+    def request(self, message: dict) -> dict:
+        """
+        Sends a request and waits for the response
+
+        Parameters
+        ----------
+        message : dict
+            Request
+
+        Returns
+        -------
+        dict
+            Successful response
+
+        Raises
+        ------
+        Exception
+            111 when the agent cannot be reached, the error of the response
+            when it failed
+        """
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.settimeout(self.timeout)
+                self._sock.connect(self.path)
+            self._sock.sendall(encode_frame(message))
+            (length,) = FRAME.unpack(self._recv(FRAME.size))
+            response = json.loads(self._recv(length))
+        except (OSError, AttributeError):
+            # AttributeError: AF_UNIX is not available on this platform.
+            self.close()
+            raise Exception(111)
+        if not response.get("ok"):
+            raise Exception(response.get("error"))
+        return response
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _recv(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionResetError("agent closed the connection")
+            data += chunk
+        return bytes(data)
+
+
+def _answers(path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def _same_user(sock) -> bool:
+    if sock is None or not hasattr(socket, "SO_PEERCRED"):
+        return True
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid == os.getuid()
@@ -0,0 +1,313 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, BinaryIO, TextIO
+
+from vauth.commands import Commands
+from vauth.database import Database
+from vauth.storage import Storage
+
+
+class AsyncDatabase:
+    """
+    asyncio front end of a pooled Database.
+    - Every call runs on a bounded thread pool, the event loop never blocks
+      on SQLite.
+    - At most max_workers calls are queued on the pool, the others wait in
+      the event loop where cancelling them is free.
+    - Cancelling a running call abandons its result, the statement itself
+      completes on its thread.
+
+    Methods
+    -------
+    run(func: Callable, *args, **kwargs) -> Any:
+        Runs a blocking function on the pool
+    iter_services(user_id: str, batch_size: int = 500) -> AsyncIterator[list]:
+        Streams the service records of a user in batches
+    close() -> None:
+        Waits for the running calls and closes the database
+    The other methods mirror Database.
+    """
+
+    def __init__(self, db: Storage, max_workers: int = 4) -> None:
+        if not db.pooled:
+            raise ValueError("AsyncDatabase needs a Database opened with pooled=True")
+        self.db = db
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="vauth-aio"
+        )
+        self._slots = asyncio.Semaphore(max_workers)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs a blocking function on the pool
+
+        Parameters
+        ----------
+        func : Callable
+            Blocking function
+        *args, **kwargs
+            Its arguments
+
+        Returns
+        -------
+        Any
+            Its result
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def insert_one(self, data, table_name: str) -> None:
+        await self.run(self.db.insert_one, data, table_name)
+
+    async def insert_many(self, data: list[Database.ServiceData]) -> None:
+        await self.run(self.db.insert_many, data)
+
+    async def find_service(
+        self, user_id: str, username: str, service: str
+    ) -> Database.ServiceData | None:
+        return await self.run(self.db.find_service, user_id, username, service)
+
+    async def service_keys(self, user_id: str) -> set[tuple[str, str]]:
+        return await self.run(self.db.service_keys, user_id)
+
+    async def find_auth(
+        self, user_id: str, key: str, mode="key"
+    ) -> Database.AuthData | None:
+        return await self.run(self.db.find_auth, user_id, key, mode)
+
+    async def find_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        return await self.run(self.db.find_recovery_code, user_id, code_hash)
+
+    async def consume_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        return await self.run(self.db.consume_recovery_code, user_id, code_hash)
+
+    async def replace_recovery_codes(
+        self, user_id: str, code_hashes: list[str]
+    ) -> None:
+        await self.run(self.db.replace_recovery_codes, user_id, code_hashes)
+
+    async def update_key(self, user_id: str, key: str) -> None:
+        await self.run(self.db.update_key, user_id, key)
+
+    async def delete_service(self, user_id: str, service: str) -> None:
+        await self.run(self.db.delete_service, user_id, service)
+
+    async def delete_auth(self, user_id: str) -> None:
+        await self.run(self.db.delete_auth, user_id)
+
+    async def update_service(
+        self, user_id: str, service: str, data: Database.ServiceData
+    ) -> None:
+        await self.run(self.db.update_service, user_id, service, data)
+
+    async def is_registered(self) -> bool:
+        return await self.run(self.db.is_registered)
+
+    async def iter_services(
+        self, user_id: str, batch_size: int = 500
+    ) -> AsyncIterator[list[Database.ServiceData]]:
+        """
+        Streams the service records of a user in batches.
+        Each batch is a separate page query, so no cursor is held between
+        batches and the iteration can stop or be cancelled at any point.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        batch_size : int
+            Number of records per batch
+
+        Yields
+        ------
+        list[ServiceData]
+            Service records, in (service, username) order
+        """
+        after = None
+        while True:
+            batch = await self.run(self.db.page_services, user_id, after, batch_size)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].service, batch[-1].username)
+
+    async def close(self) -> None:
+        """
+        Waits for the running calls, then closes the database
+        """
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True)
+        )
+        self.db.close()
+
+
+class AsyncCommands:
+    """
+    asyncio front end of Commands for embedding vAUTH in asyncio services.
+    - SQLite and Fernet work runs on the bounded pool of an AsyncDatabase,
+      through the same Commands methods, so validation, error codes and
+      ErrorHandler messages are the same as in the CLI.
+    - show_service() deletes a service with an invalid seed, so code
+      generation runs on the pool as well.
+    - login() takes the password as an argument instead of prompting for it.
+    - storage is passed to Commands, it must be safe to share between threads.
+
+    Usage
+    -----
+    async with AsyncCommands() as vauth:
+        key = await vauth.login(user_id, password)
+        seed = await vauth.find_seed(user_id, key, username, service)
+        otp, remaining = await vauth.show_service(seed, user_id, service)
+        async for batch in vauth.iter_services(user_id):
+            ...
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        max_workers: int = 4,
+        storage: Storage | None = None,
+    ) -> None:
+        self.commands = Commands(path, pooled=True, storage=storage)
+        self.db = AsyncDatabase(self.commands.db, max_workers)
+
+    async def __aenter__(self) -> "AsyncCommands":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def login(self, user_id: str, key: str) -> str | None:
+        return await self.db.run(self.commands.unlock, user_id, key)
+
+    async def logout(self) -> None:
+        await self.db.run(self.commands.logout)
+
+    async def rotate_key(
+        self, user_id: str, old_key: str, new_key: str, workers: int = 2
+    ) -> int | None:
+        return await self.db.run(
+            self.commands.rotate_key, user_id, old_key, new_key, workers
+        )
+
+    async def warm_up(self, user_id: str, key: str, workers: int = 2) -> None:
+        await self.db.run(self.commands.warm_up, user_id, key, workers)
+
+    async def add_service(
+        self, user_id: str, key: str, username: str, service: str, seed: str
+    ) -> None:
+        await self.db.run(
+            self.commands.add_service, user_id, key, username, service, seed
+        )
+
+    async def find_seed(
+        self, user_id: str, key: str, username: str, service: str
+    ) -> str | None:
+        return await self.db.run(
+            self.commands.find_seed, user_id, key, username, service
+        )
+
+    async def find_seeds(
+        self, user_id: str, key: str, pattern: str | None = None
+    ) -> dict[tuple[str, str], str] | None:
+        return await self.db.run(self.commands.find_seeds, user_id, key, pattern)
+
+    async def modify_service(
+        self,
+        user_id: str,
+        key: str,
+        username: str,
+        service: str,
+        type: str,
+        new_value: str,
+    ) -> None:
+        await self.db.run(
+            self.commands.modify_service,
+            user_id,
+            key,
+            username,
+            service,
+            type,
+            new_value,
+        )
+
+    async def remove_service(self, user_id: str, username: str, service: str) -> None:
+        await self.db.run(self.commands.remove_service, user_id, username, service)
+
+    async def list_services(
+        self, user_id: str, prefix: str | None = None
+    ) -> list[tuple[str, str]] | None:
+        return await self.db.run(self.commands.list_services, user_id, prefix)
+
+    async def search_services(
+        self, user_id: str, query: str, limit: int = 50
+    ) -> list[tuple[str, str]] | None:
+        return await self.db.run(
+            self.commands.search_services, user_id, query, limit
+        )
+
+    async def verify(
+        self,
+        key: str,
+        checks: list[tuple[str, str, str, str]],
+        drift: int = 1,
+        now: float | None = None,
+    ) -> list[bool] | None:
+        return await self.db.run(self.commands.verify, key, checks, drift, now)
+
+    async def import_services(
+        self, user_id: str, key: str, stream: TextIO, batch_size: int = 500
+    ) -> dict | None:
+        return await self.db.run(
+            self.commands.import_services, user_id, key, stream, batch_size
+        )
+
+    async def export_services(
+        self, user_id: str, key: str, stream: BinaryIO, passphrase: str
+    ) -> int | None:
+        return await self.db.run(
+            self.commands.export_services, user_id, key, stream, passphrase
+        )
+
+    async def show_service(
+        self, seed: str, user_id: str, service: str
+    ) -> tuple | None:
+        return await self.db.run(self.commands.show_service, seed, user_id, service)
+
+    async def show_services(self, seeds: dict) -> dict | None:
+        return await self.db.run(self.commands.show_services, seeds)
+
+    async def iter_services(
+        self, user_id: str, batch_size: int = 500
+    ) -> AsyncIterator[list[tuple[str, str]]]:
+        """
+        Streams the (service, username) pairs of a user in batches, seeds stay
+        encrypted in the database
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        batch_size : int
+            Number of services per batch
+
+        Yields
+        ------
+        list[tuple[str, str]]
+            (service, username) pairs, in that order
+        """
+        async for batch in self.db.iter_services(user_id, batch_size):
+            yield [(row.service, row.username) for row in batch]
+
+    async def close(self) -> None:
+        """
+        Ends the session and closes the database
+        """
+        await self.logout()
+        await self.db.close()
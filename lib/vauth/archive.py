@@ -0,0 +1,218 @@
+import base64
+import hashlib
+import json
+import os
+import struct
+from typing import BinaryIO, Iterator
+
+
+class ArchiveError(Exception):
+    """
+    Raised when an archive is corrupted, truncated or the passphrase is wrong
+    """
+
+
+class Archive:
+    """
+    Streaming, chunked and authenticated vault archive.
+
+    Layout
+    ------
+    header:
+        MAGIC, format version (u8), scrypt log2(n), r, p (u8 each), salt (16 bytes)
+    chunks:
+        length (u32, big endian) followed by a Fernet token.
+        Each token holds {"index": int, "rows": list, "end": bool, "count": int}.
+        Indexes are sequential and the last chunk has "end" set, so reordered,
+        dropped or truncated chunks are detected.
+
+    The archive key is derived from the export passphrase with scrypt and is
+    unrelated to the vault password.
+    """
+
+    MAGIC = b"VAUTHARC"
+    VERSION = 1
+    SALT_SIZE = 16
+    HEADER = struct.Struct(">8sBBBB16s")
+    LENGTH = struct.Struct(">I")
+
+    def __init__(
+        self, passphrase: str, salt: bytes, log_n: int = 15, r: int = 8, p: int = 1
+    ) -> None:
+        self.salt = salt
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+        from cryptography.fernet import Fernet
+
+        key = hashlib.scrypt(
+            passphrase.encode(),
+            salt=salt,
+            n=2**log_n,
+            r=r,
+            p=p,
+            maxmem=256 * r * 2**log_n,
+            dklen=32,
+        )
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+
+    @property
+    def header(self) -> bytes:
+        return self.HEADER.pack(
+            self.MAGIC, self.VERSION, self.log_n, self.r, self.p, self.salt
+        )
+
+    def seal(
+        self, index: int, rows: list[dict], end: bool = False, count: int = 0
+    ) -> bytes:
+        """
+        Encrypts a chunk, safe to call from worker threads
+
+        Parameters
+        ----------
+        index : int
+            Position of the chunk in the archive
+        rows : list[dict]
+            Decrypted services
+        end : bool
+            Whether this is the final chunk
+        count : int
+            Total number of services, only meaningful on the final chunk
+
+        Returns
+        -------
+        bytes
+            Length-prefixed chunk
+        """
+        payload = json.dumps(
+            {"index": index, "rows": rows, "end": end, "count": count},
+            separators=(",", ":"),
+        ).encode()
+        token = self._fernet.encrypt(payload)
+        return self.LENGTH.pack(len(token)) + token
+
+    def open(self, token: bytes) -> dict:
+        """
+        Decrypts and authenticates a chunk
+
+        Parameters
+        ----------
+        token : bytes
+            Fernet token of the chunk
+
+        Returns
+        -------
+        dict
+            Chunk payload
+
+        Raises
+        ------
+        ArchiveError
+            If the chunk cannot be authenticated
+        """
+        from cryptography.fernet import InvalidToken
+
+        try:
+            return json.loads(self._fernet.decrypt(token))
+        except (InvalidToken, ValueError):
+            raise ArchiveError("chunk cannot be authenticated")
+
+
+class ArchiveWriter:
+    """
+    Writes an archive chunk by chunk
+
+    Methods
+    -------
+    seal(index: int, rows: list[dict]) -> bytes:
+        Encrypts a chunk, safe to call from worker threads
+    write(chunk: bytes, rows: int) -> None:
+        Writes a sealed chunk
+    close() -> None:
+        Writes the final chunk
+    """
+
+    def __init__(self, stream: BinaryIO, passphrase: str) -> None:
+        self.stream = stream
+        self.archive = Archive(passphrase, os.urandom(Archive.SALT_SIZE))
+        self.count = 0
+        self._index = 0
+        self.stream.write(self.archive.header)
+
+    def seal(self, index: int, rows: list[dict]) -> bytes:
+        return self.archive.seal(index, rows)
+
+    def write(self, chunk: bytes, rows: int) -> None:
+        """
+        Writes a sealed chunk, chunks must be written in index order
+
+        Parameters
+        ----------
+        chunk : bytes
+            Chunk returned by seal()
+        rows : int
+            Number of services in the chunk
+        """
+        self.stream.write(chunk)
+        self.count += rows
+        self._index += 1
+
+    def close(self) -> None:
+        """
+        Writes the final chunk and flushes the stream
+        """
+        self.stream.write(
+            self.archive.seal(self._index, [], end=True, count=self.count)
+        )
+        self.stream.flush()
+
+
+def read_archive(stream: BinaryIO, passphrase: str) -> Iterator[list[dict]]:
+    """
+    Reads an archive incrementally
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        Archive file or stdin
+    passphrase : str
+        Export passphrase
+
+    Yields
+    ------
+    list[dict]
+        Decrypted services of each chunk
+
+    Raises
+    ------
+    ArchiveError
+        If the archive is corrupted, truncated or the passphrase is wrong
+    """
+    header = stream.read(Archive.HEADER.size)
+    if len(header) != Archive.HEADER.size:
+        raise ArchiveError("not a vAUTH archive")
+    magic, version, log_n, r, p, salt = Archive.HEADER.unpack(header)
+    if magic != Archive.MAGIC or version != Archive.VERSION:
+        raise ArchiveError("not a vAUTH archive")
+    if not 10 <= log_n <= 20 or not 1 <= r <= 16 or not 1 <= p <= 4:
+        raise ArchiveError("unsupported key derivation parameters")
+    archive = Archive(passphrase, salt, log_n, r, p)
+    index = count = 0
+    while True:
+        length = stream.read(Archive.LENGTH.size)
+        if len(length) != Archive.LENGTH.size:
+            raise ArchiveError("archive is truncated")
+        (size,) = Archive.LENGTH.unpack(length)
+        token = stream.read(size)
+        if len(token) != size:
+            raise ArchiveError("archive is truncated")
+        chunk = archive.open(token)
+        if chunk["index"] != index:
+            raise ArchiveError("archive chunks are out of order")
+        if chunk["end"]:
+            if chunk["count"] != count:
+                raise ArchiveError("archive is incomplete")
+            return
+        index += 1
+        count += len(chunk["rows"])
+        yield chunk["rows"]
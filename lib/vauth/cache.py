@@ -0,0 +1,130 @@
+import collections
+import threading
+import time
+
+
+class SeedCache:
+    """
+    Bounded cache of decrypted seeds keyed by (user_id, service, username).
+    - Entries are evicted least recently used first once max_size is reached.
+    - Entries idle for longer than ttl seconds are evicted on access.
+    - Seeds are held in bytearrays that are zeroed when they leave the cache.
+      The str handed out by get() is a copy that cannot be wiped.
+
+    Methods
+    -------
+    get(key: tuple[str, str, str]) -> str | None:
+        Returns a cached seed
+    put(key: tuple[str, str, str], seed: str) -> None:
+        Caches a seed
+    invalidate(key: tuple[str, str, str]) -> None:
+        Evicts a single entry
+    invalidate_service(user_id: str, service: str) -> None:
+        Evicts every username of a service
+    clear() -> None:
+        Evicts every entry
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 300.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: tuple[str, str, str]) -> bool:
+        return key in self._entries
+
+    def get(self, key: tuple[str, str, str]) -> str | None:
+        """
+        Returns a cached seed and marks it as recently used
+
+        Parameters
+        ----------
+        key : tuple[str, str, str]
+            (user_id, service, username)
+
+        Returns
+        -------
+        str | None
+            Seed, None if it is not cached or has expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            seed, last_used = entry
+            if now - last_used > self.ttl:
+                self._evict(key)
+                return None
+            self._entries[key] = (seed, now)
+            self._entries.move_to_end(key)
+            return seed.decode()
+
+    def put(self, key: tuple[str, str, str], seed: str) -> None:
+        """
+        Caches a seed, evicting expired and least recently used entries
+
+        Parameters
+        ----------
+        key : tuple[str, str, str]
+            (user_id, service, username)
+        seed : str
+            Decrypted seed
+        """
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            while self._entries:
+                oldest, (_, last_used) = next(iter(self._entries.items()))
+                if now - last_used <= self.ttl and len(self._entries) < self.max_size:
+                    break
+                self._evict(oldest)
+            if self.max_size > 0:
+                self._entries[key] = (bytearray(seed.encode()), now)
+
+    def invalidate(self, key: tuple[str, str, str]) -> None:
+        """
+        Evicts a single entry
+
+        Parameters
+        ----------
+        key : tuple[str, str, str]
+            (user_id, service, username)
+        """
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def invalidate_service(self, user_id: str, service: str) -> None:
+        """
+        Evicts every username of a service
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        service : str
+            Service name
+        """
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == user_id and k[1] == service]
+            for key in keys:
+                self._evict(key)
+
+    def clear(self) -> None:
+        """
+        Evicts and zeroes every entry
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def _evict(self, key: tuple[str, str, str]) -> None:
+        seed, _ = self._entries.pop(key)
+        for i in range(len(seed)):
+            seed[i] = 0
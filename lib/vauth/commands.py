@@ -1,12 +1,26 @@
 import base64
-import datetime
+import collections
+import fnmatch
 import getpass
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, BinaryIO, TextIO
 
-import pyotp
-from qrcode.main import QRCode
+from vauth import qr
+from vauth.archive import ArchiveError, ArchiveWriter, read_archive
+from vauth.cache import SeedCache
 from vauth.database import Database as db
 from vauth.encryption import Encryption as enc
 from vauth.handlers import ErrorHandler
+from vauth.otp import OTPEngine
+from vauth.search import ServiceIndex
+
+if TYPE_CHECKING:
+    from vauth.prefetch import Prefetcher
+    from vauth.storage import Storage
+    from vauth.verify import Verifier
 
 
 class Commands:
@@ -14,17 +28,47 @@ class Commands:
     vAUTH Commands Class.
     - Handles all the commands for vAUTH.
 
+    Args:
+        path (str | None): Directory of the database, defaults to ~/.vauth.
+        pooled (bool): Share the database between threads, see Database.
+        storage (Storage | None): Vault store to use instead of the SQLite
+            database at path, such as a MemoryStorage.
+
     Attributes:
-        db (Database): Database Object.
+        db (Storage): Database Object.
         enc (Encryption): Encryption Object.
         error_handler (ErrorHandler): Error Handler Object.
+        otp (OTPEngine): Batched TOTP Engine.
+        seed_cache (SeedCache): Decrypted Seed Cache.
+        qr_cache (MatrixCache): QR Code Matrices of the Session.
+        prefetcher (Prefetcher | None): Background Warm-up of the Session.
+        verifier (Verifier | None): Expected Codes and Replay Cache of verify().
+        index (ServiceIndex | None): Service Names of the Session, for Search.
         login_state (str): Login State.
     """
 
-    def __init__(self):
-        self.db = db()
+    def __init__(
+        self,
+        path: str | None = None,
+        pooled: bool = False,
+        storage: "Storage | None" = None,
+    ):
+        if storage is not None:
+            self.db = storage
+        elif path is None:
+            self.db = db(pooled=pooled)
+        else:
+            self.db = db(path, pooled=pooled)
         self.enc = enc()
         self.error_handler = ErrorHandler()
+        self.otp = OTPEngine()
+        self.seed_cache = SeedCache()
+        self.qr_cache = qr.MatrixCache()
+        self.prefetcher = None
+        self.verifier = None
+        self._verifier_lock = threading.Lock()
+        self.index = None
+        self._index_user = None
         if self.db.is_registered():
             self.login_state = "login"
         else:
@@ -45,11 +89,117 @@ class Commands:
             Exception: 100 - Invalid Password
         """
         key = getpass.getpass("vAUTH> Enter Password: ")
+        return self.unlock(user_id, key)
+
+    @ErrorHandler()
+    def unlock(self, user_id: str, key: str) -> str:
+        """
+        Start a session with a password, without prompting for it.
+        - Check the password.
+        - Derive the session key.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+
+        Returns:
+            str: Password
+
+        Raises:
+            Exception: 100 - Invalid Password
+            Exception: 114 - Password change interrupted
+        """
         auth_data = self.db.find_auth(user_id, self.enc.hash_key(key.encode()))
         if auth_data:
+            if self.db.find_rotation(user_id) is not None:
+                # Part of the seeds still needs the previous password.
+                raise Exception(114)
+            self.enc.unlock(key)
             return key
         raise Exception(100)
 
+    def logout(self) -> None:
+        """
+        End the session.
+        - Stop the warm-up.
+        - Wipe the session key.
+        - Wipe the cached seeds and QR codes.
+        - Drop the service index.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        self.enc.lock()
+        self.seed_cache.clear()
+        self.qr_cache.clear()
+        self.otp.clear()
+        if self.verifier is not None:
+            self.verifier.clear()
+        self.index = None
+        self._index_user = None
+
+    def warm_up(self, user_id: str, key: str, workers: int = 2) -> "Prefetcher":
+        """
+        Start warming the session up in the background.
+        - Load the service metadata on a separate connection.
+        - Decrypt seeds into the seed cache on a thread pool.
+        - Lookups of an entry being prefetched wait for that entry only.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password, must be the session key
+            workers (int): Number of decryption worker threads
+
+        Returns:
+            Prefetcher: Running warm-up
+        """
+        from vauth.prefetch import Prefetcher
+
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        self.prefetcher = Prefetcher(
+            self.db, self.enc, self.seed_cache, user_id, key, workers
+        )
+        self.prefetcher.start()
+        return self.prefetcher
+
+    def _invalidate_service(self, user_id: str, service: str) -> None:
+        if self.prefetcher is not None:
+            self.prefetcher.invalidate_service(user_id, service)
+        self.seed_cache.invalidate_service(user_id, service)
+        self.qr_cache.invalidate_service(user_id, service)
+
+    def _decrypt_many(self, rows: list, key: str) -> list:
+        # A seed the key cannot decrypt was stored under another password,
+        # typically before a recovery.
+        from cryptography.fernet import InvalidToken
+
+        try:
+            return self.enc.decrypt_many(rows, key)
+        except InvalidToken:
+            raise Exception(115)
+
+    def service_index(self, user_id: str) -> ServiceIndex:
+        """
+        Return the service index of a user.
+        - Load the (service, username) pairs once per session.
+        - Add, modify, remove and import keep it up to date afterwards.
+
+        Args:
+            user_id (str): User ID
+
+        Returns:
+            ServiceIndex: Prefix index over service names and usernames
+        """
+        if self.index is None or self._index_user != user_id:
+            self.index = ServiceIndex(self.db.service_keys(user_id))
+            self._index_user = user_id
+        return self.index
+
+    def _loaded_index(self, user_id: str) -> ServiceIndex | None:
+        # Indexes that were never loaded are built from the database later.
+        return self.index if self._index_user == user_id else None
+
     @ErrorHandler()
     def register(self, user_id: str) -> tuple:
         """
@@ -89,7 +239,9 @@ class Commands:
         """
         Recover a user's password.
         - Check if the recovery code is valid.
-        - Update the password hash.
+        - Warn that the stored seeds cannot be decrypted with the new password,
+          and ask for a confirmation when there are any.
+        - Consume the recovery code and update the password hash together.
 
         Args:
             user_id (str): User ID of the account to recover.
@@ -100,16 +252,167 @@ class Commands:
         Raises:
             Exception: 101 - Invalid Recovery Code
             Exception: 108 - Passwords do not match
+            Exception: 116 - Recovery cancelled
         """
-        recovery_code = getpass.getpass("vAUTH> Enter Recovery Code: ")
-        if self.db.find_recovery_code(user_id, recovery_code):
-            key_1 = getpass.getpass("vAUTH> Create a New Password: ")
-            key_2 = getpass.getpass("vAUTH> Confirm New Password: ")
-            if key_1 != key_2:
-                raise Exception(108)
+        recovery_code = getpass.getpass("vAUTH> Enter Recovery Code: ").strip()
+        code_hash = self.enc.hash_key(recovery_code.encode())
+        if not self.db.find_recovery_code(user_id, code_hash):
+            raise Exception(101)
+        count = len(self.db.service_keys(user_id))
+        if count:
+            noun = "service" if count == 1 else "services"
+            print(
+                f"vAUTH> {count} stored {noun} can only be decrypted with the current "
+                "password and will become unreadable. Run 'vauth passwd' instead "
+                "if you still know it."
+            )
+            if input("vAUTH> Type 'yes' to continue: ").strip().lower() != "yes":
+                raise Exception(116)
+        key_1 = getpass.getpass("vAUTH> Create a New Password: ")
+        key_2 = getpass.getpass("vAUTH> Confirm New Password: ")
+        if key_1 != key_2:
+            raise Exception(108)
+        with self.db.transaction():
+            # The code may have been used since it was checked.
+            if not self.db.consume_recovery_code(user_id, code_hash):
+                raise Exception(101)
             self.db.update_key(user_id, self.enc.hash_key(key_1.encode()))
-            return key_1
-        raise Exception(101)
+        return key_1
+
+    @ErrorHandler()
+    def regenerate_recovery_codes(self, user_id: str, key: str) -> tuple:
+        """
+        Replace every recovery code of a user with a new set.
+        - Check the password.
+        - Store the new hashes in a single transaction, the old codes stop
+          working at once.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+
+        Returns:
+            tuple: Recovery Codes
+
+        Raises:
+            Exception: 100 - Invalid Password
+        """
+        if not self.db.find_auth(user_id, self.enc.hash_key(key.encode())):
+            raise Exception(100)
+        recovery_codes = self.enc.generate_recovery_codes()
+        self.db.replace_recovery_codes(
+            user_id, [self.enc.hash_key(code.encode()) for code in recovery_codes]
+        )
+        return recovery_codes
+
+    @ErrorHandler()
+    def change_password(self, user_id: str) -> str:
+        """
+        Change a user's password and re-encrypt every seed with it.
+        - Prompt for the current and the new password.
+        - Resume the previous change if it was interrupted, with the same
+          passwords.
+
+        Args:
+            user_id (str): User ID
+
+        Returns:
+            str: New Password
+
+        Raises:
+            Exception: 100 - Invalid Password
+            Exception: 108 - Passwords do not match
+        """
+        old_key = getpass.getpass("vAUTH> Enter Current Password: ")
+        key_1 = getpass.getpass("vAUTH> Create a New Password: ")
+        key_2 = getpass.getpass("vAUTH> Confirm New Password: ")
+        if key_1 != key_2:
+            raise Exception(108)
+        rotated = self.rotate_key(user_id, old_key, key_1)
+        if rotated is None:
+            return None
+        print(f">>PASSWORD CHANGED, {rotated} SERVICES RE-ENCRYPTED")
+        return key_1
+
+    @ErrorHandler()
+    def rotate_key(
+        self,
+        user_id: str,
+        old_key: str,
+        new_key: str,
+        workers: int = 2,
+        batch_size: int = 1000,
+    ) -> int:
+        """
+        Re-encrypt every seed of a user with a new password.
+        - Switch the password hash and record a checkpoint in one transaction.
+        - Read the services page by page and re-encrypt the pages on a thread
+          pool while earlier pages are written.
+        - Write each page in its own transaction together with the checkpoint,
+          an interrupted change resumes after the last written page.
+        - Both passwords decrypt the seeds of the session until it is done.
+
+        Args:
+            user_id (str): User ID
+            old_key (str): Current Password
+            new_key (str): New Password
+            workers (int): Number of worker threads
+            batch_size (int): Number of services per page
+
+        Returns:
+            int: Number of services re-encrypted, over every attempt
+
+        Raises:
+            Exception: 100 - Invalid Password
+        """
+        old_hash = self.enc.hash_key(old_key.encode())
+        new_hash = self.enc.hash_key(new_key.encode())
+        rotation = self.db.find_rotation(user_id)
+        if rotation is None:
+            if not self.db.find_auth(user_id, old_hash):
+                raise Exception(100)
+            self.db.start_rotation(user_id, old_hash, new_hash)
+            after, rotated = None, 0
+        else:
+            if (rotation.old_key, rotation.new_key) != (old_hash, new_hash):
+                raise Exception(100)
+            after, rotated = None, rotation.rotated
+            if rotation.after_service is not None:
+                after = (rotation.after_service, rotation.after_username)
+            print(f">>RESUMING PASSWORD CHANGE AFTER {rotated} SERVICES")
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        self.enc.unlock(new_key, previous=old_key)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        pending = collections.deque()
+
+        def write_next() -> None:
+            nonlocal rotated
+            rows = pending.popleft().result()
+            rotated += len(rows)
+            self.db.rotate_batch(user_id, rows, rotated)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                page = self.db.page_services(user_id, after, batch_size)
+                if not page:
+                    break
+                after = (page[-1].service, page[-1].username)
+                pending.append(
+                    executor.submit(self.enc.rotate_many, page, old_key, new_key)
+                )
+                if len(pending) >= 2 * workers:
+                    write_next()
+                if len(page) < batch_size:
+                    break
+            while pending:
+                write_next()
+        self.db.finish_rotation(user_id)
+        self.enc.unlock(new_key)
+        return rotated
 
     @ErrorHandler()
     def remove_user(self, user_id: str) -> None:
@@ -141,9 +444,9 @@ class Commands:
     ) -> None:
         """
         Add a new service to the user's account.
-        - Check if the service already exists.
         - Check if the seed is valid.
         - Encrypt and store the service data.
+        - The UNIQUE index rejects a service that already exists.
 
         Args:
             user_id (str): User ID
@@ -159,8 +462,6 @@ class Commands:
             Exception: 107 - Service already exists
             Exception: 105 - Invalid Seed
         """
-        if self.db.find_service(user_id, username, service):
-            raise Exception(107)
         try:
             base64.b32decode(seed, casefold=True)
         except Exception:
@@ -171,18 +472,230 @@ class Commands:
             "service": service,
             "seed": seed,
         }
-        self.db.insert_one(
-            self.enc.encrypt_data(data, key),
-            self.db.service_table,
-        )
+        try:
+            self.db.insert_one(
+                self.enc.encrypt_data(data, key),
+                self.db.service_table,
+            )
+        except sqlite3.IntegrityError:
+            raise Exception(107)
+        index = self._loaded_index(user_id)
+        if index is not None:
+            index.add(service, username)
         print(">>SERVICE ADDED")
 
+    @ErrorHandler()
+    def import_services(
+        self,
+        user_id: str,
+        key: str,
+        stream: TextIO,
+        batch_size: int = 500,
+        workers: int = 4,
+    ) -> dict:
+        """
+        Import services from an authenticator export.
+        - Stream otpauth URIs, otpauth-migration payloads or Aegis/andOTP JSON.
+        - Validate the seeds of each batch and skip services that already exist.
+        - Encrypt each batch on a worker pool and insert it with executemany.
+        - Insert every batch inside one transaction.
+        - Report failed records without stopping the import.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+            stream (TextIO): Export file or stdin
+            batch_size (int): Number of records per batch
+            workers (int): Number of encryption worker threads
+
+        Returns:
+            dict: Number of imported services and the (position, reason) failures
+
+        Raises:
+            Exception: 109 - Invalid Import File
+        """
+        from vauth.importers import iter_records
+
+        existing = self.db.service_keys(user_id)
+        imported = 0
+        failed = []
+        batch = []
+        try:
+            with self.db.transaction():
+                for position, record, error in iter_records(stream):
+                    if error:
+                        failed.append((position, error))
+                        continue
+                    batch.append((position, record))
+                    if len(batch) >= batch_size:
+                        imported += self._import_batch(
+                            user_id, key, batch, existing, failed, workers
+                        )
+                        batch = []
+                imported += self._import_batch(
+                    user_id, key, batch, existing, failed, workers
+                )
+        except ValueError:
+            raise Exception(109)
+        for position, reason in failed:
+            print(f">>{position.upper()}: {reason.upper()}")
+        print(f">>{imported} SERVICES IMPORTED, {len(failed)} FAILED")
+        return {"imported": imported, "failed": failed}
+
+    @ErrorHandler()
+    def export_services(
+        self,
+        user_id: str,
+        key: str,
+        stream: BinaryIO,
+        passphrase: str | None = None,
+        batch_size: int = 500,
+        workers: int = 4,
+    ) -> int:
+        """
+        Export every service of the user to an encrypted archive.
+        - Stream the services table in batches instead of loading it at once.
+        - Decrypt each batch and re-encrypt it under the export passphrase
+          on worker threads.
+        - Write the chunks in order, keeping at most 2 * workers in flight.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+            stream (BinaryIO): Archive file or stdout
+            passphrase (str | None): Export passphrase, prompted when None
+            batch_size (int): Number of services per chunk
+            workers (int): Number of worker threads
+
+        Returns:
+            int: Number of exported services
+
+        Raises:
+            Exception: 108 - Passwords do not match
+            Exception: 115 - Seed encrypted under a previous password.
+        """
+        if passphrase is None:
+            passphrase = getpass.getpass("vAUTH> Create an Export Passphrase: ")
+            if passphrase != getpass.getpass("vAUTH> Confirm Export Passphrase: "):
+                raise Exception(108)
+        writer = ArchiveWriter(stream, passphrase)
+
+        def seal(index: int, batch: list) -> tuple[bytes, int]:
+            rows = [
+                {"service": row.service, "username": row.username, "seed": row.seed}
+                for row in self._decrypt_many(batch, key)
+            ]
+            return writer.seal(index, rows), len(rows)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, batch in enumerate(self.db.iter_services(user_id, batch_size)):
+                pending.append(executor.submit(seal, index, batch))
+                if len(pending) >= 2 * workers:
+                    writer.write(*pending.popleft().result())
+            while pending:
+                writer.write(*pending.popleft().result())
+        writer.close()
+        return writer.count
+
+    @ErrorHandler()
+    def restore_services(
+        self,
+        user_id: str,
+        key: str,
+        stream: BinaryIO,
+        passphrase: str | None = None,
+        workers: int = 4,
+    ) -> dict:
+        """
+        Restore services from an encrypted archive.
+        - Read and authenticate the archive chunk by chunk.
+        - Re-encrypt each chunk under the user's key and insert it.
+        - Skip services that already exist.
+        - The whole restore runs in one transaction, a damaged archive restores nothing.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+            stream (BinaryIO): Archive file or stdin
+            passphrase (str | None): Export passphrase, prompted when None
+            workers (int): Number of encryption worker threads
+
+        Returns:
+            dict: Number of restored services and the (position, reason) failures
+
+        Raises:
+            Exception: 110 - Invalid Archive or Passphrase
+        """
+        if passphrase is None:
+            passphrase = getpass.getpass("vAUTH> Enter Export Passphrase: ")
+        existing = self.db.service_keys(user_id)
+        restored = 0
+        failed = []
+        position = 0
+        try:
+            with self.db.transaction():
+                for rows in read_archive(stream, passphrase):
+                    batch = []
+                    for row in rows:
+                        position += 1
+                        batch.append((f"entry {position}", row))
+                    restored += self._import_batch(
+                        user_id, key, batch, existing, failed, workers
+                    )
+        except (ArchiveError, KeyError, TypeError):
+            raise Exception(110)
+        for position, reason in failed:
+            print(f">>{position.upper()}: {reason.upper()}")
+        print(f">>{restored} SERVICES RESTORED, {len(failed)} FAILED")
+        return {"restored": restored, "failed": failed}
+
+    def _import_batch(
+        self,
+        user_id: str,
+        key: str,
+        batch: list,
+        existing: set,
+        failed: list,
+        workers: int,
+    ) -> int:
+        records = []
+        for position, record in batch:
+            service_key = (record["service"], record["username"])
+            if service_key in existing:
+                failed.append((position, "service already exists"))
+                continue
+            try:
+                OTPEngine.decode_seed(record["seed"])
+            except (ValueError, TypeError):
+                failed.append((position, "invalid seed"))
+                continue
+            existing.add(service_key)
+            records.append(
+                {
+                    "user_id": user_id,
+                    "username": record["username"],
+                    "service": record["service"],
+                    "seed": record["seed"],
+                }
+            )
+        if records:
+            self.db.insert_many(self.enc.encrypt_many(records, key, workers))
+            index = self._loaded_index(user_id)
+            if index is not None:
+                for record in records:
+                    index.add(record["service"], record["username"])
+        return len(records)
+
     @ErrorHandler()
     def find_seed(self, user_id: str, key: str, username: str, service: str) -> str:
         """
         Find the seed for a service.
+        - Return the cached seed when the key is the session key.
         - Check if service exists.
-        - Decrypt and return the seed.
+        - Decrypt, cache and return the seed.
 
         Args:
             user_id (str): User ID
@@ -195,12 +708,137 @@ class Commands:
 
         Raises:
             Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
+        """
+        return self.lookup_seed(user_id, key, username, service)
+
+    @ErrorHandler()
+    def find_seeds(
+        self, user_id: str, key: str, pattern: str | None = None
+    ) -> dict[tuple[str, str], str]:
+        """
+        Find the seeds of every service, or of those matching a pattern.
+        - Stream the services of the user in batches.
+        - Keep the services whose name or username matches the pattern.
+        - Take cached seeds, decrypt the others in one call per batch.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+            pattern (str | None): Shell-style pattern, case insensitive
+
+        Returns:
+            dict: Mapping of (service, username) to seed.
+        """
+        cacheable = self.enc.is_session_key(key)
+        if pattern is not None:
+            pattern = pattern.lower()
+        seeds = {}
+        for batch in self.db.iter_services(user_id):
+            missing = []
+            for row in batch:
+                service, username = row.service, row.username
+                if pattern is not None and not (
+                    fnmatch.fnmatchcase(service.lower(), pattern)
+                    or fnmatch.fnmatchcase(username.lower(), pattern)
+                ):
+                    continue
+                seed = None
+                if cacheable:
+                    seed = self.seed_cache.get((user_id, service, username))
+                if seed is None:
+                    missing.append(row)
+                else:
+                    seeds[(service, username)] = seed
+            for row in self._decrypt_many(missing, key):
+                seeds[(row.service, row.username)] = row.seed
+                if cacheable:
+                    self.seed_cache.put((user_id, row.service, row.username), row.seed)
+        return seeds
+
+    def lookup_seed(self, user_id: str, key: str, username: str, service: str) -> str:
+        """
+        Find the seed for a service like find_seed, raising the error codes
+        instead of printing them, for callers that answer clients.
+
+        Raises:
+            Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
         """
+        cacheable = self.enc.is_session_key(key)
+        if cacheable:
+            if self.prefetcher is not None:
+                self.prefetcher.wait_for((user_id, service, username))
+            seed = self.seed_cache.get((user_id, service, username))
+            if seed is not None:
+                return seed
         service_data = self.db.find_service(user_id, username, service)
-        if service_data:
-            service_data = self.enc.decrypt_data(service_data, key)
-            return service_data["seed"]
-        raise Exception(103)
+        if not service_data:
+            raise Exception(103)
+        seed = self._decrypt_many([service_data], key)[0]["seed"]
+        if cacheable:
+            self.seed_cache.put((user_id, service, username), seed)
+        return seed
+
+    @ErrorHandler()
+    def list_services(
+        self, user_id: str, prefix: str | None = None
+    ) -> list[tuple[str, str]]:
+        """
+        List the services of the user's account, seeds stay encrypted.
+
+        Args:
+            user_id (str): User ID
+            prefix (str | None): Only list services or usernames starting with it,
+                ignoring case.
+
+        Returns:
+            list: Sorted (service, username) pairs.
+        """
+        index = self.service_index(user_id)
+        if prefix is None:
+            return index.pairs()
+        return index.search(prefix)
+
+    @ErrorHandler()
+    def search_services(
+        self, user_id: str, query: str, limit: int = 50
+    ) -> list[tuple[str, str]]:
+        """
+        Search the services of the user's account, ignoring case.
+        - Match service names and usernames starting with the query first.
+        - Fill up with those containing it, through the trigram index when it
+          was built, by scanning the service index otherwise.
+
+        Args:
+            user_id (str): User ID
+            query (str): Text to look for
+            limit (int): Maximum number of results
+
+        Returns:
+            list: (service, username) pairs, prefix matches first.
+        """
+        index = self.service_index(user_id)
+        found = index.search(query, limit)
+        if len(found) >= limit:
+            return found
+        if len(query) >= 3 and self.db.has_search_index():
+            more = self.db.search_services(user_id, query, limit)
+        else:
+            more = index.contains(query, limit)
+        seen = set(found)
+        found.extend(pair for pair in more if pair not in seen)
+        return found[:limit]
+
+    @ErrorHandler()
+    def build_search_index(self) -> bool:
+        """
+        Build the trigram index used by search_services for substring matches.
+
+        Returns:
+            bool: False if SQLite was built without FTS5.
+        """
+        return self.db.create_search_index()
 
     @ErrorHandler()
     def show_service(self, seed: str, user_id: str, service: str) -> tuple:
@@ -220,15 +858,120 @@ class Commands:
         Raises:
             Exception: 104 - Invalid Seed > Deleted Service
         """
-        try:
-            totp = pyotp.TOTP(seed)
-        except Exception:
-            self.db.delete_service(user_id, service)
-            raise Exception(104)
-        return (
-            totp.now(),
-            totp.interval - datetime.datetime.now().timestamp() % totp.interval,
-        )
+        if seed not in self.otp:
+            try:
+                self.otp.add(seed, seed)
+            except Exception:
+                self.db.delete_service(user_id, service)
+                self._invalidate_service(user_id, service)
+                index = self._loaded_index(user_id)
+                if index is not None:
+                    index.remove_service(service)
+                raise Exception(104)
+        now = time.time()
+        return self.otp.code(seed, now), self.otp.remaining(seed, now)
+
+    def current_code(
+        self, user_id: str, key: str, username: str, service: str
+    ) -> tuple[str, float]:
+        """
+        Compute the TOTP of a stored service for a client, such as the agent.
+        - Raise the error codes instead of printing them.
+        - Leave a service with an invalid seed in place, unlike show_service.
+
+        Args:
+            user_id (str): User ID
+            key (str): Password
+            username (str): Username for the service
+            service (str): Service name
+
+        Returns:
+            tuple: TOTP, Time remaining
+
+        Raises:
+            Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
+            Exception: 105 - Invalid Seed
+        """
+        seed = self.lookup_seed(user_id, key, username, service)
+        if seed not in self.otp:
+            try:
+                self.otp.add(seed, seed)
+            except Exception:
+                raise Exception(105)
+        now = time.time()
+        return self.otp.code(seed, now), self.otp.remaining(seed, now)
+
+    @ErrorHandler()
+    def show_services(self, seeds: dict) -> dict:
+        """
+        Show the TOTPs for many services in one pass.
+        - Register the seeds that are not known yet.
+        - Generate every TOTP for the current time step.
+
+        Args:
+            seeds (dict): Mapping of service names to seeds.
+                Seeds are registered in the engine under their own value,
+                so a modified seed never returns a stale TOTP.
+
+        Returns:
+            dict: Mapping of service names to (TOTP, Time remaining).
+                Services with an invalid seed are left out.
+        """
+        new_seeds = {seed: seed for seed in seeds.values() if seed not in self.otp}
+        invalid = set(self.otp.load(new_seeds))
+        now = time.time()
+        codes = self.otp.codes(now)
+        return {
+            name: (codes[seed], self.otp.remaining(seed, now))
+            for name, seed in seeds.items()
+            if seed not in invalid
+        }
+
+    @ErrorHandler()
+    def verify(
+        self,
+        key: str,
+        checks: list[tuple[str, str, str, str]],
+        drift: int = 1,
+        now: float | None = None,
+    ) -> list[bool]:
+        """
+        Verify codes submitted for stored services.
+        - Find every seed once per batch, from the seed cache when possible.
+        - Accept a code of the current time step or of up to drift steps around it.
+        - Reject a code when the same or a later step was already accepted.
+        - Reject every code of a service for a while after repeated failures.
+
+        Args:
+            key (str): Password
+            checks (list[tuple]): (user_id, service, username, code) tuples.
+            drift (int): Number of time steps accepted before and after now.
+            now (float | None): Unix time, defaults to the current time.
+
+        Returns:
+            list[bool]: Whether each code is accepted, in the same order.
+                Codes of unknown services are rejected.
+        """
+        if self.verifier is None:
+            from vauth.verify import Verifier
+
+            # Concurrent first requests must share one replay cache.
+            with self._verifier_lock:
+                if self.verifier is None:
+                    self.verifier = Verifier()
+        seeds = {}
+        batch = []
+        for user_id, service, username, code in checks:
+            lookup = (user_id, service, username)
+            if lookup not in seeds:
+                try:
+                    seeds[lookup] = self.lookup_seed(user_id, key, username, service)
+                except Exception:
+                    # Unknown service, or a seed the key cannot decrypt.
+                    seeds[lookup] = None
+            batch.append((lookup, seeds[lookup], code))
+        return self.verifier.verify_many(batch, drift, now)
 
     @ErrorHandler()
     def modify_service(
@@ -261,19 +1004,27 @@ class Commands:
             Exception: 103 - Service not found.
             Exception: 105 - Invalid Seed.
             Exception: 106 - Invalid Type.
+            Exception: 107 - Service already exists.
         """
         service_data = self.db.find_service(user_id, username, service)
         if not service_data:
             raise Exception(103)
         if type == "username":
-            self.db.update_service(
-                user_id,
-                service,
-                {
-                    "username": new_value,
-                    "seed": service_data["seed"],
-                },
-            )
+            try:
+                self.db.update_service(
+                    user_id,
+                    service,
+                    {
+                        "username": new_value,
+                        "seed": service_data["seed"],
+                    },
+                )
+            except sqlite3.IntegrityError:
+                raise Exception(107)
+            index = self._loaded_index(user_id)
+            if index is not None:
+                index.remove_service(service)
+                index.add(service, new_value)
         elif type == "seed":
             try:
                 base64.b32decode(new_value, casefold=True)
@@ -290,6 +1041,7 @@ class Commands:
             )
         else:
             raise Exception(106)
+        self._invalidate_service(user_id, service)
         print(">>SERVICE MODIFIED")
         return
 
@@ -316,16 +1068,23 @@ class Commands:
         if not service_data:
             raise Exception(103)
         self.db.delete_service(user_id, service)
+        self._invalidate_service(user_id, service)
+        index = self._loaded_index(user_id)
+        if index is not None:
+            index.remove_service(service)
         print(">>SERVICE REMOVED")
 
     @ErrorHandler()
-    def show_qr(self, user_id: str, key: str, username: str, service: str) -> QRCode:
+    def show_qr(
+        self, user_id: str, key: str, username: str, service: str
+    ) -> qr.Matrix:
         """
         Show the QR code for a service.
+        - Check the password unless it is the session key.
         - Check if the service exists.
-        - Decrypt the service data.
+        - Decrypt the service data, or take it from the seed cache.
         - Generate the provisioning URI.
-        - Generate the QR code.
+        - Generate the QR code, or take it from the QR cache.
 
         Args:
             user_id (str): User ID.
@@ -334,18 +1093,109 @@ class Commands:
             service (str): Service name.
 
         Returns:
-            QRCode: QR Code Object.
+            Matrix: QR Code Modules, render them with vauth.qr.
 
         Raises:
+            Exception: 100 - Invalid Password.
             Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
         """
-        if not self.db.find_auth(user_id, self.enc.hash_key(key.encode())):
+        if not self.enc.is_session_key(key) and not self.db.find_auth(
+            user_id, self.enc.hash_key(key.encode())
+        ):
             raise Exception(100)
-        service_data = self.db.find_service(user_id, username, service)
-        if not service_data:
-            raise Exception(103)
-        service_data = self.enc.decrypt_data(service_data, key)
-        totp = pyotp.TOTP(service_data["seed"])
-        qr = QRCode()
-        qr.add_data(totp.provisioning_uri(username, issuer_name=service))
-        return qr
+        import pyotp
+
+        totp = pyotp.TOTP(self.lookup_seed(user_id, key, username, service))
+        return self.qr_cache.get(
+            (user_id, service, username),
+            totp.provisioning_uri(username, issuer_name=service),
+        )
+
+    @ErrorHandler()
+    def save_qr(
+        self, user_id: str, key: str, username: str, service: str, path: str
+    ) -> str:
+        """
+        Save the QR code of a service to a file.
+        - The format follows the extension: .txt, .svg or .png.
+        - The file is only readable by its owner.
+
+        Args:
+            user_id (str): User ID.
+            key (str): Password.
+            username (str): Username for the service.
+            service (str): Service name.
+            path (str): Output file.
+
+        Returns:
+            str: Output file.
+
+        Raises:
+            Exception: 100 - Invalid Password.
+            Exception: 103 - Service not found.
+            Exception: 115 - Seed encrypted under a previous password.
+            Exception: 113 - Invalid QR format.
+        """
+        fmt = os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in qr.FORMATS:
+            raise Exception(113)
+        modules = self.show_qr(user_id, key, username, service)
+        if not isinstance(modules, tuple):
+            return None
+        qr.write(path, qr.render(modules, fmt))
+        return path
+
+    @ErrorHandler()
+    def export_qr(
+        self,
+        user_id: str,
+        key: str,
+        directory: str,
+        fmt: str = "png",
+        pattern: str | None = None,
+        workers: int | None = None,
+    ) -> list[str]:
+        """
+        Save the QR code of every service to a directory.
+        - Decrypt every seed in one pass.
+        - Encode and render the codes on a process pool.
+        - Create the directory and the files readable by their owner only.
+
+        Args:
+            user_id (str): User ID.
+            key (str): Password.
+            directory (str): Output directory.
+            fmt (str): txt, svg or png.
+            pattern (str | None): Only export matching services, see find_seeds.
+            workers (int | None): Number of processes, one per CPU by default.
+
+        Returns:
+            list: Written files.
+
+        Raises:
+            Exception: 100 - Invalid Password.
+            Exception: 113 - Invalid QR format.
+        """
+        if fmt not in qr.FORMATS:
+            raise Exception(113)
+        if not self.enc.is_session_key(key) and not self.db.find_auth(
+            user_id, self.enc.hash_key(key.encode())
+        ):
+            raise Exception(100)
+        seeds = self.find_seeds(user_id, key, pattern)
+        if not isinstance(seeds, dict):
+            return None
+        import pyotp
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        jobs = [
+            (
+                pyotp.TOTP(seed).provisioning_uri(username, issuer_name=service),
+                os.path.join(directory, qr.filename(service, username, fmt)),
+            )
+            for (service, username), seed in sorted(seeds.items())
+        ]
+        paths = qr.export_all(jobs, fmt, workers)
+        print(f">>{len(paths)} QR CODES WRITTEN TO {directory}")
+        return paths
@@ -0,0 +1,142 @@
+import asyncio
+import shutil
+import time
+
+from vauth.otp import OTPEngine
+from vauth.terminal import ESC, KeyReader, Screen, seconds_to_next_tick
+
+BAR_WIDTH = 30
+
+
+class Dashboard:
+    """
+    Live view of the codes of many services at once.
+    - Codes are recomputed by the OTP engine only when a time step boundary
+      of their interval is crossed, the scheduler wakes exactly at it.
+    - In between, a tick on every whole second redraws the countdown bars,
+      one per interval, and leaves the table untouched.
+    - Services with different intervals and digit counts can be mixed.
+
+    Methods
+    -------
+    run() -> None:
+        Displays the dashboard until ESC is pressed
+    frame(now: float) -> list[str]:
+        Builds the lines of the dashboard at a given time
+    """
+
+    def __init__(
+        self,
+        seeds: dict[tuple[str, str], str],
+        screen: Screen,
+        keys: KeyReader,
+        title: str = "vAUTH dashboard",
+        height: int | None = None,
+    ) -> None:
+        self.screen = screen
+        self.keys = keys
+        self.title = title
+        self.height = height
+        self.engine = OTPEngine()
+        self.rows: list[tuple[str, str, str]] = []
+        for index, ((service, username), seed) in enumerate(sorted(seeds.items())):
+            name = str(index)
+            try:
+                self.engine.add(name, seed)
+            except (ValueError, TypeError):
+                continue
+            self.rows.append((name, service, username))
+        self._table: list[str] = []
+        self._next_change = float("-inf")
+
+    def frame(self, now: float) -> list[str]:
+        """
+        Builds the lines of the dashboard at a given time
+
+        Parameters
+        ----------
+        now : float
+            Unix time
+
+        Returns
+        -------
+        list[str]
+            Lines, the table is only rebuilt after a code changed
+        """
+        if now >= self._next_change:
+            self._table = self._build_table(self.engine.codes(now))
+            self._next_change = self.engine.next_change(now)
+        lines = [f"{self.title} - {len(self.rows)} services"]
+        for interval in self.engine.intervals():
+            remaining = interval - now % interval
+            filled = round(remaining / interval * BAR_WIDTH)
+            bar = "█" * filled + "░" * (BAR_WIDTH - filled)
+            lines.append(f"{interval:>3}s {bar} {int(remaining):>3}s")
+        lines.append("")
+        lines.extend(self._table)
+        lines.append("Press 'ESC' to quit")
+        return lines
+
+    async def run(self) -> None:
+        """
+        Displays the dashboard until ESC is pressed
+        """
+        stop = asyncio.Event()
+        listening = self._listen(stop)
+        try:
+            while not stop.is_set():
+                now = time.time()
+                self.screen.draw(self.frame(now))
+                wake = min(
+                    now + seconds_to_next_tick(now), self.engine.next_change(now)
+                )
+                try:
+                    await asyncio.wait_for(stop.wait(), max(wake - time.time(), 0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            listening.cancel()
+
+    def _listen(self, stop: asyncio.Event) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.keys.selectable:
+            fd = self.keys.stream.fileno()
+
+            def on_readable() -> None:
+                key = self.keys.read_key(0)
+                if key is None:
+                    # End of input, nothing will ever arrive.
+                    loop.remove_reader(fd)
+                elif key == ESC:
+                    stop.set()
+
+            loop.add_reader(fd, on_readable)
+            future.add_done_callback(lambda _: loop.remove_reader(fd))
+            return future
+
+        async def poll() -> None:
+            while await asyncio.to_thread(self.keys.read_key, 0.2) != ESC:
+                pass
+            stop.set()
+
+        return asyncio.ensure_future(poll())
+
+    def _build_table(self, codes: dict[str, str]) -> list[str]:
+        height = self.height
+        if height is None:
+            height = shutil.get_terminal_size().lines
+        # Title, one bar per interval, blank line, header, footers.
+        room = max(height - len(self.engine.intervals()) - 5, 1)
+        service_width = max([len("SERVICE")] + [len(r[1]) for r in self.rows])
+        username_width = max([len("USERNAME")] + [len(r[2]) for r in self.rows])
+        table = [f"{'SERVICE':<{service_width}}  {'USERNAME':<{username_width}}  OTP"]
+        for name, service, username in self.rows[:room]:
+            table.append(
+                f"{service:<{service_width}}  {username:<{username_width}}  "
+                f"{codes[name]}  {self.engine.interval(name)}s"
+            )
+        if len(self.rows) > room:
+            more = len(self.rows) - room
+            table.append(f"+{more} more, narrow it down with: dashboard <pattern>")
+        return table
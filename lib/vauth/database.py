@@ -1,7 +1,11 @@
-import json
+import contextlib
 import os
+import queue
 import sqlite3
-from typing import TypedDict
+import threading
+from typing import Iterator
+
+from vauth.metrics import METRICS
 
 
 class Database:
@@ -12,12 +16,42 @@ class Database:
     -------
     insert_one(data: dict, table_name: str) -> None:
         Inserts a record into the table
+    insert_many(data: list[ServiceData]) -> None:
+        Inserts many service records with a single statement
     find_service(user_id: str, username: str, service: str) -> ServiceData | None:
         Finds a service record
+    service_keys(user_id: str) -> set[tuple[str, str]]:
+        Returns the (service, username) pairs of a user
+    iter_services(user_id: str, batch_size: int = 500) -> Iterator[list[ServiceData]]:
+        Streams the service records of a user in batches
+    page_services(user_id: str, after: tuple | None = None, limit: int = 500) -> list:
+        Returns the next page of service records of a user
+    create_search_index() -> bool:
+        Builds the optional trigram index used by search_services
+    has_search_index() -> bool:
+        Checks if the trigram index exists
+    search_services(user_id: str, query: str, limit: int = 50) -> list[tuple]:
+        Finds the services whose service or username contains a string
     find_auth(user_id: str, key: str, mode="key") -> AuthData | None:
         Finds an auth record
-    find_recovery_code(user_id: str, recovery_code: str) -> bool:
-        Finds a recovery code
+    find_recovery_code(user_id: str, code_hash: str) -> bool:
+        Checks that a recovery code exists and is unused
+    consume_recovery_code(user_id: str, code_hash: str) -> bool:
+        Marks a recovery code as used, once
+    recovery_codes(user_id: str) -> dict[str, bool]:
+        Returns the recovery code hashes of a user and whether they were used
+    replace_recovery_codes(user_id: str, code_hashes: list[str]) -> None:
+        Replaces every recovery code of a user
+    update_key(user_id: str, key: str) -> None:
+        Updates the password hash of a user
+    start_rotation(user_id: str, old_key: str, new_key: str) -> None:
+        Records a password change and switches the password hash
+    find_rotation(user_id: str) -> RotationData | None:
+        Finds the checkpoint of an unfinished password change
+    rotate_batch(user_id: str, rows: list, rotated: int) -> None:
+        Stores re-encrypted seeds together with the checkpoint
+    finish_rotation(user_id: str) -> None:
+        Removes the checkpoint of a completed password change
     delete_service(user_id: str, service: str) -> None:
         Deletes a service record
     delete_auth(user_id: str) -> None:
@@ -28,36 +62,452 @@ class Database:
         Updates a service record
     is_registered() -> bool:
         Checks if the database is registered
+    user_ids() -> list[str]:
+        Returns every registered user
+    migrate() -> None:
+        Applies the pending schema migrations
+    transaction() -> ContextManager[Database]:
+        Groups many operations into a single commit
+    reader() -> ContextManager[Database]:
+        Opens a handle for reads from another thread
     close():
-        Closes the database connection
+        Closes the writer and every pooled reader connection
+
+    Threading
+    ---------
+    By default every call goes through one connection, which can only be
+    used from the thread that opened the database.
+    With pooled=True the database can be shared between threads:
+    - reads check a connection out of a pool of at most max_readers, opened
+      on first use, and return it when done, nested reads of a thread share
+      the connection it holds,
+    - writes and transactions go through a single writer connection and are
+      serialized by a lock, reads made inside a transaction see its writes,
+    - every call uses its own cursor.
     """
 
-    class ServiceData(TypedDict):
+    class _Row:
         """
-        TypedDict to represent the data of a service
+        Compact record with a slot per column.
+        Fields are read as attributes or by name, as with the dicts returned by
+        earlier versions, and can be replaced by name.
         """
 
-        user_id: str
-        username: str
-        service: str
-        seed: str
+        __slots__ = ()
+
+        def __getitem__(self, name: str):
+            if name not in self.__slots__:
+                raise KeyError(name)
+            return getattr(self, name)
+
+        def __setitem__(self, name: str, value) -> None:
+            if name not in self.__slots__:
+                raise KeyError(name)
+            setattr(self, name, value)
+
+        def __eq__(self, other) -> bool:
+            if isinstance(other, dict):
+                return other == self._asdict()
+            if type(other) is not type(self):
+                return NotImplemented
+            return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+        def __repr__(self) -> str:
+            fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__slots__)
+            return f"{type(self).__name__}({fields})"
+
+        def keys(self) -> tuple[str, ...]:
+            return self.__slots__
+
+        def _asdict(self) -> dict:
+            return {f: getattr(self, f) for f in self.__slots__}
+
+        @classmethod
+        def row_factory(cls, cursor: sqlite3.Cursor, row: tuple) -> "Database._Row":
+            return cls(*row)
 
-    class AuthData(TypedDict):
+    class ServiceData(_Row):
         """
-        TypedDict to represent the data of an auth record
+        Record of the services table
         """
 
-        user_id: str
-        key: str
-        recovery_codes: list
+        __slots__ = ("user_id", "username", "service", "seed")
 
-    def __init__(self, path=os.path.join(os.path.expanduser("~"), ".vauth")) -> None:
+        def __init__(self, user_id: str, username: str, service: str, seed: str):
+            self.user_id = user_id
+            self.username = username
+            self.service = service
+            self.seed = seed
+
+    class AuthData(_Row):
+        """
+        Record of the auth table
+        """
+
+        __slots__ = ("user_id", "key", "recovery_codes")
+
+        def __init__(self, user_id: str, key: str, recovery_codes: str):
+            self.user_id = user_id
+            self.key = key
+            self.recovery_codes = recovery_codes
+
+    class RotationData(_Row):
+        """
+        Checkpoint of an interrupted password change
+        """
+
+        __slots__ = (
+            "user_id",
+            "old_key",
+            "new_key",
+            "after_service",
+            "after_username",
+            "rotated",
+        )
+
+        def __init__(
+            self,
+            user_id: str,
+            old_key: str,
+            new_key: str,
+            after_service: str | None,
+            after_username: str | None,
+            rotated: int,
+        ):
+            self.user_id = user_id
+            self.old_key = old_key
+            self.new_key = new_key
+            self.after_service = after_service
+            self.after_username = after_username
+            self.rotated = rotated
+
+    # Ordered schema migrations, migration N brings PRAGMA user_version to N.
+    MIGRATIONS = [
+        [
+            "CREATE TABLE IF NOT EXISTS services(user_id TEXT, username TEXT, service TEXT, seed TEXT)",
+            "CREATE TABLE IF NOT EXISTS auth(user_id TEXT, key TEXT, recovery_codes TEXT)",
+            # Older versions could insert the same service twice, keep the first one.
+            "DELETE FROM services WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM services GROUP BY user_id, service, username)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_services_user_service_username "
+            "ON services(user_id, service, username)",
+            "CREATE INDEX IF NOT EXISTS idx_auth_user_id ON auth(user_id)",
+        ],
+        [
+            "CREATE TABLE IF NOT EXISTS recovery_codes("
+            "user_id TEXT NOT NULL, code_hash TEXT NOT NULL, "
+            "consumed INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (user_id, code_hash)) WITHOUT ROWID",
+            # Move the hashes out of the JSON list of the auth row.
+            "INSERT OR IGNORE INTO recovery_codes (user_id, code_hash) "
+            "SELECT auth.user_id, codes.value "
+            "FROM auth, json_each(auth.recovery_codes) AS codes "
+            "WHERE json_valid(auth.recovery_codes)",
+            "UPDATE auth SET recovery_codes = '[]'",
+        ],
+        [
+            "CREATE TABLE IF NOT EXISTS key_rotations("
+            "user_id TEXT PRIMARY KEY, old_key TEXT NOT NULL, new_key TEXT NOT NULL, "
+            "after_service TEXT, after_username TEXT, "
+            "rotated INTEGER NOT NULL DEFAULT 0)",
+        ],
+    ]
+
+    JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+    SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+    def __init__(
+        self,
+        path=os.path.join(os.path.expanduser("~"), ".vauth"),
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        busy_timeout: int = 5000,
+        cache_size: int = -8192,
+        mmap_size: int = 64 * 1024 * 1024,
+        pooled: bool = False,
+        max_readers: int = 4,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            Directory holding vauth.db
+        journal_mode : str
+            SQLite journal mode
+        synchronous : str
+            SQLite synchronous mode, NORMAL is durable with WAL on commit boundaries
+        busy_timeout : int
+            Milliseconds to wait for a lock held by another connection
+        cache_size : int
+            Page cache size, in pages when positive and in KiB when negative
+        mmap_size : int
+            Bytes of the database file to memory-map, 0 disables it
+        pooled : bool
+            Pool the read connections and serialize writes
+        max_readers : int
+            Read connections kept by a pooled database
+        """
         os.makedirs(path, exist_ok=True)
-        self.connection = sqlite3.connect(os.path.join(path, "vauth.db"))
-        self.cursor = self.connection.cursor()
+        self.path = path
+        self.pooled = pooled
         self.service_table = "services"
         self.auth_table = "auth"
+        self.recovery_table = "recovery_codes"
+        self.search_table = "services_fts"
+        self.rotation_table = "key_rotations"
+        self.service_columns = "user_id, username, service, seed"
+        self._settings: dict[str, int] = {}
+        self.max_readers = max_readers
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._held: dict[int, list] = {}
+        self._opened = 0
+        self._closed = False
+        self._pool_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._owner = None
+        self._transaction_depth = 0
+        self.connection = self._connect()
+        self.configure(
+            journal_mode=journal_mode,
+            synchronous=synchronous,
+            busy_timeout=busy_timeout,
+            cache_size=cache_size,
+            mmap_size=mmap_size,
+        )
+        self.migrate()
 
+    def configure(
+        self,
+        journal_mode: str | None = None,
+        synchronous: str | None = None,
+        busy_timeout: int | None = None,
+        cache_size: int | None = None,
+        mmap_size: int | None = None,
+    ) -> None:
+        """
+        Applies connection settings, settings left as None are not changed
+
+        Parameters
+        ----------
+        journal_mode : str | None
+            SQLite journal mode
+        synchronous : str | None
+            SQLite synchronous mode
+        busy_timeout : int | None
+            Busy timeout in milliseconds
+        cache_size : int | None
+            Page cache size
+        mmap_size : int | None
+            Memory-mapped I/O size in bytes
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If a mode is not a valid SQLite mode
+        """
+        if journal_mode is not None:
+            if journal_mode.upper() not in self.JOURNAL_MODES:
+                raise ValueError(f"invalid journal_mode: {journal_mode}")
+            self._execute(f"PRAGMA journal_mode = {journal_mode.upper()}")
+        if synchronous is not None:
+            if synchronous.upper() not in self.SYNCHRONOUS_MODES:
+                raise ValueError(f"invalid synchronous: {synchronous}")
+            self._execute(f"PRAGMA synchronous = {synchronous.upper()}")
+        # Read connections opened later get the same per-connection settings.
+        for name, value in (
+            ("busy_timeout", busy_timeout),
+            ("cache_size", cache_size),
+            ("mmap_size", mmap_size),
+        ):
+            if value is not None:
+                self._settings[name] = int(value)
+                self._execute(f"PRAGMA {name} = {int(value)}")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups every operation in the block into a single commit.
+        Nested blocks join the outermost one, which commits on success
+        and rolls back if an exception escapes it.
+
+        Yields
+        ------
+        Database
+            This database
+        """
+        with self._write_lock:
+            if self._transaction_depth == 0:
+                self._owner = threading.get_ident()
+                if not self.connection.in_transaction:
+                    self.connection.execute("BEGIN")
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._transaction_depth == 1:
+                    self.connection.rollback()
+                raise
+            else:
+                if self._transaction_depth == 1:
+                    self.connection.commit()
+            finally:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._owner = None
+
+    @contextlib.contextmanager
+    def reader(self):
+        """
+        Opens a handle for reads from another thread.
+        A pooled database is shared as is, otherwise a separate database is
+        opened on the same file and closed at the end of the block.
+
+        Yields
+        ------
+        Database
+            Database usable from the calling thread
+        """
+        if self.pooled:
+            yield self
+            return
+        db = Database(self.path)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _connect(self, reader: bool = False) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            os.path.join(self.path, "vauth.db"), check_same_thread=not self.pooled
+        )
+        connection.set_trace_callback(METRICS.count_statement)
+        if reader:
+            connection.execute("PRAGMA query_only = ON")
+            for name, value in self._settings.items():
+                connection.execute(f"PRAGMA {name} = {value}")
+        return connection
+
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        # Reads inside a transaction must see its uncommitted writes.
+        thread = threading.get_ident()
+        if not self.pooled or self._owner == thread:
+            yield self.connection
+            return
+        with self._pool_lock:
+            held = self._held.get(thread)
+            if held is not None:
+                held[1] += 1
+        if held is None:
+            held = self._held[thread] = [self._checkout(), 1]
+        try:
+            yield held[0]
+        finally:
+            # The thread is captured, a generator may be closed from another.
+            with self._pool_lock:
+                held[1] -= 1
+                if held[1]:
+                    return
+                del self._held[thread]
+            self._checkin(held[0])
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            create = self._opened < self.max_readers
+            if create:
+                self._opened += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return self._connect(reader=True)
+        except BaseException:
+            with self._pool_lock:
+                self._opened -= 1
+            raise
+
+    def _checkin(self, connection: sqlite3.Connection) -> None:
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    @contextlib.contextmanager
+    def _cursor(self, row_factory=None) -> Iterator[sqlite3.Cursor]:
+        with self._reader() as connection:
+            with contextlib.closing(connection.cursor()) as cursor:
+                if row_factory is not None:
+                    cursor.row_factory = row_factory
+                yield cursor
+
+    def _fetchone(self, sql: str, parameters=(), row_factory=None):
+        with self._cursor(row_factory) as cursor:
+            return cursor.execute(sql, parameters).fetchone()
+
+    def _fetchall(self, sql: str, parameters=(), row_factory=None) -> list:
+        with self._cursor(row_factory) as cursor:
+            return cursor.execute(sql, parameters).fetchall()
+
+    def _execute(self, sql: str, parameters=()) -> None:
+        with self._write_lock:
+            try:
+                self.connection.execute(sql, parameters).close()
+            except BaseException:
+                self._rollback()
+                raise
+            self._commit()
+
+    def _executemany(self, sql: str, parameters) -> None:
+        with self._write_lock:
+            try:
+                self.connection.executemany(sql, parameters).close()
+            except BaseException:
+                self._rollback()
+                raise
+            self._commit()
+
+    def _commit(self) -> None:
+        if self._transaction_depth == 0 and self.connection.in_transaction:
+            self.connection.commit()
+
+    def _rollback(self) -> None:
+        # A failed statement opened an implicit transaction, which would keep
+        # the write lock until the next commit. transaction() rolls back its own.
+        if self._transaction_depth == 0 and self.connection.in_transaction:
+            self.connection.rollback()
+
+    @property
+    def schema_version(self) -> int:
+        with self._write_lock:
+            return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> None:
+        """
+        Applies the pending schema migrations.
+        Each migration runs in its own transaction together with the version bump,
+        so an interrupted upgrade is retried from the last completed migration.
+
+        Returns
+        -------
+        None
+        """
+        version = self.schema_version
+        for number, statements in enumerate(
+            self.MIGRATIONS[version:], start=version + 1
+        ):
+            with self.transaction():
+                for statement in statements:
+                    self.connection.execute(statement)
+                self.connection.execute(f"PRAGMA user_version = {number}")
+
+    @METRICS.timed("db")
     def insert_one(self, data, table_name: str) -> None:
         """
         Inserts a record into the table
@@ -70,12 +520,19 @@ class Database:
         Returns
         -------
         None
+
+        Raises
+        ------
+        sqlite3.IntegrityError
+            If the service already exists for the user
+
+        Notes
+        -----
+        The recovery codes of an auth record are hashes, they are stored in
+        the recovery_codes table in the same transaction.
         """
         if table_name == self.service_table:
-            self.cursor.execute(
-                f"CREATE TABLE IF NOT EXISTS {self.service_table}(user_id TEXT, username TEXT, service TEXT, seed TEXT)",
-            )
-            self.cursor.execute(
+            self._execute(
                 f"INSERT INTO {self.service_table} (user_id, username, service, seed) VALUES (?, ?, ?, ?)",
                 (
                     data["user_id"],
@@ -85,20 +542,39 @@ class Database:
                 ),
             )
         elif table_name == self.auth_table:
+            with self.transaction():
+                self._execute(
+                    f"INSERT INTO {table_name} (user_id, key, recovery_codes) VALUES (?, ?, ?)",
+                    (data["user_id"], data["key"], "[]"),
+                )
+                self.replace_recovery_codes(data["user_id"], data["recovery_codes"])
 
-            self.cursor.execute(
-                f"CREATE TABLE IF NOT EXISTS {self.auth_table}(user_id TEXT, key TEXT, recovery_codes TEXT)",
-            )
-            self.cursor.execute(
-                f"INSERT INTO {table_name} (user_id, key, recovery_codes) VALUES (?, ?, ?)",
-                (
-                    data["user_id"],
-                    data["key"],
-                    json.dumps(data["recovery_codes"]),
-                ),
-            )
-        self.connection.commit()
+    @METRICS.timed("db")
+    def insert_many(self, data: list[ServiceData]) -> None:
+        """
+        Inserts many service records with a single executemany
+        ----------
+        data : list[ServiceData]
+            Records to be inserted
 
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        sqlite3.IntegrityError
+            If one of the services already exists for the user
+        """
+        self._executemany(
+            f"INSERT INTO {self.service_table} (user_id, username, service, seed) VALUES (?, ?, ?, ?)",
+            (
+                (record["user_id"], record["username"], record["service"], record["seed"])
+                for record in data
+            ),
+        )
+
+    @METRICS.timed("db")
     def find_service(
         self,
         user_id: str,
@@ -120,25 +596,199 @@ class Database:
         ServiceData | None
             Service record
         """
-        self.cursor.execute(
-            f"CREATE TABLE IF NOT EXISTS {self.service_table}(user_id TEXT, username TEXT, service TEXT, seed TEXT)",
-        )
-        self.cursor.execute(
-            f"SELECT * FROM {self.service_table} WHERE user_id = ? AND username = ? AND service = ?",
+        return self._fetchone(
+            f"SELECT {self.service_columns} FROM {self.service_table} "
+            "WHERE user_id = ? AND username = ? AND service = ?",
             (user_id, username, service),
+            self.ServiceData.row_factory,
+        )
+
+    @METRICS.timed("db")
+    def service_keys(self, user_id: str) -> set[tuple[str, str]]:
+        """
+        Returns the (service, username) pairs of a user
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+
+        Returns
+        -------
+        set[tuple[str, str]]
+            Service and username of every service of the user
+        """
+        return set(
+            self._fetchall(
+                f"SELECT service, username FROM {self.service_table} WHERE user_id = ?",
+                (user_id,),
+            )
+        )
+
+    def iter_services(
+        self, user_id: str, batch_size: int = 500
+    ) -> Iterator[list[ServiceData]]:
+        """
+        Streams the service records of a user in batches.
+        Rows are stepped from a dedicated cursor with fetchmany and built by the
+        row factory, so memory use depends on batch_size only, not on the number
+        of services. In pooled mode a read connection stays checked out until
+        the iteration ends or the generator is closed.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        batch_size : int
+            Number of records per batch
+
+        Yields
+        ------
+        list[ServiceData]
+            Service records, in (service, username) order
+        """
+        with self._cursor(self.ServiceData.row_factory) as cursor:
+            cursor.execute(
+                f"SELECT {self.service_columns} FROM {self.service_table} "
+                # Walks the unique (user_id, service, username) index, no sort.
+                "WHERE user_id = ? ORDER BY service, username",
+                (user_id,),
+            )
+            while rows := cursor.fetchmany(batch_size):
+                yield rows
+
+    @METRICS.timed("db")
+    def page_services(
+        self, user_id: str, after: tuple[str, str] | None = None, limit: int = 500
+    ) -> list[ServiceData]:
+        """
+        Returns the next page of service records of a user.
+        Pages are keyed on (service, username) and walk the unique index, so
+        each page is an independent query that needs no open cursor.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        after : tuple[str, str] | None
+            (service, username) of the last record of the previous page
+        limit : int
+            Number of records per page
+
+        Returns
+        -------
+        list[ServiceData]
+            Service records in (service, username) order, empty after the last page
+        """
+        columns = f"SELECT {self.service_columns} FROM {self.service_table}"
+        if after is None:
+            return self._fetchall(
+                f"{columns} WHERE user_id = ? ORDER BY service, username LIMIT ?",
+                (user_id, limit),
+                self.ServiceData.row_factory,
+            )
+        return self._fetchall(
+            f"{columns} WHERE user_id = ? AND (service, username) > (?, ?) "
+            "ORDER BY service, username LIMIT ?",
+            (user_id, after[0], after[1], limit),
+            self.ServiceData.row_factory,
         )
-        output = self.cursor.fetchone()
+
+    def create_search_index(self) -> bool:
+        """
+        Builds the optional FTS5 trigram index over service and username.
+        Triggers keep it in sync with the services table afterwards.
+
+        Returns
+        -------
+        bool
+            False if this SQLite build has no FTS5 trigram tokenizer
+        """
+        table = self.search_table
+        try:
+            with self.transaction():
+                self._execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                    f"service, username, content='{self.service_table}', "
+                    "content_rowid='rowid', tokenize='trigram')"
+                )
+                self._execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_insert "
+                    f"AFTER INSERT ON {self.service_table} BEGIN "
+                    f"INSERT INTO {table} (rowid, service, username) "
+                    "VALUES (new.rowid, new.service, new.username); END"
+                )
+                self._execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_delete "
+                    f"AFTER DELETE ON {self.service_table} BEGIN "
+                    f"INSERT INTO {table} ({table}, rowid, service, username) "
+                    "VALUES ('delete', old.rowid, old.service, old.username); END"
+                )
+                self._execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_update "
+                    f"AFTER UPDATE ON {self.service_table} BEGIN "
+                    f"INSERT INTO {table} ({table}, rowid, service, username) "
+                    "VALUES ('delete', old.rowid, old.service, old.username); "
+                    f"INSERT INTO {table} (rowid, service, username) "
+                    "VALUES (new.rowid, new.service, new.username); END"
+                )
+                self._execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def has_search_index(self) -> bool:
+        """
+        Checks if the trigram index exists
+
+        Returns
+        -------
+        bool
+            True once create_search_index succeeded on this database
+        """
         return (
-            {
-                "user_id": output[0],
-                "username": output[1],
-                "service": output[2],
-                "seed": output[3],
-            }
-            if output
-            else None
+            self._fetchone(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (self.search_table,),
+            )
+            is not None
         )
 
+    @METRICS.timed("db")
+    def search_services(
+        self, user_id: str, query: str, limit: int = 50
+    ) -> list[tuple[str, str]]:
+        """
+        Finds the services whose service or username contains a string,
+        ignoring case, through the trigram index
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        query : str
+            Substring, at least 3 characters
+        limit : int
+            Maximum number of results
+
+        Returns
+        -------
+        list[tuple[str, str]]
+            (service, username) pairs, sorted
+        """
+        # A quoted string is matched as a substring, quotes are doubled inside.
+        phrase = '"' + query.replace('"', '""') + '"'
+        return sorted(
+            self._fetchall(
+                # CROSS JOIN keeps the index lookup in the outer loop.
+                f"SELECT s.service, s.username FROM {self.search_table} AS f "
+                f"CROSS JOIN {self.service_table} AS s ON s.rowid = f.rowid "
+                f"WHERE {self.search_table} MATCH ? AND s.user_id = ? LIMIT ?",
+                (phrase, user_id, limit),
+            )
+        )
+
+    @METRICS.timed("db")
     def find_auth(self, user_id: str, key: str, mode="key") -> AuthData | None:
         """
         Finds an auth record
@@ -157,51 +807,231 @@ class Database:
             AuthData | None
             Auth record
         """
+        columns = f"SELECT user_id, key, recovery_codes FROM {self.auth_table}"
         if mode == "key":
-            self.cursor.execute(
-                f"SELECT * FROM {self.auth_table} WHERE user_id = ? AND key = ?",
+            return self._fetchone(
+                f"{columns} WHERE user_id = ? AND key = ?",
                 (user_id, key),
+                self.AuthData.row_factory,
             )
-            output = self.cursor.fetchone()
         elif mode == "recovery":
-            self.cursor.execute(
-                f"SELECT * FROM {self.auth_table} WHERE user_id = ?",
+            return self._fetchone(
+                f"{columns} WHERE user_id = ?",
                 (user_id,),
+                self.AuthData.row_factory,
             )
-            output = self.cursor.fetchone()
+
+    @METRICS.timed("db")
+    def find_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        """
+        Checks that a recovery code exists and has not been used,
+        with a single primary key lookup
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        code_hash : str
+            sha256 hash of the recovery code
+
+        Returns
+        -------
+        bool
+            True if the recovery code is valid, False otherwise
+        """
         return (
-            {
-                "user_id": output[0],
-                "key": output[1],
-                "recovery_codes": output[2],
-            }
-            if output
-            else None
+            self._fetchone(
+                f"SELECT 1 FROM {self.recovery_table} "
+                "WHERE user_id = ? AND code_hash = ? AND consumed = 0",
+                (user_id, code_hash),
+            )
+            is not None
         )
 
-    def find_recovery_code(self, user_id: str, recovery_code: str) -> bool:
+    @METRICS.timed("db")
+    def consume_recovery_code(self, user_id: str, code_hash: str) -> bool:
         """
-        Validates the recovery code.
+        Marks a recovery code as used.
+        The check and the update are a single statement, so a code can only be
+        consumed once even by concurrent callers.
 
         Parameters
         ----------
         user_id : str
             User ID
-        recovery_code : str
-            Recovery code
+        code_hash : str
+            sha256 hash of the recovery code
 
         Returns
         -------
         bool
-            True if the recovery code exists, False otherwise
+            True if the code was valid and is now consumed, False otherwise
+        """
+        with self._write_lock:
+            try:
+                cursor = self.connection.execute(
+                    f"UPDATE {self.recovery_table} SET consumed = 1 "
+                    "WHERE user_id = ? AND code_hash = ? AND consumed = 0",
+                    (user_id, code_hash),
+                )
+            except BaseException:
+                self._rollback()
+                raise
+            consumed = cursor.rowcount == 1
+            cursor.close()
+            self._commit()
+        return consumed
+
+    def recovery_codes(self, user_id: str) -> dict[str, bool]:
+        """
+        Returns the recovery codes of a user
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+
+        Returns
+        -------
+        dict[str, bool]
+            True for the used codes, keyed by sha256 hash
+        """
+        return {
+            code_hash: bool(consumed)
+            for code_hash, consumed in self._fetchall(
+                f"SELECT code_hash, consumed FROM {self.recovery_table} "
+                "WHERE user_id = ?",
+                (user_id,),
+            )
+        }
+
+    @METRICS.timed("db")
+    def replace_recovery_codes(self, user_id: str, code_hashes: list[str]) -> None:
+        """
+        Replaces every recovery code of a user in one transaction
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        code_hashes : list[str]
+            sha256 hashes of the new recovery codes
+        """
+        with self.transaction():
+            self._execute(
+                f"DELETE FROM {self.recovery_table} WHERE user_id = ?", (user_id,)
+            )
+            self._executemany(
+                f"INSERT OR IGNORE INTO {self.recovery_table} (user_id, code_hash) "
+                "VALUES (?, ?)",
+                ((user_id, code_hash) for code_hash in code_hashes),
+            )
+
+    @METRICS.timed("db")
+    def update_key(self, user_id: str, key: str) -> None:
         """
-        auth_data = self.find_auth(user_id, "", mode="recovery")
-        if auth_data:
-            recovery_codes = json.loads(auth_data["recovery_codes"])
-            if recovery_code in recovery_codes:
-                return True
-        return False
+        Updates the password hash of a user
 
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        key : str
+            sha256 hash of the new password
+        """
+        self._execute(
+            f"UPDATE {self.auth_table} SET key = ? WHERE user_id = ?",
+            (key, user_id),
+        )
+
+    def start_rotation(self, user_id: str, old_key: str, new_key: str) -> None:
+        """
+        Records a password change and switches the password hash, in one
+        transaction. From then on the seeds are a mix of both keys until
+        finish_rotation.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        old_key : str
+            sha256 hash of the current password
+        new_key : str
+            sha256 hash of the new password
+        """
+        with self.transaction():
+            self._execute(
+                f"INSERT INTO {self.rotation_table} (user_id, old_key, new_key) "
+                "VALUES (?, ?, ?)",
+                (user_id, old_key, new_key),
+            )
+            self.update_key(user_id, new_key)
+
+    def find_rotation(self, user_id: str) -> RotationData | None:
+        """
+        Finds the checkpoint of an unfinished password change
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+
+        Returns
+        -------
+        RotationData | None
+            Checkpoint, None when no password change is running
+        """
+        return self._fetchone(
+            "SELECT user_id, old_key, new_key, after_service, after_username, "
+            f"rotated FROM {self.rotation_table} WHERE user_id = ?",
+            (user_id,),
+            self.RotationData.row_factory,
+        )
+
+    @METRICS.timed("db")
+    def rotate_batch(
+        self, user_id: str, rows: list[ServiceData], rotated: int
+    ) -> None:
+        """
+        Stores a batch of re-encrypted seeds and moves the checkpoint past it,
+        in one transaction
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        rows : list[ServiceData]
+            Records with their new seeds, in (service, username) order
+        rotated : int
+            Number of records rotated so far, this batch included
+        """
+        last = rows[-1]
+        with self.transaction():
+            self._executemany(
+                f"UPDATE {self.service_table} SET seed = ? "
+                "WHERE user_id = ? AND service = ? AND username = ?",
+                ((row.seed, user_id, row.service, row.username) for row in rows),
+            )
+            self._execute(
+                f"UPDATE {self.rotation_table} SET after_service = ?, "
+                "after_username = ?, rotated = ? WHERE user_id = ?",
+                (last.service, last.username, rotated, user_id),
+            )
+
+    def finish_rotation(self, user_id: str) -> None:
+        """
+        Removes the checkpoint of a completed password change
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        """
+        self._execute(
+            f"DELETE FROM {self.rotation_table} WHERE user_id = ?", (user_id,)
+        )
+
+    @METRICS.timed("db")
     def delete_service(self, user_id: str, service: str) -> None:
         """
         Deletes a service record
@@ -217,12 +1047,12 @@ class Database:
         -------
         None
         """
-        self.cursor.execute(
+        self._execute(
             f"DELETE FROM {self.service_table} WHERE user_id = ? AND service = ?",  # Fixed: Correct table name
             (user_id, service),
         )
-        self.connection.commit()
 
+    @METRICS.timed("db")
     def delete_auth(self, user_id: str) -> None:
         """
         Deletes an auth record
@@ -236,12 +1066,21 @@ class Database:
         -------
         None
         """
-        self.cursor.execute(
-            f"DELETE FROM {self.auth_table} WHERE user_id = ?",
-            (user_id,),
-        )
-        self.connection.commit()
+        with self.transaction():
+            self._execute(
+                f"DELETE FROM {self.auth_table} WHERE user_id = ?",
+                (user_id,),
+            )
+            self._execute(
+                f"DELETE FROM {self.recovery_table} WHERE user_id = ?",
+                (user_id,),
+            )
+            self._execute(
+                f"DELETE FROM {self.rotation_table} WHERE user_id = ?",
+                (user_id,),
+            )
 
+    @METRICS.timed("db")
     def update_service(
         self,
         user_id: str,
@@ -264,11 +1103,10 @@ class Database:
             -------
             None
         """
-        self.cursor.execute(
+        self._execute(
             f"UPDATE {self.service_table} SET username = ?, seed = ? WHERE user_id = ? AND service = ?",
             (data["username"], data["seed"], user_id, service),
         )
-        self.connection.commit()
 
     def is_registered(self) -> bool:
         """
@@ -279,14 +1117,35 @@ class Database:
         bool
             True if the database is registered, False otherwise
         """
-        self.cursor.execute(
-            f"SELECT name FROM sqlite_master WHERE type='table' AND name='{self.auth_table}'",
-        )
-        return self.cursor.fetchone() is not None
+        return self._fetchone(f"SELECT 1 FROM {self.auth_table} LIMIT 1") is not None
+
+    def user_ids(self) -> list[str]:
+        """
+        Returns every registered user
+
+        Returns
+        -------
+        list[str]
+            User IDs, in registration order
+        """
+        return [
+            user_id
+            for (user_id,) in self._fetchall(
+                f"SELECT user_id FROM {self.auth_table} ORDER BY rowid"
+            )
+        ]
 
     def close(self):
         """
-        Closes the database connection
+        Closes every idle pooled read connection, then the writer once the
+        running write or transaction is over. Checked out readers are closed
+        when they are returned.
         """
-        self.cursor.close()
-        self.connection.close()
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            self.connection.close()
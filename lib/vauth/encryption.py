@@ -1,17 +1,30 @@
 import base64
 import hashlib
 import secrets
-from typing import TypedDict
+from typing import TYPE_CHECKING, TypedDict
 
-from cryptography.fernet import Fernet
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet, MultiFernet
 
 
 class Encryption:
     """
     Class to handle encryption and decryption of data.
 
+    A session key can be derived once with unlock() and is then reused by every
+    call made with the same password until lock() wipes it.
+
+    cryptography is imported on first use so commands that never touch a seed
+    start without it.
+
     Methods
     -------
+    unlock(key: str, previous: str | None = None) -> None:
+        Derives the session key and keeps the Fernet instance
+
+    lock() -> None:
+        Wipes the session key
+
     generate_key() -> str:
         Generates a new encryption key
 
@@ -24,6 +37,15 @@ class Encryption:
     decrypt_data(data: ServiceData, key: str) -> ServiceData:
         Decrypts the data using the key provided
 
+    encrypt_many(data: list[ServiceData], key: str) -> list[dict]:
+        Encrypts many records in one call
+
+    decrypt_many(data: list[ServiceData], key: str) -> list[ServiceData]:
+        Decrypts many records in one call
+
+    rotate_many(data: list[ServiceData], old_key: str, new_key: str) -> list:
+        Re-encrypts many records from one password to another
+
     hash_key(key: bytes) -> str:
         Hashes the key using sha256
     """
@@ -39,9 +61,94 @@ class Encryption:
         seed: str
 
     def __init__(self) -> None:
-        pass
+        self._key = None
+        self._derived_key = None
+        self._fernet = None
+
+    @property
+    def unlocked(self) -> bool:
+        return self._fernet is not None
+
+    def derive_key(self, key: str) -> bytes:
+        """
+        Derives the Fernet key from a password.
+        - The key is hashed using sha256
+        - The key is then encoded using base64 and truncated to 32 bytes
+
+        Parameters
+        ----------
+        key: str
+            Password
+
+        Returns
+        -------
+        bytes:
+            Fernet key
+        """
+        key = self.hash_key(key.encode())
+        return base64.urlsafe_b64encode(key[:32].encode())
+
+    def unlock(self, key: str, previous: str | None = None) -> None:
+        """
+        Derives the session key once and keeps the Fernet instance until lock()
+
+        Parameters
+        ----------
+        key: str
+            Password
+        previous: str | None
+            Password being replaced by key. While a password change is running,
+            seeds still encrypted with it are decrypted too, new data is always
+            encrypted with key.
+        """
+        self.lock()
+        from cryptography.fernet import Fernet, MultiFernet
+
+        self._derived_key = bytearray(self.derive_key(key))
+        self._fernet = Fernet(bytes(self._derived_key))
+        if previous is not None:
+            self._fernet = MultiFernet(
+                [self._fernet, Fernet(self.derive_key(previous))]
+            )
+        self._key = key
+
+    def lock(self) -> None:
+        """
+        Wipes the session key
+        """
+        if self._derived_key is not None:
+            for i in range(len(self._derived_key)):
+                self._derived_key[i] = 0
+        self._key = None
+        self._derived_key = None
+        self._fernet = None
+
+    def is_session_key(self, key: str) -> bool:
+        """
+        Checks if the key is the password the session was unlocked with
+
+        Parameters
+        ----------
+        key: str
+            Password
+
+        Returns
+        -------
+        bool:
+            True if the session is unlocked with this password
+        """
+        return self._fernet is not None and key == self._key
+
+    def _get_fernet(self, key: str) -> "Fernet | MultiFernet":
+        if self.is_session_key(key):
+            return self._fernet
+        from cryptography.fernet import Fernet
+
+        return Fernet(self.derive_key(key))
 
     def generate_key(self) -> str:
+        from cryptography.fernet import Fernet
+
         key = Fernet.generate_key()
         return key.decode()
 
@@ -76,9 +183,7 @@ class Encryption:
         dict:
             Encrypted data
         """
-        key = self.hash_key(key.encode())
-        key = base64.urlsafe_b64encode(key[:32].encode())
-        f = Fernet(key)
+        f = self._get_fernet(key)
         data["seed"] = f.encrypt(data["seed"].encode()).decode()
         return data
 
@@ -102,11 +207,110 @@ class Encryption:
         ServiceData:
             Decrypted data
         """
-        key = self.hash_key(key.encode())
-        key = base64.urlsafe_b64encode(key[:32].encode())
-        f = Fernet(key)
+        f = self._get_fernet(key)
         data["seed"] = f.decrypt(data["seed"].encode()).decode()
         return data
 
+    def encrypt_many(
+        self, data: list[ServiceData], key: str, workers: int = 1
+    ) -> list[dict]:
+        """
+        Encrypts many records, deriving the key at most once.
+
+        Parameters
+        ----------
+        data: list[ServiceData]
+            Data to be encrypted
+        key: str
+            Encryption key
+        workers: int
+            Number of worker threads, records are encrypted inline when 1
+
+        Returns
+        -------
+        list[dict]:
+            Encrypted data, in the same order
+        """
+        f = self._get_fernet(key)
+
+        def encrypt(record):
+            record["seed"] = f.encrypt(record["seed"].encode()).decode()
+            return record
+
+        return self._map(encrypt, data, workers)
+
+    def decrypt_many(
+        self, data: list[ServiceData], key: str, workers: int = 1
+    ) -> list[ServiceData]:
+        """
+        Decrypts many records, deriving the key at most once.
+
+        Parameters
+        ----------
+        data: list[ServiceData]
+            Data to be decrypted
+        key: str
+            Encryption key
+        workers: int
+            Number of worker threads, records are decrypted inline when 1
+
+        Returns
+        -------
+        list[ServiceData]:
+            Decrypted data, in the same order
+        """
+        f = self._get_fernet(key)
+
+        def decrypt(record):
+            record["seed"] = f.decrypt(record["seed"].encode()).decode()
+            return record
+
+        return self._map(decrypt, data, workers)
+
+    def rotate_many(
+        self, data: list[ServiceData], old_key: str, new_key: str, workers: int = 1
+    ) -> list[ServiceData]:
+        """
+        Re-encrypts many records with a new password.
+        Seeds already encrypted with new_key are accepted as well, so a batch
+        that was rotated before an interruption can be rotated again.
+
+        Parameters
+        ----------
+        data: list[ServiceData]
+            Records encrypted with old_key or new_key
+        old_key: str
+            Current password
+        new_key: str
+            New password
+        workers: int
+            Number of worker threads, records are rotated inline when 1
+
+        Returns
+        -------
+        list[ServiceData]:
+            Records encrypted with new_key, in the same order
+        """
+        from cryptography.fernet import Fernet, MultiFernet
+
+        f = MultiFernet(
+            [Fernet(self.derive_key(new_key)), Fernet(self.derive_key(old_key))]
+        )
+
+        def rotate(record):
+            record["seed"] = f.rotate(record["seed"].encode()).decode()
+            return record
+
+        return self._map(rotate, data, workers)
+
+    @staticmethod
+    def _map(func, data: list, workers: int) -> list:
+        if workers <= 1 or len(data) < 2:
+            return [func(record) for record in data]
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, data))
+
     def hash_key(self, key: bytes) -> str:
         return hashlib.sha256(key).hexdigest()
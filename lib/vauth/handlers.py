@@ -1,9 +1,17 @@
 import functools
-import logging
+import time
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from vauth.metrics import METRICS
+
+
+def _log_error(error: Exception) -> None:
+    # logging is only needed for unexpected errors, keep it off the startup path.
+    import logging
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    logging.error(error)
 
 
 class ErrorHandler(object):
@@ -20,27 +28,40 @@ class ErrorHandler(object):
             106: ">>INVALID TYPE",
             107: ">>SERVICE ALREADY EXISTS",
             108: ">>PASSWORDS DO NOT MATCH",
+            109: ">>INVALID IMPORT FILE",
+            110: ">>INVALID ARCHIVE OR PASSPHRASE",
+            111: ">>AGENT NOT RUNNING",
+            112: ">>AGENT ALREADY RUNNING",
+            113: ">>INVALID QR FORMAT",
+            114: ">>PASSWORD CHANGE INTERRUPTED, RUN 'vauth passwd' TO RESUME",
+            115: ">>SEED ENCRYPTED UNDER A PREVIOUS PASSWORD",
+            116: ">>RECOVERY CANCELLED",
         }
 
     def __call__(self, func):
+        name = func.__name__
+
         @functools.wraps(func)
         def wrapper(instance, *args, **kwargs):
+            start = time.perf_counter()
             try:
                 if hasattr(instance, "login_state"):
-                    if (
-                        instance.login_state == "register"
-                        and func.__name__ != "register"
-                    ):
+                    if instance.login_state == "register" and name != "register":
                         print(">>USER NOT REGISTERED")
+                        METRICS.count_error(name, "not_registered")
                         return self.default_error_message
                 return func(instance, *args, **kwargs)
             except Exception as e:
                 if e.args:
                     error_code = e.args[0]
                     if error_code in self.error_codes:
+                        METRICS.count_error(name, error_code)
                         print(self.error_codes[error_code])
                         return
-                logging.error(e)
+                METRICS.count_error(name, type(e).__name__)
+                _log_error(e)
                 return self.default_error_message
+            finally:
+                METRICS.observe("command", name, time.perf_counter() - start)
 
         return wrapper
@@ -0,0 +1,259 @@
+import base64
+import itertools
+import json
+import re
+from typing import Iterator, TextIO, TypedDict
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class ImportRecord(TypedDict):
+    """
+    TypedDict to represent a service read from an export
+    """
+
+    service: str
+    username: str
+    seed: str
+
+
+def iter_records(
+    stream: TextIO,
+) -> Iterator[tuple[str, ImportRecord | None, str | None]]:
+    """
+    Streams the services of an export.
+    - otpauth:// URI lists and otpauth-migration:// payloads are read line by line.
+    - Aegis and andOTP JSON exports are detected by their first character.
+
+    Parameters
+    ----------
+    stream : TextIO
+        Export file or stdin
+
+    Yields
+    ------
+    tuple[str, ImportRecord | None, str | None]
+        Position in the export, record, error. Exactly one of record and error is set.
+
+    Raises
+    ------
+    ValueError
+        If the export as a whole cannot be read
+    """
+    first = ""
+    for first in stream:
+        if first.strip():
+            break
+    if first.lstrip().startswith(("{", "[")):
+        yield from _iter_json(json.loads(first + stream.read()))
+        return
+    for number, line in enumerate(itertools.chain([first], stream), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            if line.startswith("otpauth-migration://"):
+                records = parse_migration_uri(line)
+            else:
+                records = [parse_uri(line)]
+        except ValueError as e:
+            yield f"line {number}", None, str(e)
+            continue
+        for index, record in enumerate(records, start=1):
+            position = f"line {number}"
+            if len(records) > 1:
+                position += f"#{index}"
+            if isinstance(record, str):
+                yield position, None, record
+            else:
+                yield position, record, None
+
+
+def parse_uri(uri: str) -> ImportRecord:
+    """
+    Parses an otpauth://totp/ URI
+
+    Parameters
+    ----------
+    uri : str
+        otpauth URI
+
+    Returns
+    -------
+    ImportRecord
+        Parsed record
+
+    Raises
+    ------
+    ValueError
+        If the URI is not a supported TOTP URI
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme != "otpauth":
+        raise ValueError("not an otpauth URI")
+    if parsed.netloc.lower() != "totp":
+        raise ValueError(f"unsupported OTP type: {parsed.netloc}")
+    params = {name: values[0] for name, values in parse_qs(parsed.query).items()}
+    if "secret" not in params:
+        raise ValueError("missing secret")
+    _check_parameters(
+        params.get("algorithm", "SHA1"),
+        params.get("digits", "6"),
+        params.get("period", "30"),
+    )
+    return _make_record(
+        unquote(parsed.path.lstrip("/")), params.get("issuer", ""), params["secret"]
+    )
+
+
+def parse_migration_uri(uri: str) -> list[ImportRecord | str]:
+    """
+    Parses a Google Authenticator otpauth-migration:// URI
+
+    Parameters
+    ----------
+    uri : str
+        otpauth-migration URI
+
+    Returns
+    -------
+    list[ImportRecord | str]
+        Parsed records, or the error of each record that could not be parsed
+
+    Raises
+    ------
+    ValueError
+        If the payload cannot be decoded
+    """
+    params = parse_qs(urlparse(uri).query)
+    if "data" not in params:
+        raise ValueError("missing migration data")
+    try:
+        # parse_qs turns an unescaped "+" of the base64 payload into a space.
+        payload = base64.b64decode(params["data"][0].replace(" ", "+") + "==")
+        entries = [value for field, value in _protobuf_fields(payload) if field == 1]
+    except (ValueError, IndexError):
+        raise ValueError("invalid migration payload")
+    records = []
+    for entry in entries:
+        try:
+            fields = dict(_protobuf_fields(entry))
+        except (ValueError, IndexError):
+            records.append("invalid migration entry")
+            continue
+        # Enum values: algorithm 1 = SHA1, digits 1 = six, type 2 = TOTP.
+        if fields.get(6, 2) != 2:
+            records.append("unsupported OTP type: hotp")
+            continue
+        if fields.get(4, 1) not in (0, 1) or fields.get(5, 1) not in (0, 1):
+            records.append("unsupported OTP parameters")
+            continue
+        seed = base64.b32encode(fields.get(1, b"")).decode().rstrip("=")
+        try:
+            records.append(
+                _make_record(
+                    fields.get(2, b"").decode(), fields.get(3, b"").decode(), seed
+                )
+            )
+        except ValueError as e:
+            records.append(str(e))
+    return records
+
+
+def _iter_json(document) -> Iterator[tuple[str, ImportRecord | None, str | None]]:
+    if isinstance(document, dict) and "db" in document:
+        if not isinstance(document["db"], dict):
+            raise ValueError("encrypted Aegis exports are not supported")
+        entries = document["db"].get("entries", [])
+        parse = _parse_aegis_entry
+    elif isinstance(document, list):
+        entries = document
+        parse = _parse_andotp_entry
+    else:
+        raise ValueError("unknown export format")
+    for number, entry in enumerate(entries, start=1):
+        try:
+            yield f"entry {number}", parse(entry), None
+        except KeyError as e:
+            yield f"entry {number}", None, f"missing {e.args[0]}"
+        except (ValueError, TypeError, AttributeError):
+            yield f"entry {number}", None, "invalid entry"
+
+
+def _parse_aegis_entry(entry: dict) -> ImportRecord:
+    if entry.get("type", "totp").lower() != "totp":
+        raise ValueError(f"unsupported OTP type: {entry['type']}")
+    info = entry["info"]
+    _check_parameters(
+        info.get("algo", "SHA1"), info.get("digits", 6), info.get("period", 30)
+    )
+    return _make_record(
+        entry.get("name", ""), entry.get("issuer", ""), info["secret"]
+    )
+
+
+def _parse_andotp_entry(entry: dict) -> ImportRecord:
+    if entry.get("type", "TOTP").upper() != "TOTP":
+        raise ValueError(f"unsupported OTP type: {entry['type']}")
+    _check_parameters(
+        entry.get("algorithm", "SHA1"),
+        entry.get("digits", 6),
+        entry.get("period", 30),
+    )
+    return _make_record(
+        entry.get("label", ""), entry.get("issuer", ""), entry["secret"]
+    )
+
+
+def _check_parameters(algorithm, digits, period) -> None:
+    # Only the seed is stored, codes are always generated as SHA1 / 6 digits / 30s.
+    if str(algorithm).upper() != "SHA1" or int(digits) != 6 or int(period) != 30:
+        raise ValueError("unsupported OTP parameters")
+
+
+def _make_record(label: str, issuer: str, seed: str) -> ImportRecord:
+    account = label
+    if ":" in label:
+        label_issuer, account = label.split(":", 1)
+        issuer = issuer or label_issuer
+    service = _clean(issuer) or _clean(account)
+    username = _clean(account) or service
+    if not service:
+        raise ValueError("missing service name")
+    seed = re.sub(r"\s+", "", seed).upper().rstrip("=")
+    return ImportRecord(service=service, username=username, seed=seed)
+
+
+def _clean(name: str) -> str:
+    # The shell splits arguments on whitespace, so names must not contain any.
+    return re.sub(r"\s+", "_", name.strip())
+
+
+def _read_varint(buffer: bytes, position: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _protobuf_fields(buffer: bytes) -> Iterator[tuple[int, int | bytes]]:
+    position = 0
+    while position < len(buffer):
+        tag, position = _read_varint(buffer, position)
+        field, wire_type = tag >> 3, tag & 0x07
+        if wire_type == 0:
+            value, position = _read_varint(buffer, position)
+        elif wire_type == 2:
+            length, position = _read_varint(buffer, position)
+            value = buffer[position : position + length]
+            position += length
+        elif wire_type in (1, 5):
+            size = 8 if wire_type == 1 else 4
+            value = buffer[position : position + size]
+            position += size
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+        yield field, value
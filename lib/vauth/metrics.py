@@ -0,0 +1,237 @@
+import bisect
+import functools
+import re
+import threading
+import time
+
+# Latency buckets in seconds, shared by every histogram.
+BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+
+_TABLE = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)",
+    re.IGNORECASE,
+)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram
+
+    Methods
+    -------
+    observe(seconds: float) -> None:
+        Records a latency
+    quantile(q: float) -> float:
+        Estimates a quantile from the buckets
+    """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket holding it
+
+        Parameters
+        ----------
+        q : float
+            Quantile between 0 and 1
+
+        Returns
+        -------
+        float
+            Upper bound in seconds, inf when it falls in the overflow bucket
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Process-wide registry of command, database and SQLite metrics
+
+    Methods
+    -------
+    observe(kind: str, name: str, seconds: float) -> None:
+        Records the latency of a command or database call
+    count_error(command: str, code) -> None:
+        Counts an error raised by a command
+    count_statement(sql: str) -> None:
+        Counts an SQLite statement
+    timed(kind: str) -> Callable:
+        Decorator recording the latency of a function
+    summary() -> str:
+        Human readable summary
+    to_prometheus() -> str:
+        Prometheus text exposition format
+    dump(path: str) -> None:
+        Writes the Prometheus text format to a file
+    reset() -> None:
+        Clears every metric
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.latency: dict[tuple[str, str], Histogram] = {}
+            self.errors: dict[tuple[str, str], int] = {}
+            self.statements: dict[tuple[str, str], int] = {}
+
+    def observe(self, kind: str, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.latency.get((kind, name))
+            if histogram is None:
+                histogram = self.latency[(kind, name)] = Histogram()
+            histogram.observe(seconds)
+
+    def count_error(self, command: str, code) -> None:
+        key = (command, str(code))
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def count_statement(self, sql: str) -> None:
+        words = sql.split(None, 1)
+        table = _TABLE.search(sql)
+        key = (words[0].upper() if words else "", table.group(1) if table else "")
+        with self._lock:
+            self.statements[key] = self.statements.get(key, 0) + 1
+
+    def timed(self, kind: str):
+        """
+        Decorator recording the latency of every call of a function
+
+        Parameters
+        ----------
+        kind : str
+            Metric family, "command" or "db"
+        """
+
+        def decorator(func):
+            name = func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(kind, name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self) -> str:
+        """
+        Returns a table of call counts, latencies, errors and statements
+        """
+        with self._lock:
+            lines = [
+                f"{'CALL':<28}{'COUNT':>8}{'AVG ms':>10}{'P50 ms':>10}{'P99 ms':>10}"
+            ]
+            for (kind, name), h in sorted(self.latency.items()):
+                lines.append(
+                    f"{kind + '.' + name:<28}{h.count:>8}{h.sum / h.count * 1e3:>10.3f}"
+                    f"{h.quantile(0.5) * 1e3:>10.3f}{h.quantile(0.99) * 1e3:>10.3f}"
+                )
+            if self.errors:
+                lines.append(f"\n{'ERROR':<28}{'COUNT':>8}")
+                for (command, code), count in sorted(self.errors.items()):
+                    lines.append(f"{command + ' ' + code:<28}{count:>8}")
+            if self.statements:
+                lines.append(f"\n{'SQLITE STATEMENT':<28}{'COUNT':>8}")
+                for (operation, table), count in sorted(self.statements.items()):
+                    lines.append(f"{(operation + ' ' + table).strip():<28}{count:>8}")
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        families = {
+            "command": "vauth_command_duration_seconds",
+            "db": "vauth_db_duration_seconds",
+        }
+        labels = {"command": "command", "db": "method"}
+        out = []
+        with self._lock:
+            for kind, family in families.items():
+                out.append(f"# HELP {family} Latency of vAUTH {kind} calls.")
+                out.append(f"# TYPE {family} histogram")
+                for (k, name), h in sorted(self.latency.items()):
+                    if k != kind:
+                        continue
+                    label = f'{labels[kind]}="{_escape(name)}"'
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, h.counts):
+                        cumulative += count
+                        out.append(
+                            f'{family}_bucket{{{label},le="{bound}"}} {cumulative}'
+                        )
+                    out.append(f'{family}_bucket{{{label},le="+Inf"}} {h.count}')
+                    out.append(f"{family}_sum{{{label}}} {h.sum}")
+                    out.append(f"{family}_count{{{label}}} {h.count}")
+            out.append("# HELP vauth_command_errors_total Errors raised by commands.")
+            out.append("# TYPE vauth_command_errors_total counter")
+            for (command, code), count in sorted(self.errors.items()):
+                out.append(
+                    f'vauth_command_errors_total{{command="{_escape(command)}",'
+                    f'code="{_escape(code)}"}} {count}'
+                )
+            out.append("# HELP vauth_sqlite_statements_total SQLite statements run.")
+            out.append("# TYPE vauth_sqlite_statements_total counter")
+            for (operation, table), count in sorted(self.statements.items()):
+                out.append(
+                    f'vauth_sqlite_statements_total{{operation="{_escape(operation)}",'
+                    f'table="{_escape(table)}"}} {count}'
+                )
+        return "\n".join(out) + "\n"
+
+    def dump(self, path: str) -> None:
+        """
+        Writes the Prometheus text format to a file
+
+        Parameters
+        ----------
+        path : str
+            Output file
+        """
+        with open(path, "w") as f:
+            f.write(self.to_prometheus())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics()
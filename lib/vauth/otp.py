@@ -0,0 +1,307 @@
+import base64
+import hashlib
+import hmac
+import time
+
+
+class OTPEngine:
+    """
+    Batched TOTP engine.
+    - Every base32 seed is decoded once and kept as a keyed HMAC state.
+    - Codes for every registered seed are produced in a single call.
+    - A seed is only recomputed when its time step counter changes.
+
+    Methods
+    -------
+    add(name: str, seed: str, interval=30, digits=6, digest="sha1") -> None:
+        Registers a seed under a name
+    load(seeds: dict[str, str]) -> list[str]:
+        Registers many seeds, returns the names of the invalid ones
+    remove(name: str) -> None:
+        Removes a seed
+    clear() -> None:
+        Removes every seed
+    code(name: str, now: float | None = None) -> str:
+        Returns the code of a single seed
+    codes(now: float | None = None) -> dict[str, str]:
+        Returns the codes of every seed for the current time step
+    remaining(name: str, now: float | None = None) -> float:
+        Returns the seconds left in the current time step of a seed
+    code_at(name: str, counter: int) -> str:
+        Returns the code of a seed for any time step
+    intervals() -> list[int]:
+        Returns the distinct time steps of the registered seeds
+    next_change(now: float | None = None) -> float:
+        Returns the time at which the next code changes
+    """
+
+    class _Entry:
+        """
+        Precomputed state of a single seed
+        """
+
+        __slots__ = ("name", "mac", "interval", "digits", "modulo", "counter")
+
+        def __init__(self, name: str, mac, interval: int, digits: int) -> None:
+            self.name = name
+            self.mac = mac
+            self.interval = interval
+            self.digits = digits
+            self.modulo = 10**digits
+            self.counter = -1
+
+    def __init__(self) -> None:
+        self._entries: dict[str, OTPEngine._Entry] = {}
+        self._groups: dict[int, dict[str, OTPEngine._Entry]] = {}
+        self._counters: dict[int, int] = {}
+        self._codes: dict[str, str] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def decode_seed(seed: str) -> bytes:
+        """
+        Decodes a base32 seed, padding it like pyotp does
+
+        Parameters
+        ----------
+        seed : str
+            Base32 seed
+
+        Returns
+        -------
+        bytes
+            Raw secret
+
+        Raises
+        ------
+        ValueError
+            If the seed is not valid base32
+        """
+        seed = seed.strip().replace(" ", "")
+        missing_padding = len(seed) % 8
+        if missing_padding:
+            seed += "=" * (8 - missing_padding)
+        secret = base64.b32decode(seed, casefold=True)
+        if not secret:
+            raise ValueError("empty seed")
+        return secret
+
+    def add(
+        self,
+        name: str,
+        seed: str,
+        interval: int = 30,
+        digits: int = 6,
+        digest: str = "sha1",
+    ) -> None:
+        """
+        Registers a seed under a name, replacing any previous one
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry
+        seed : str
+            Base32 seed
+        interval : int
+            Time step in seconds
+        digits : int
+            Number of digits of the code
+        digest : str
+            Name of the HMAC digest
+
+        Raises
+        ------
+        ValueError
+            If the seed is not valid base32
+        """
+        mac = hmac.new(self.decode_seed(seed), digestmod=getattr(hashlib, digest))
+        self.remove(name)
+        entry = self._Entry(name, mac, interval, digits)
+        self._entries[name] = entry
+        self._groups.setdefault(interval, {})[name] = entry
+        if interval in self._counters:
+            self._compute(entry, self._counters[interval])
+
+    def load(self, seeds: dict[str, str]) -> list[str]:
+        """
+        Registers many seeds with the default parameters
+
+        Parameters
+        ----------
+        seeds : dict[str, str]
+            Mapping of names to base32 seeds
+
+        Returns
+        -------
+        list[str]
+            Names of the seeds that could not be decoded
+        """
+        invalid = []
+        for name, seed in seeds.items():
+            try:
+                self.add(name, seed)
+            except (ValueError, TypeError):
+                invalid.append(name)
+        return invalid
+
+    def remove(self, name: str) -> None:
+        """
+        Removes a seed, does nothing if it is not registered
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry
+        """
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self._codes.pop(name, None)
+        group = self._groups[entry.interval]
+        del group[name]
+        if not group:
+            del self._groups[entry.interval]
+            self._counters.pop(entry.interval, None)
+
+    def clear(self) -> None:
+        """
+        Removes every seed
+        """
+        self._entries.clear()
+        self._groups.clear()
+        self._counters.clear()
+        self._codes.clear()
+
+    def code(self, name: str, now: float | None = None) -> str:
+        """
+        Returns the code of a single seed
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry
+        now : float | None
+            Unix time, defaults to the current time
+
+        Returns
+        -------
+        str
+            Current code
+        """
+        entry = self._entries[name]
+        counter = int((time.time() if now is None else now) // entry.interval)
+        if entry.counter != counter:
+            self._compute(entry, counter)
+        return self._codes[name]
+
+    def codes(self, now: float | None = None) -> dict[str, str]:
+        """
+        Returns the codes of every seed for the current time step.
+        Groups whose counter did not change since the last call are not recomputed.
+
+        Parameters
+        ----------
+        now : float | None
+            Unix time, defaults to the current time
+
+        Returns
+        -------
+        dict[str, str]
+            Mapping of names to codes
+        """
+        if now is None:
+            now = time.time()
+        for interval, group in self._groups.items():
+            counter = int(now // interval)
+            if self._counters.get(interval) == counter:
+                continue
+            self._counters[interval] = counter
+            compute = self._compute
+            for entry in group.values():
+                if entry.counter != counter:
+                    compute(entry, counter)
+        return dict(self._codes)
+
+    def remaining(self, name: str, now: float | None = None) -> float:
+        """
+        Returns the seconds left in the current time step of a seed
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry
+        now : float | None
+            Unix time, defaults to the current time
+
+        Returns
+        -------
+        float
+            Seconds until the code changes
+        """
+        interval = self._entries[name].interval
+        return interval - (time.time() if now is None else now) % interval
+
+    def code_at(self, name: str, counter: int) -> str:
+        """
+        Returns the code of a seed for any time step, without caching it
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry
+        counter : int
+            Time step, unix time // interval
+
+        Returns
+        -------
+        str
+            Code of that time step
+        """
+        return self._hotp(self._entries[name], counter)
+
+    def interval(self, name: str) -> int:
+        return self._entries[name].interval
+
+    def intervals(self) -> list[int]:
+        return sorted(self._groups)
+
+    def next_change(self, now: float | None = None) -> float:
+        """
+        Returns the time at which the next code changes, the closest time step
+        boundary among every registered interval
+
+        Parameters
+        ----------
+        now : float | None
+            Unix time, defaults to the current time
+
+        Returns
+        -------
+        float
+            Unix time, inf when no seed is registered
+        """
+        if now is None:
+            now = time.time()
+        return min(
+            ((now // interval + 1) * interval for interval in self._groups),
+            default=float("inf"),
+        )
+
+    def _compute(self, entry: "OTPEngine._Entry", counter: int) -> None:
+        self._codes[entry.name] = self._hotp(entry, counter)
+        entry.counter = counter
+
+    @staticmethod
+    def _hotp(entry: "OTPEngine._Entry", counter: int) -> str:
+        mac = entry.mac.copy()
+        mac.update(counter.to_bytes(8, "big"))
+        digest = mac.digest()
+        offset = digest[-1] & 0x0F
+        value = int.from_bytes(digest[offset : offset + 4], "big") & 0x7FFFFFFF
+        return str(value % entry.modulo).zfill(entry.digits)
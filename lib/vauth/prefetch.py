@@ -0,0 +1,142 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from vauth.cache import SeedCache
+from vauth.encryption import Encryption
+from vauth.storage import Storage
+
+
+class Prefetcher:
+    """
+    Warms the session up in the background after login.
+    - A loader thread opens its own reader and streams the user's services.
+    - Batches are decrypted on a thread pool and stored in the seed cache.
+    - At most cache.max_size seeds are decrypted, the rest is left to lookups.
+
+    Methods
+    -------
+    start() -> None:
+        Starts the warm-up
+    wait_for(key: tuple[str, str, str], timeout: float | None = None) -> None:
+        Waits for a single entry if it is being prefetched
+    invalidate_service(user_id: str, service: str) -> None:
+        Keeps pending results of a service out of the cache
+    stop() -> None:
+        Cancels the warm-up and waits for the workers
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        enc: Encryption,
+        cache: SeedCache,
+        user_id: str,
+        key: str,
+        workers: int = 2,
+        batch_size: int = 64,
+    ) -> None:
+        self.storage = storage
+        self.enc = enc
+        self.cache = cache
+        self.user_id = user_id
+        self.key = key
+        self.batch_size = batch_size
+        self.services: list[tuple[str, str]] = []
+        self.done = threading.Event()
+        self._pending: dict[tuple[str, str, str], Future] = {}
+        self._skip: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="vauth-prefetch"
+        )
+        self._loader = threading.Thread(
+            target=self._load, name="vauth-prefetch-loader", daemon=True
+        )
+
+    def start(self) -> None:
+        """
+        Starts the warm-up, returns immediately
+        """
+        self._loader.start()
+
+    def wait_for(
+        self, key: tuple[str, str, str], timeout: float | None = None
+    ) -> None:
+        """
+        Waits for a single entry if it is being prefetched
+
+        Parameters
+        ----------
+        key : tuple[str, str, str]
+            (user_id, service, username)
+        timeout : float | None
+            Seconds to wait at most
+        """
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+    def invalidate_service(self, user_id: str, service: str) -> None:
+        """
+        Keeps pending results of a service out of the cache
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        service : str
+            Service name
+        """
+        with self._lock:
+            self._skip.add((user_id, service))
+
+    def stop(self) -> None:
+        """
+        Cancels the pending work and waits for the running batches
+        """
+        self._stopped.set()
+        if self._loader.is_alive():
+            self._loader.join()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _load(self) -> None:
+        try:
+            with self.storage.reader() as db:
+                budget = self.cache.max_size
+                for batch in db.iter_services(self.user_id, self.batch_size):
+                    if self._stopped.is_set():
+                        break
+                    self.services.extend((r.service, r.username) for r in batch)
+                    if budget <= 0:
+                        continue
+                    batch = batch[:budget]
+                    budget -= len(batch)
+                    keys = [(self.user_id, r.service, r.username) for r in batch]
+                    with self._lock:
+                        future = self._executor.submit(self._decrypt, batch)
+                        for key in keys:
+                            self._pending[key] = future
+                    future.add_done_callback(
+                        lambda _, keys=keys: self._release(keys)
+                    )
+        finally:
+            self.done.set()
+
+    def _decrypt(self, batch: list) -> None:
+        if self._stopped.is_set():
+            return
+        for row in self.enc.decrypt_many(batch, self.key):
+            with self._lock:
+                if (row.user_id, row.service) in self._skip:
+                    continue
+                self.cache.put((row.user_id, row.service, row.username), row.seed)
+
+    def _release(self, keys: list) -> None:
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
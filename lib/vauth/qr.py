@@ -0,0 +1,316 @@
+import hashlib
+import os
+import re
+import struct
+import threading
+import zlib
+
+# A matrix is a tuple of rows, each row holds one byte per module, 1 for dark.
+Matrix = tuple[bytes, ...]
+
+FORMATS = ("txt", "svg", "png")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def matrix(uri: str) -> Matrix:
+    """
+    Computes the module matrix of a QR code, without the quiet zone
+
+    Parameters
+    ----------
+    uri : str
+        Encoded text, usually an otpauth:// provisioning URI
+
+    Returns
+    -------
+    Matrix
+        Rows of modules
+    """
+    from qrcode.main import QRCode
+
+    qr = QRCode(border=0)
+    qr.add_data(uri)
+    qr.make(fit=True)
+    return tuple(bytes(row) for row in qr.modules)
+
+
+def render_ascii(modules: Matrix, border: int = 4, invert: bool = False) -> str:
+    """
+    Renders a matrix with half block characters, two module rows per line
+
+    Parameters
+    ----------
+    modules : Matrix
+        Module matrix
+    border : int
+        Quiet zone, in modules
+    invert : bool
+        Swap dark and light, for terminals with a light background
+
+    Returns
+    -------
+    str
+        Lines of the code
+    """
+    chars = ("█", "▄", "▀", " ") if invert else (" ", "▀", "▄", "█")
+    size = len(modules) + 2 * border
+    blank = bytes(size)
+    rows = [blank] * border
+    rows += [bytes(border) + row + bytes(border) for row in modules]
+    rows += [blank] * (border + (size % 2))
+    lines = []
+    for top, bottom in zip(rows[::2], rows[1::2]):
+        lines.append("".join(chars[t | b << 1] for t, b in zip(top, bottom)))
+    return "\n".join(lines)
+
+
+def render_svg(modules: Matrix, scale: int = 8, border: int = 4) -> str:
+    """
+    Renders a matrix as an SVG document, one path for every dark module run
+
+    Parameters
+    ----------
+    modules : Matrix
+        Module matrix
+    scale : int
+        Size of a module, in pixels
+    border : int
+        Quiet zone, in modules
+
+    Returns
+    -------
+    str
+        SVG document
+    """
+    size = len(modules) + 2 * border
+    path = []
+    for y, row in enumerate(modules, border):
+        for run in re.finditer(b"\x01+", row):
+            x = run.start() + border
+            path.append(f"M{x},{y}h{run.end() - run.start()}v1H{x}z")
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        f'width="{size * scale}" height="{size * scale}" viewBox="0 0 {size} {size}" '
+        'shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/></svg>\n'
+    )
+
+
+def render_png(modules: Matrix, scale: int = 8, border: int = 4) -> bytes:
+    """
+    Renders a matrix as a 1 bit grayscale PNG
+
+    Parameters
+    ----------
+    modules : Matrix
+        Module matrix
+    scale : int
+        Size of a module, in pixels
+    border : int
+        Quiet zone, in modules
+
+    Returns
+    -------
+    bytes
+        PNG file
+    """
+    size = len(modules) + 2 * border
+    width = size * scale
+    padding = -width % 8
+    blank = b"\x00" + _pack_bits("1" * width + "0" * padding)
+    lines = []
+    for row in modules:
+        # 0 bits are black, every module is repeated scale times.
+        bits = "".join("0" if module else "1" for module in row)
+        bits = "1" * border + bits + "1" * border
+        line = b"\x00" + _pack_bits(
+            "".join(bit * scale for bit in bits) + "0" * padding
+        )
+        lines.extend([line] * scale)
+    quiet = [blank] * (border * scale)
+    raw = b"".join(quiet + lines + quiet)
+    return b"".join(
+        (
+            PNG_SIGNATURE,
+            _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, width, 1, 0, 0, 0, 0)),
+            _png_chunk(b"IDAT", zlib.compress(raw, 9)),
+            _png_chunk(b"IEND", b""),
+        )
+    )
+
+
+def render(modules: Matrix, fmt: str) -> bytes:
+    """
+    Renders a matrix in one of FORMATS
+
+    Parameters
+    ----------
+    modules : Matrix
+        Module matrix
+    fmt : str
+        "txt", "svg" or "png"
+
+    Returns
+    -------
+    bytes
+        File contents
+
+    Raises
+    ------
+    ValueError
+        If the format is unknown
+    """
+    if fmt == "png":
+        return render_png(modules)
+    if fmt == "svg":
+        return render_svg(modules).encode()
+    if fmt == "txt":
+        return (render_ascii(modules) + "\n").encode()
+    raise ValueError(f"unknown QR format {fmt!r}")
+
+
+def write(path: str, data: bytes) -> None:
+    """
+    Writes a rendered code, readable by the owner only since it holds a seed
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+
+
+def filename(service: str, username: str, fmt: str) -> str:
+    """
+    Returns a file name for a service, unsafe characters are replaced by _.
+    A hash of the service and username keeps services whose names only differ
+    in replaced characters, or in where _ splits them, from sharing a file.
+    """
+    name = re.sub(r"[^\w.@+-]", "_", f"{service}_{username}").lstrip(".")
+    digest = hashlib.sha256(f"{service}\0{username}".encode()).hexdigest()
+    return f"{name}-{digest[:12]}.{fmt}"
+
+
+def export_one(uri: str, path: str, fmt: str) -> str:
+    """
+    Computes, renders and writes a single code, runs in the worker processes
+    of export_all
+    """
+    write(path, render(matrix(uri), fmt))
+    return path
+
+
+def export_all(
+    jobs: list[tuple[str, str]], fmt: str, workers: int | None = None
+) -> list[str]:
+    """
+    Renders many codes on a process pool, the QR encoder is pure Python
+
+    Parameters
+    ----------
+    jobs : list[tuple[str, str]]
+        (uri, path) of every code
+    fmt : str
+        "txt", "svg" or "png"
+    workers : int | None
+        Number of processes, defaults to the number of CPUs.
+        Codes are rendered inline when 1.
+
+    Returns
+    -------
+    list[str]
+        Written paths, in the same order
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown QR format {fmt!r}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        return [export_one(uri, path, fmt) for uri, path in jobs]
+    from concurrent.futures import ProcessPoolExecutor
+
+    uris, paths = zip(*jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                export_one,
+                uris,
+                paths,
+                [fmt] * len(jobs),
+                chunksize=max(1, len(jobs) // (workers * 4)),
+            )
+        )
+
+
+class MatrixCache:
+    """
+    Module matrices of the codes shown in this session.
+    - Entries are keyed by (user_id, service, username) and hold a digest of
+      the URI, a changed seed or username never returns a stale code.
+    - invalidate_service drops every username of a service when it is
+      modified or removed.
+
+    Methods
+    -------
+    get(key: tuple[str, str, str], uri: str) -> Matrix:
+        Returns the matrix of a code, computing it on a miss
+    invalidate_service(user_id: str, service: str) -> None:
+        Drops every username of a service
+    clear() -> None:
+        Drops every entry
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, str, str], tuple[bytes, Matrix]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple[str, str, str], uri: str) -> Matrix:
+        """
+        Returns the matrix of a code, computing it on a miss
+
+        Parameters
+        ----------
+        key : tuple[str, str, str]
+            (user_id, service, username)
+        uri : str
+            Provisioning URI of the code
+
+        Returns
+        -------
+        Matrix
+            Module matrix
+        """
+        digest = hashlib.sha256(uri.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == digest:
+            return entry[1]
+        modules = matrix(uri)
+        with self._lock:
+            self._entries[key] = (digest, modules)
+        return modules
+
+    def invalidate_service(self, user_id: str, service: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[:2] == (user_id, service)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _pack_bits(bits: str) -> bytes:
+    return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
@@ -0,0 +1,201 @@
+import bisect
+import threading
+from typing import Iterable
+
+
+class ServiceIndex:
+    """
+    In-memory prefix index over the (service, username) pairs of a vault.
+    - Service names, distinct names (services and usernames together) and the
+      usernames of every service are kept in sorted lists. A prefix is a
+      contiguous range found with two binary searches, so completion does not
+      depend on the size of the vault.
+    - Search terms are the casefolded service names and usernames, kept in
+      one sorted list of (term, service, username).
+    - Updates insert into or delete from the sorted lists, nothing is rebuilt.
+
+    Methods
+    -------
+    add(service: str, username: str) -> None:
+        Indexes a pair
+    remove_service(service: str) -> None:
+        Drops every username of a service
+    services(prefix: str = "") -> list[str]:
+        Returns the service names starting with a prefix
+    usernames(service: str, prefix: str = "") -> list[str]:
+        Returns the usernames of a service starting with a prefix
+    names(prefix: str = "") -> list[str]:
+        Returns the service names and usernames starting with a prefix
+    pairs() -> list[tuple[str, str]]:
+        Returns every pair, sorted
+    search(query: str, limit: int | None = None) -> list[tuple[str, str]]:
+        Returns the pairs whose service or username starts with the query
+    contains(query: str, limit: int | None = None) -> list[tuple[str, str]]:
+        Returns the pairs whose service or username contains the query
+    """
+
+    def __init__(self, pairs: Iterable[tuple[str, str]] = ()) -> None:
+        self._services: list[str] = []
+        self._usernames: dict[str, list[str]] = {}
+        self._terms: list[tuple[str, str, str]] = []
+        self._name_counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+        counts = self._name_counts
+        terms = self._terms
+        # Sorted pairs leave every list of usernames sorted as it is built.
+        for service, username in sorted(pairs):
+            usernames = self._usernames.get(service)
+            if usernames is None:
+                usernames = self._usernames[service] = []
+                self._services.append(service)
+            usernames.append(username)
+            terms.append((service.casefold(), service, username))
+            terms.append((username.casefold(), service, username))
+            counts[service] = counts.get(service, 0) + 1
+            counts[username] = counts.get(username, 0) + 1
+        self._names = sorted(counts)
+        terms.sort()
+
+    def __len__(self) -> int:
+        return len(self._terms) // 2
+
+    def __contains__(self, pair: tuple[str, str]) -> bool:
+        service, username = pair
+        usernames = self._usernames.get(service, ())
+        index = bisect.bisect_left(usernames, username)
+        return index < len(usernames) and usernames[index] == username
+
+    def add(self, service: str, username: str) -> None:
+        """
+        Indexes a pair, does nothing if it is already indexed
+        """
+        with self._lock:
+            if (service, username) in self:
+                return
+            usernames = self._usernames.get(service)
+            if usernames is None:
+                usernames = self._usernames[service] = []
+                bisect.insort(self._services, service)
+            bisect.insort(usernames, username)
+            bisect.insort(self._terms, (service.casefold(), service, username))
+            bisect.insort(self._terms, (username.casefold(), service, username))
+            for name in (service, username):
+                self._count_name(name, 1)
+
+    def remove_service(self, service: str) -> None:
+        """
+        Drops every username of a service
+        """
+        with self._lock:
+            usernames = self._usernames.pop(service, None)
+            if usernames is None:
+                return
+            del self._services[bisect.bisect_left(self._services, service)]
+            for username in usernames:
+                for term in (service.casefold(), username.casefold()):
+                    entry = (term, service, username)
+                    del self._terms[bisect.bisect_left(self._terms, entry)]
+                for name in (service, username):
+                    self._count_name(name, -1)
+
+    def services(self, prefix: str = "") -> list[str]:
+        """
+        Returns the service names starting with a prefix, sorted
+        """
+        return _prefix_range(self._services, prefix)
+
+    def usernames(self, service: str, prefix: str = "") -> list[str]:
+        """
+        Returns the usernames of a service starting with a prefix, sorted
+        """
+        return _prefix_range(self._usernames.get(service, []), prefix)
+
+    def names(self, prefix: str = "") -> list[str]:
+        """
+        Returns the service names and usernames starting with a prefix, sorted
+        """
+        return _prefix_range(self._names, prefix)
+
+    def pairs(self) -> list[tuple[str, str]]:
+        """
+        Returns every (service, username) pair, sorted
+        """
+        return [
+            (service, username)
+            for service in self._services
+            for username in self._usernames[service]
+        ]
+
+    def search(self, query: str, limit: int | None = None) -> list[tuple[str, str]]:
+        """
+        Returns the pairs whose service or username starts with the query,
+        ignoring case
+
+        Parameters
+        ----------
+        query : str
+            Prefix
+        limit : int | None
+            Maximum number of pairs
+
+        Returns
+        -------
+        list[tuple[str, str]]
+            (service, username) pairs, sorted
+        """
+        query = query.casefold()
+        terms = self._terms
+        index = bisect.bisect_left(terms, (query,))
+        found = set()
+        while index < len(terms) and terms[index][0].startswith(query):
+            found.add(terms[index][1:])
+            if limit is not None and len(found) >= limit:
+                break
+            index += 1
+        return sorted(found)
+
+    def contains(self, query: str, limit: int | None = None) -> list[tuple[str, str]]:
+        """
+        Returns the pairs whose service or username contains the query,
+        ignoring case. Scans every term, see Database.search_services for an
+        indexed substring search.
+
+        Parameters
+        ----------
+        query : str
+            Substring
+        limit : int | None
+            Maximum number of pairs
+
+        Returns
+        -------
+        list[tuple[str, str]]
+            (service, username) pairs, sorted
+        """
+        query = query.casefold()
+        found = set()
+        for term, service, username in self._terms:
+            if query in term:
+                found.add((service, username))
+                if limit is not None and len(found) >= limit:
+                    break
+        return sorted(found)
+
+    def _count_name(self, name: str, delta: int) -> None:
+        count = self._name_counts.get(name, 0) + delta
+        if count > 0:
+            if name not in self._name_counts:
+                bisect.insort(self._names, name)
+            self._name_counts[name] = count
+        else:
+            del self._name_counts[name]
+            del self._names[bisect.bisect_left(self._names, name)]
+
+
+def _prefix_range(values: list[str], prefix: str) -> list[str]:
+    start = bisect.bisect_left(values, prefix)
+    if not prefix:
+        return values[start:]
+    # Every string starting with the prefix sorts before prefix + U+10FFFF.
+    end = bisect.bisect_left(values, prefix + "\U0010ffff", start)
+    return values[start:end]
@@ -0,0 +1,329 @@
+import bisect
+import contextlib
+import copy
+import sqlite3
+import threading
+from typing import ContextManager, Iterator, Protocol, runtime_checkable
+
+from vauth.database import Database
+
+ServiceData = Database.ServiceData
+AuthData = Database.AuthData
+RotationData = Database.RotationData
+
+# Database is the SQLite implementation of Storage.
+SQLiteStorage = Database
+
+UNIQUE_SERVICE = (
+    "UNIQUE constraint failed: services.user_id, services.service, services.username"
+)
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """
+    Operations Commands needs from a vault store.
+    Database (SQLite), MemoryStorage and vauth.vault.VaultStorage implement it,
+    see Database for the meaning of every method.
+    - Records are ServiceData, AuthData and RotationData rows. Callers may
+      modify the rows they get, stored records are never affected.
+    - A duplicate (user_id, service, username) raises sqlite3.IntegrityError,
+      whatever the implementation, and a failed batch stores nothing.
+    """
+
+    path: str | None
+    pooled: bool
+    service_table: str
+    auth_table: str
+
+    def insert_one(self, data, table_name: str) -> None: ...
+
+    def insert_many(self, data: list[ServiceData]) -> None: ...
+
+    def find_service(
+        self, user_id: str, username: str, service: str
+    ) -> ServiceData | None: ...
+
+    def service_keys(self, user_id: str) -> set[tuple[str, str]]: ...
+
+    def iter_services(
+        self, user_id: str, batch_size: int = 500
+    ) -> Iterator[list[ServiceData]]: ...
+
+    def page_services(
+        self, user_id: str, after: tuple[str, str] | None = None, limit: int = 500
+    ) -> list[ServiceData]: ...
+
+    def find_auth(self, user_id: str, key: str, mode="key") -> AuthData | None: ...
+
+    def find_recovery_code(self, user_id: str, code_hash: str) -> bool: ...
+
+    def consume_recovery_code(self, user_id: str, code_hash: str) -> bool: ...
+
+    def replace_recovery_codes(self, user_id: str, code_hashes: list[str]) -> None: ...
+
+    def update_key(self, user_id: str, key: str) -> None: ...
+
+    def start_rotation(self, user_id: str, old_key: str, new_key: str) -> None: ...
+
+    def find_rotation(self, user_id: str) -> RotationData | None: ...
+
+    def rotate_batch(
+        self, user_id: str, rows: list[ServiceData], rotated: int
+    ) -> None: ...
+
+    def finish_rotation(self, user_id: str) -> None: ...
+
+    def delete_service(self, user_id: str, service: str) -> None: ...
+
+    def delete_auth(self, user_id: str) -> None: ...
+
+    def update_service(
+        self, user_id: str, service: str, data: ServiceData
+    ) -> None: ...
+
+    def is_registered(self) -> bool: ...
+
+    def create_search_index(self) -> bool: ...
+
+    def has_search_index(self) -> bool: ...
+
+    def search_services(
+        self, user_id: str, query: str, limit: int = 50
+    ) -> list[tuple[str, str]]: ...
+
+    def transaction(self) -> ContextManager: ...
+
+    def reader(self) -> ContextManager: ...
+
+    def close(self) -> None: ...
+
+
+class MemoryStorage:
+    """
+    Dict-backed Storage with the semantics of Database, nothing is persisted.
+    - Services are kept per user in a dict keyed by (service, username) and a
+      sorted list of those keys for paging.
+    - Every method is atomic and the storage can be shared between threads.
+    - transaction() snapshots the data and restores it if the block fails.
+
+    Useful for tests, for benchmarks separating crypto and OTP costs from disk
+    costs, and for applications that keep the vault elsewhere.
+    """
+
+    def __init__(self) -> None:
+        self.path = None
+        self.pooled = True
+        self.service_table = "services"
+        self.auth_table = "auth"
+        self._services: dict[str, dict[tuple[str, str], str]] = {}
+        self._order: dict[str, list[tuple[str, str]]] = {}
+        self._auth: dict[str, tuple[str, str]] = {}
+        self._recovery: dict[str, dict[str, bool]] = {}
+        self._rotations: dict[str, list] = {}
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+
+    def __len__(self) -> int:
+        return sum(len(services) for services in self._services.values())
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._transaction_depth == 0:
+                snapshot = self._snapshot()
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._transaction_depth == 1:
+                    self._restore(snapshot)
+                raise
+            finally:
+                self._transaction_depth -= 1
+
+    @contextlib.contextmanager
+    def reader(self):
+        yield self
+
+    def insert_one(self, data, table_name: str) -> None:
+        if table_name == self.service_table:
+            self.insert_many([data])
+        elif table_name == self.auth_table:
+            with self._lock:
+                self._auth[data["user_id"]] = (data["key"], "[]")
+                self._recovery[data["user_id"]] = dict.fromkeys(
+                    data["recovery_codes"], False
+                )
+
+    def insert_many(self, data: list[ServiceData]) -> None:
+        with self._lock:
+            keys = [
+                (record["user_id"], (record["service"], record["username"]))
+                for record in data
+            ]
+            # Checked up front, so a failing batch stores nothing.
+            if len(set(keys)) != len(keys) or any(
+                key in self._services.get(user_id, ()) for user_id, key in keys
+            ):
+                raise sqlite3.IntegrityError(UNIQUE_SERVICE)
+            for (user_id, key), record in zip(keys, data):
+                self._services.setdefault(user_id, {})[key] = record["seed"]
+                bisect.insort(self._order.setdefault(user_id, []), key)
+
+    def find_service(
+        self, user_id: str, username: str, service: str
+    ) -> ServiceData | None:
+        seed = self._services.get(user_id, {}).get((service, username))
+        if seed is None:
+            return None
+        return ServiceData(user_id, username, service, seed)
+
+    def service_keys(self, user_id: str) -> set[tuple[str, str]]:
+        with self._lock:
+            return set(self._services.get(user_id, ()))
+
+    def iter_services(
+        self, user_id: str, batch_size: int = 500
+    ) -> Iterator[list[ServiceData]]:
+        after = None
+        while batch := self.page_services(user_id, after, batch_size):
+            yield batch
+            after = (batch[-1].service, batch[-1].username)
+
+    def page_services(
+        self, user_id: str, after: tuple[str, str] | None = None, limit: int = 500
+    ) -> list[ServiceData]:
+        with self._lock:
+            order = self._order.get(user_id, [])
+            services = self._services.get(user_id, {})
+            start = 0 if after is None else bisect.bisect_right(order, tuple(after))
+            return [
+                ServiceData(user_id, username, service, services[service, username])
+                for service, username in order[start : start + limit]
+            ]
+
+    def find_auth(self, user_id: str, key: str, mode="key") -> AuthData | None:
+        auth = self._auth.get(user_id)
+        if auth is None or (mode == "key" and auth[0] != key):
+            return None
+        return AuthData(user_id, auth[0], auth[1])
+
+    def find_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        return self._recovery.get(user_id, {}).get(code_hash) is False
+
+    def consume_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        with self._lock:
+            codes = self._recovery.get(user_id, {})
+            if codes.get(code_hash) is not False:
+                return False
+            codes[code_hash] = True
+            return True
+
+    def replace_recovery_codes(self, user_id: str, code_hashes: list[str]) -> None:
+        with self._lock:
+            self._recovery[user_id] = dict.fromkeys(code_hashes, False)
+
+    def update_key(self, user_id: str, key: str) -> None:
+        with self._lock:
+            if user_id in self._auth:
+                self._auth[user_id] = (key, self._auth[user_id][1])
+
+    def start_rotation(self, user_id: str, old_key: str, new_key: str) -> None:
+        with self._lock:
+            if user_id in self._rotations:
+                raise sqlite3.IntegrityError(
+                    "UNIQUE constraint failed: key_rotations.user_id"
+                )
+            self._rotations[user_id] = [old_key, new_key, None, None, 0]
+            self.update_key(user_id, new_key)
+
+    def find_rotation(self, user_id: str) -> RotationData | None:
+        rotation = self._rotations.get(user_id)
+        return None if rotation is None else RotationData(user_id, *rotation)
+
+    def rotate_batch(self, user_id: str, rows: list[ServiceData], rotated: int) -> None:
+        with self._lock:
+            services = self._services.get(user_id, {})
+            for row in rows:
+                if (row.service, row.username) in services:
+                    services[row.service, row.username] = row.seed
+            rotation = self._rotations.get(user_id)
+            if rotation is not None:
+                rotation[2:] = [rows[-1].service, rows[-1].username, rotated]
+
+    def finish_rotation(self, user_id: str) -> None:
+        with self._lock:
+            self._rotations.pop(user_id, None)
+
+    def delete_service(self, user_id: str, service: str) -> None:
+        with self._lock:
+            services = self._services.get(user_id, {})
+            for key in [key for key in services if key[0] == service]:
+                del services[key]
+                order = self._order[user_id]
+                del order[bisect.bisect_left(order, key)]
+
+    def delete_auth(self, user_id: str) -> None:
+        with self._lock:
+            self._auth.pop(user_id, None)
+            self._recovery.pop(user_id, None)
+            self._rotations.pop(user_id, None)
+
+    def update_service(self, user_id: str, service: str, data: ServiceData) -> None:
+        with self._lock:
+            services = self._services.get(user_id, {})
+            # Every username of the service is updated, as with the SQL UPDATE.
+            keys = [key for key in services if key[0] == service]
+            if not keys:
+                return
+            new_key = (service, data["username"])
+            if len(keys) > 1 or (new_key in services and keys != [new_key]):
+                raise sqlite3.IntegrityError(UNIQUE_SERVICE)
+            order = self._order[user_id]
+            del services[keys[0]]
+            del order[bisect.bisect_left(order, keys[0])]
+            services[new_key] = data["seed"]
+            bisect.insort(order, new_key)
+
+    def is_registered(self) -> bool:
+        return bool(self._auth)
+
+    def create_search_index(self) -> bool:
+        return False
+
+    def has_search_index(self) -> bool:
+        return False
+
+    def search_services(
+        self, user_id: str, query: str, limit: int = 50
+    ) -> list[tuple[str, str]]:
+        query = query.casefold()
+        with self._lock:
+            found = [
+                key
+                for key in self._order.get(user_id, [])
+                if query in key[0].casefold() or query in key[1].casefold()
+            ]
+        return found[:limit]
+
+    def close(self) -> None:
+        pass
+
+    def _snapshot(self) -> tuple:
+        return (
+            {user_id: dict(services) for user_id, services in self._services.items()},
+            {user_id: list(order) for user_id, order in self._order.items()},
+            dict(self._auth),
+            copy.deepcopy(self._recovery),
+            copy.deepcopy(self._rotations),
+        )
+
+    def _restore(self, snapshot: tuple) -> None:
+        (
+            self._services,
+            self._order,
+            self._auth,
+            self._recovery,
+            self._rotations,
+        ) = snapshot
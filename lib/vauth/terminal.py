@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+
+ESC = "\x1b"
+CSI = ESC + "["
+
+try:
+    import select
+    import termios
+    import tty
+except ImportError:  # Windows
+    termios = None
+    import msvcrt
+
+
+class KeyReader:
+    """
+    Reads single keypresses from the terminal without root or a busy loop.
+    - On POSIX the terminal is put in cbreak mode and read_key() blocks in
+      select() until stdin is readable or the timeout expires.
+    - On Windows msvcrt is polled every poll_interval seconds.
+    - The terminal mode is restored when the context manager exits.
+
+    Attributes
+    ----------
+    selectable : bool
+        Whether the stream can be waited on with select() or an event loop
+
+    Methods
+    -------
+    read_key(timeout: float | None = None) -> str | None:
+        Waits for a keypress
+
+    Usage
+    -----
+    with KeyReader() as keys:
+        if keys.read_key(1.0) == ESC:
+            ...
+    """
+
+    def __init__(self, stream=None, poll_interval: float = 0.05) -> None:
+        self.stream = sys.stdin if stream is None else stream
+        self.poll_interval = poll_interval
+        self._saved = None
+
+    @property
+    def selectable(self) -> bool:
+        return termios is not None
+
+    def __enter__(self) -> "KeyReader":
+        if termios is not None and self.stream.isatty():
+            fd = self.stream.fileno()
+            self._saved = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._saved is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self._saved)
+            self._saved = None
+
+    def read_key(self, timeout: float | None = None) -> str | None:
+        """
+        Waits for a keypress
+
+        Parameters
+        ----------
+        timeout : float | None
+            Seconds to wait at most, waits forever when None
+
+        Returns
+        -------
+        str | None
+            ESC for the escape key, the characters read otherwise.
+            None on timeout or end of input.
+        """
+        if termios is None:
+            return self._read_windows(timeout)
+        fd = self.stream.fileno()
+        readable, _, _ = select.select([fd], [], [], timeout)
+        if not readable:
+            return None
+        # An escape sequence (arrow keys...) arrives in a single read.
+        data = os.read(fd, 32)
+        if not data:
+            # End of input, wait out the timeout instead of spinning.
+            if timeout:
+                time.sleep(timeout)
+            return None
+        return data.decode(errors="replace")
+
+    def _read_windows(self, timeout: float | None) -> str | None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not msvcrt.kbhit():
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+        key = msvcrt.getwch()
+        if key in ("\x00", "\xe0"):
+            # Function and arrow keys send a second character.
+            return key + msvcrt.getwch()
+        return key
+
+
+def seconds_to_next_tick(now: float | None = None) -> float:
+    """
+    Returns the time left until the next whole second, the display refresh tick
+
+    Parameters
+    ----------
+    now : float | None
+        Unix time, defaults to the current time
+    """
+    now = time.time() if now is None else now
+    return 1.0 - now % 1.0
+
+
+class Screen:
+    """
+    Line-based ANSI renderer that redraws only the lines that changed.
+    - The first draw() clears the screen, later ones move the cursor to each
+      changed line and rewrite it in place, so nothing flickers.
+    - Every frame is a single write, no subprocess is spawned.
+    - The cursor is hidden while the screen is in use.
+
+    Methods
+    -------
+    draw(lines: list[str]) -> None:
+        Renders a frame
+    clear() -> None:
+        Clears the terminal and forgets the last frame
+
+    Usage
+    -----
+    with Screen() as screen:
+        screen.draw(["OTP: 123456", "█████░░░░░ 5s"])
+    """
+
+    def __init__(self, stream=None) -> None:
+        self.stream = sys.stdout if stream is None else stream
+        self._lines: list[str] | None = None
+        _enable_ansi()
+
+    def __enter__(self) -> "Screen":
+        self._write(CSI + "?25l")
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.clear()
+        self._write(CSI + "?25h")
+
+    def draw(self, lines: list[str]) -> None:
+        """
+        Renders a frame, rewriting only the lines that differ from the last one
+
+        Parameters
+        ----------
+        lines : list[str]
+            Lines of the frame, without newlines
+        """
+        if self._lines is None:
+            out = [CSI + "2J" + CSI + "H", "\n".join(lines)]
+        else:
+            out = []
+            previous = self._lines
+            for row in range(max(len(lines), len(previous))):
+                line = lines[row] if row < len(lines) else ""
+                if row < len(previous) and previous[row] == line:
+                    continue
+                out.append(f"{CSI}{row + 1};1H{line}{CSI}K")
+            out.append(f"{CSI}{len(lines) + 1};1H")
+        self._lines = list(lines)
+        self._write("".join(out))
+
+    def clear(self) -> None:
+        """
+        Clears the terminal and forgets the last frame
+        """
+        self._lines = None
+        self._write(CSI + "2J" + CSI + "H")
+
+    def _write(self, data: str) -> None:
+        self.stream.write(data)
+        self.stream.flush()
+
+
+def _enable_ansi() -> None:
+    # Windows 10+ consoles understand ANSI once virtual terminal processing is on.
+    if os.name != "nt":
+        return
+    try:
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)
+        mode = ctypes.c_uint32()
+        if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            kernel32.SetConsoleMode(handle, mode.value | 0x0004)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,872 @@
+import base64
+import binascii
+import bisect
+import contextlib
+import copy
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import zlib
+from typing import Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from vauth.database import Database
+from vauth.metrics import METRICS
+from vauth.storage import UNIQUE_SERVICE
+
+ServiceData = Database.ServiceData
+AuthData = Database.AuthData
+RotationData = Database.RotationData
+
+VAULT_FILE = "vauth.vault"
+MAGIC = b"vAUTHVLT"
+VERSION = 1
+
+# magic, version, flags, index offset, index slots, used slots, live services,
+# data end, meta offset, dead bytes
+HEADER = struct.Struct("<8sIIQQQQQQQ")
+HEADER_SIZE = 128
+# payload length, crc32 of the kind and payload, kind
+RECORD = struct.Struct("<IIB")
+# byte lengths of user_id, service and username
+KEY = struct.Struct("<HHH")
+# key hash, record offset
+SLOT = struct.Struct("<QQ")
+LENGTH = struct.Struct("<I")
+URLSAFE = bytes.maketrans(b"+/", b"-_")
+
+# Record kinds
+SERVICE, DELETE, META, INDEX = 1, 2, 3, 4
+# Slot offsets that are not records
+EMPTY, DELETED = 0, 1
+# Seed encodings, Fernet tokens are stored decoded
+TEXT, TOKEN = 0, 1
+# Header flags
+DIRTY = 1
+
+MIN_SLOTS = 1024
+MAX_LOAD = 0.7
+# The file grows by at least this much, and is compacted once at least this
+# much of it is dead and dead records are over half of it.
+GROWTH = 1 << 20
+COMPACT_MIN_DEAD = 1 << 20
+
+
+class VaultError(Exception):
+    """
+    Raised when a vault file is corrupted, or opened by another process
+    """
+
+
+class VaultStorage:
+    """
+    Storage in a single append-only file, read through mmap.
+    - Services are length-prefixed records holding the key and the Fernet
+      token as raw bytes, appended on every insert or update. Deletes append
+      a tombstone, so the records alone describe the vault.
+    - The header points at an open addressing hash table of (hash, offset)
+      slots. A lookup hashes the key and reads one slot and one record from
+      the mapping, without SQL or system calls.
+    - Auth records, recovery codes and password change checkpoints are small
+      and kept in a JSON record, rewritten when they change.
+    - Outdated records are dead space. The table grows by appending a larger
+      one, and the file is rewritten without dead records once they are over
+      half of it, or by compact().
+    - Every write is a transaction. A failed transaction appends the previous
+      records again, then the data is flushed before the header marks the
+      file clean. A file left dirty by a crash is rebuilt from its records up
+      to the last committed one.
+    - Lookups do not lock, writes are serialized, so the storage can be shared
+      between threads. A lookup may see the writes of a transaction still in
+      progress, which can be rolled back. A service updated without a new
+      username is never seen missing. The file is locked against other
+      processes.
+
+    Methods
+    -------
+    find_service(user_id: str, username: str, service: str) -> ServiceData | None:
+        Finds a service record with one hash table probe
+    compact() -> None:
+        Rewrites the file without dead records
+    user_ids() -> list[str]:
+        Returns every registered user
+    recovery_codes(user_id: str) -> dict[str, bool]:
+        Returns the recovery code hashes of a user and whether they were used
+    The other methods mirror Database.
+    """
+
+    def __init__(
+        self, path: str = os.path.join(os.path.expanduser("~"), ".vauth")
+    ) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            Directory holding vauth.vault, created when missing
+
+        Raises
+        ------
+        VaultError
+            If the file is not a vault or is opened by another process
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.file = os.path.join(path, VAULT_FILE)
+        self.pooled = True
+        self.service_table = "services"
+        self.auth_table = "auth"
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._undo: list | None = None
+        self._meta_before: dict | None = None
+        self._order: dict[str, list[tuple[str, str]]] | None = None
+        self._offsets: dict[str, dict[tuple[str, str], int]] = {}
+        self._fd = -1
+        if os.path.exists(self.file):
+            fd = os.open(self.file, os.O_RDWR)
+            _lock_file(fd)
+            self._open(fd)
+        else:
+            self._rewrite([], _empty_meta())
+
+    def __len__(self) -> int:
+        return self._live
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups writes, they are flushed together and undone on an exception.
+        Nested blocks join the outermost one.
+        """
+        with self._lock:
+            if self._transaction_depth:
+                self._transaction_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._transaction_depth -= 1
+                return
+            self._begin()
+            try:
+                yield self
+            except BaseException:
+                self._rollback()
+                raise
+            finally:
+                self._transaction_depth = 0
+                self._undo = self._meta_before = None
+                self._commit()
+
+    @contextlib.contextmanager
+    def reader(self):
+        yield self
+
+    def insert_one(self, data, table_name: str) -> None:
+        """
+        Inserts a service or auth record, see Database.insert_one
+        """
+        if table_name == self.service_table:
+            self.insert_many([data])
+        elif table_name == self.auth_table:
+            with self.transaction():
+                self._meta["auth"][data["user_id"]] = data["key"]
+                self._meta["recovery"][data["user_id"]] = dict.fromkeys(
+                    data["recovery_codes"], False
+                )
+                self._write_meta()
+
+    @METRICS.timed("db")
+    def insert_many(self, data: list[ServiceData]) -> None:
+        """
+        Inserts many service records in one transaction
+
+        Parameters
+        ----------
+        data : list[ServiceData]
+            Records to be inserted
+
+        Raises
+        ------
+        sqlite3.IntegrityError
+            If one of the services already exists for the user, nothing is
+            inserted then
+        """
+        with self.transaction():
+            keys = [
+                _key(record["user_id"], record["service"], record["username"])
+                for record in data
+            ]
+            state = self._state
+            if len(set(keys)) != len(keys) or any(
+                _lookup(state, key, _hash(key))[0] >= 0 for key in keys
+            ):
+                raise sqlite3.IntegrityError(UNIQUE_SERVICE)
+            for key, record in zip(keys, data):
+                self._put(key, record["seed"])
+
+    @METRICS.timed("db")
+    def find_service(
+        self, user_id: str, username: str, service: str
+    ) -> ServiceData | None:
+        """
+        Finds a service record with one hash table probe
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        username : str
+            Username
+        service : str
+            Service
+
+        Returns
+        -------
+        ServiceData | None
+            Service record
+        """
+        key = _key(user_id, service, username)
+        state = self._state
+        position, offset, _ = _lookup(state, key, _hash(key))
+        if position < 0:
+            return None
+        return ServiceData(user_id, username, service, _seed(state[0], offset))
+
+    @METRICS.timed("db")
+    def service_keys(self, user_id: str) -> set[tuple[str, str]]:
+        with self._lock:
+            return set(self._keys(user_id))
+
+    def iter_services(
+        self, user_id: str, batch_size: int = 500
+    ) -> Iterator[list[ServiceData]]:
+        after = None
+        while batch := self.page_services(user_id, after, batch_size):
+            yield batch
+            after = (batch[-1].service, batch[-1].username)
+
+    @METRICS.timed("db")
+    def page_services(
+        self, user_id: str, after: tuple[str, str] | None = None, limit: int = 500
+    ) -> list[ServiceData]:
+        """
+        Returns the next page of service records of a user.
+        The (service, username) order and the offset of every record are kept
+        in memory, they are loaded from the hash table by the first call that
+        needs them.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        after : tuple[str, str] | None
+            (service, username) of the last record of the previous page
+        limit : int
+            Number of records per page
+
+        Returns
+        -------
+        list[ServiceData]
+            Service records in (service, username) order, empty after the last page
+        """
+        with self._lock:
+            order = self._keys(user_id)
+            offsets = self._offsets.get(user_id, {})
+            start = 0 if after is None else bisect.bisect_right(order, tuple(after))
+            mm = self._state[0]
+            rows = []
+            for service, username in order[start : start + limit]:
+                seed = _seed(mm, offsets[service, username])
+                rows.append(ServiceData(user_id, username, service, seed))
+            return rows
+
+    def create_search_index(self) -> bool:
+        return False
+
+    def has_search_index(self) -> bool:
+        return False
+
+    @METRICS.timed("db")
+    def search_services(
+        self, user_id: str, query: str, limit: int = 50
+    ) -> list[tuple[str, str]]:
+        """
+        Returns the pairs whose service or username contains the query,
+        ignoring case, by scanning the names of the user
+        """
+        query = query.casefold()
+        found = []
+        with self._lock:
+            for service, username in self._keys(user_id):
+                if query in service.casefold() or query in username.casefold():
+                    found.append((service, username))
+                    if len(found) >= limit:
+                        break
+        return found
+
+    @METRICS.timed("db")
+    def find_auth(self, user_id: str, key: str, mode="key") -> AuthData | None:
+        """
+        Finds an auth record, see Database.find_auth
+        """
+        stored = self._meta["auth"].get(user_id)
+        if stored is None or (mode == "key" and stored != key):
+            return None
+        return AuthData(user_id, stored, "[]")
+
+    @METRICS.timed("db")
+    def find_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        return self._meta["recovery"].get(user_id, {}).get(code_hash) is False
+
+    @METRICS.timed("db")
+    def consume_recovery_code(self, user_id: str, code_hash: str) -> bool:
+        """
+        Marks a recovery code as used, see Database.consume_recovery_code
+        """
+        with self.transaction():
+            codes = self._meta["recovery"].get(user_id, {})
+            if codes.get(code_hash) is not False:
+                return False
+            codes[code_hash] = True
+            self._write_meta()
+            return True
+
+    @METRICS.timed("db")
+    def replace_recovery_codes(self, user_id: str, code_hashes: list[str]) -> None:
+        with self.transaction():
+            self._meta["recovery"][user_id] = dict.fromkeys(code_hashes, False)
+            self._write_meta()
+
+    def recovery_codes(self, user_id: str) -> dict[str, bool]:
+        """
+        Returns the recovery code hashes of a user and whether they were used
+        """
+        return dict(self._meta["recovery"].get(user_id, {}))
+
+    def user_ids(self) -> list[str]:
+        """
+        Returns every registered user
+        """
+        return list(self._meta["auth"])
+
+    @METRICS.timed("db")
+    def update_key(self, user_id: str, key: str) -> None:
+        with self.transaction():
+            if user_id in self._meta["auth"]:
+                self._meta["auth"][user_id] = key
+                self._write_meta()
+
+    def start_rotation(self, user_id: str, old_key: str, new_key: str) -> None:
+        """
+        Records a password change and switches the password hash, see
+        Database.start_rotation
+        """
+        with self.transaction():
+            if user_id in self._meta["rotations"]:
+                raise sqlite3.IntegrityError(
+                    "UNIQUE constraint failed: key_rotations.user_id"
+                )
+            self._meta["rotations"][user_id] = [old_key, new_key, None, None, 0]
+            self.update_key(user_id, new_key)
+
+    def find_rotation(self, user_id: str) -> RotationData | None:
+        rotation = self._meta["rotations"].get(user_id)
+        return None if rotation is None else RotationData(user_id, *rotation)
+
+    @METRICS.timed("db")
+    def rotate_batch(self, user_id: str, rows: list[ServiceData], rotated: int) -> None:
+        """
+        Stores a batch of re-encrypted seeds and moves the checkpoint past it,
+        see Database.rotate_batch
+        """
+        with self.transaction():
+            state = self._state
+            for row in rows:
+                key = _key(user_id, row.service, row.username)
+                if _lookup(state, key, _hash(key))[0] >= 0:
+                    self._put(key, row.seed)
+                    state = self._state
+            rotation = self._meta["rotations"].get(user_id)
+            if rotation is not None:
+                rotation[2:] = [rows[-1].service, rows[-1].username, rotated]
+                self._write_meta()
+
+    def finish_rotation(self, user_id: str) -> None:
+        with self.transaction():
+            if self._meta["rotations"].pop(user_id, None) is not None:
+                self._write_meta()
+
+    @METRICS.timed("db")
+    def delete_service(self, user_id: str, service: str) -> None:
+        """
+        Deletes every username of a service
+        """
+        with self.transaction():
+            for _, username in _prefix_keys(self._keys(user_id), service):
+                self._remove(_key(user_id, service, username))
+
+    @METRICS.timed("db")
+    def delete_auth(self, user_id: str) -> None:
+        """
+        Deletes the auth record, recovery codes and checkpoint of a user
+        """
+        with self.transaction():
+            for table in ("auth", "recovery", "rotations"):
+                self._meta[table].pop(user_id, None)
+            self._write_meta()
+
+    @METRICS.timed("db")
+    def update_service(self, user_id: str, service: str, data: ServiceData) -> None:
+        """
+        Updates the username and seed of a service, see Database.update_service
+        """
+        with self.transaction():
+            # Every username of the service is updated, as with the SQL UPDATE.
+            keys = _prefix_keys(self._keys(user_id), service)
+            if not keys:
+                return
+            new = _key(user_id, service, data["username"])
+            if len(keys) > 1 or (
+                keys[0][1] != data["username"]
+                and _lookup(self._state, new, _hash(new))[0] >= 0
+            ):
+                raise sqlite3.IntegrityError(UNIQUE_SERVICE)
+            if keys[0][1] != data["username"]:
+                self._remove(_key(user_id, service, keys[0][1]))
+            # The slot of a kept key is repointed in place, lookups never miss it.
+            self._put(new, data["seed"])
+
+    def is_registered(self) -> bool:
+        return bool(self._meta["auth"])
+
+    def compact(self) -> None:
+        """
+        Rewrites the file with the live records only and a new hash table.
+        Threads still reading keep the previous mapping until they are done.
+        """
+        with self._lock:
+            if self._transaction_depth:
+                raise RuntimeError("cannot compact during a transaction")
+            mm, index, slots = self._state
+            table = mm[index + RECORD.size : index + RECORD.size + slots * SLOT.size]
+            offsets = sorted(
+                offset for _, offset in SLOT.iter_unpack(table) if offset > DELETED
+            )
+            self._rewrite([_record(mm, offset) for offset in offsets], self._meta)
+
+    def close(self) -> None:
+        """
+        Waits for the running write, then unmaps and unlocks the file
+        """
+        with self._lock:
+            if self._fd < 0:
+                return
+            self._state[0].close()
+            os.close(self._fd)
+            self._fd = -1
+
+    def _keys(self, user_id: str) -> list[tuple[str, str]]:
+        # Sorted (service, username) pairs of a user, called with the lock held.
+        if self._order is None:
+            offsets: dict[str, dict[tuple[str, str], int]] = {}
+            mm, index, slots = self._state
+            start = index + RECORD.size
+            for _, offset in SLOT.iter_unpack(mm[start : start + slots * SLOT.size]):
+                if offset > DELETED:
+                    user, service, username = _decode_key(mm, offset + RECORD.size)
+                    offsets.setdefault(user, {})[service, username] = offset
+            self._offsets = offsets
+            self._order = {user: sorted(pairs) for user, pairs in offsets.items()}
+        return self._order.get(user_id, [])
+
+    def _put(self, key: bytes, seed: str) -> None:
+        offset = self._append(SERVICE, key + _encode_seed(seed))
+        self._link(key, _hash(key), offset)
+
+    def _remove(self, key: bytes) -> None:
+        self._dead += RECORD.size + len(key)
+        self._append(DELETE, key)
+        self._link(key, _hash(key), None)
+
+    def _link(self, key: bytes, digest: int, offset: int | None) -> None:
+        # Points the slot of a key at a record, or frees it when offset is None.
+        if offset is not None and self._used + 1 > self._state[2] * MAX_LOAD:
+            self._grow_index()
+        mm = self._state[0]
+        position, previous, free = _lookup(self._state, key, digest)
+        if position >= 0:
+            self._dead += RECORD.size + LENGTH.unpack_from(mm, previous)[0]
+            if offset is None:
+                SLOT.pack_into(mm, position, 0, DELETED)
+                self._live -= 1
+            else:
+                SLOT.pack_into(mm, position, digest, offset)
+        elif offset is not None:
+            if SLOT.unpack_from(mm, free)[1] == EMPTY:
+                self._used += 1
+            SLOT.pack_into(mm, free, digest, offset)
+            self._live += 1
+        else:
+            return
+        if self._undo is not None:
+            self._undo.append((key, previous if position >= 0 else None))
+        if self._order is not None:
+            user_id, service, username = _decode_key(key, 0)
+            keys = self._order.setdefault(user_id, [])
+            offsets = self._offsets.setdefault(user_id, {})
+            pair = (service, username)
+            if offset is None:
+                if offsets.pop(pair, None) is not None:
+                    del keys[bisect.bisect_left(keys, pair)]
+            else:
+                if pair not in offsets:
+                    bisect.insort(keys, pair)
+                offsets[pair] = offset
+
+    def _grow_index(self) -> None:
+        mm, index, slots = self._state
+        start = index + RECORD.size
+        entries = [
+            entry
+            for entry in SLOT.iter_unpack(mm[start : start + slots * SLOT.size])
+            if entry[1] > DELETED
+        ]
+        table, new_slots = _build_table(entries)
+        offset = self._append(INDEX, table)
+        self._dead += RECORD.size + slots * SLOT.size
+        self._state = (self._state[0], offset, new_slots)
+        self._used = len(entries)
+
+    def _append(self, kind: int, payload: bytes) -> int:
+        size = RECORD.size + len(payload)
+        mm = self._state[0]
+        if self._data_end + size > len(mm):
+            length = self._data_end + size + max(GROWTH, len(mm) // 4)
+            os.ftruncate(self._fd, length)
+            # Readers holding the previous mapping keep using it, both map
+            # the same pages.
+            mm = mmap.mmap(self._fd, length)
+            self._state = (mm,) + self._state[1:]
+        offset = self._data_end
+        # The hash table is updated in place, it is not checksummed.
+        checksum = 0 if kind == INDEX else _checksum(kind, payload)
+        RECORD.pack_into(mm, offset, len(payload), checksum, kind)
+        mm[offset + RECORD.size : offset + size] = payload
+        self._data_end += size
+        return offset
+
+    def _write_meta(self) -> None:
+        if self._meta_offset:
+            mm = self._state[0]
+            self._dead += RECORD.size + LENGTH.unpack_from(mm, self._meta_offset)[0]
+        self._meta_offset = self._append(
+            META, json.dumps(self._meta, separators=(",", ":")).encode()
+        )
+
+    def _begin(self) -> None:
+        self._transaction_depth = 1
+        self._undo = []
+        self._meta_before = copy.deepcopy(self._meta)
+        self._committed_end = self._data_end
+        # Marked before the first change, a crash leaves the file dirty.
+        self._write_header(DIRTY)
+        self._state[0].flush(0, mmap.PAGESIZE)
+
+    def _rollback(self) -> None:
+        undo, self._undo = self._undo, None
+        # Records are appended again rather than relinked, so that the
+        # records alone still describe the vault.
+        for key, previous in reversed(undo):
+            if previous is None:
+                self._remove(key)
+            else:
+                mm = self._state[0]
+                self._link(key, _hash(key), self._append(*_record(mm, previous)))
+        if self._meta != self._meta_before:
+            self._meta = self._meta_before
+            self._write_meta()
+        self._order = None
+
+    def _commit(self) -> None:
+        mm = self._state[0]
+        if self._data_end != self._committed_end:
+            mm.flush()
+        self._write_header(0)
+        mm.flush(0, mmap.PAGESIZE)
+        if self._dead > COMPACT_MIN_DEAD and self._dead * 2 > self._data_end:
+            self.compact()
+
+    def _write_header(self, flags: int) -> None:
+        _, index, slots = self._state
+        HEADER.pack_into(
+            self._state[0],
+            0,
+            MAGIC,
+            VERSION,
+            flags,
+            index,
+            slots,
+            self._used,
+            self._live,
+            self._data_end,
+            self._meta_offset,
+            self._dead,
+        )
+
+    def _open(self, fd: int) -> None:
+        size = os.fstat(fd).st_size
+        mm = mmap.mmap(fd, size) if size >= HEADER_SIZE else None
+        if mm is None or HEADER.unpack_from(mm, 0)[:2] != (MAGIC, VERSION):
+            if mm is not None:
+                mm.close()
+            os.close(fd)
+            raise VaultError(f"{self.file} is not a vAUTH vault")
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = fd
+        _, _, flags, index, slots, *counts = HEADER.unpack_from(mm, 0)
+        self._used, self._live, self._data_end, self._meta_offset, self._dead = counts
+        self._committed_end = self._data_end
+        self._state = (mm, index, slots)
+        self._order = None
+        if flags & DIRTY:
+            self._recover()
+        else:
+            self._meta = json.loads(_record(mm, self._meta_offset)[1])
+
+    def _recover(self) -> None:
+        # Replays the records of the last commit, the file was left dirty.
+        mm = self._state[0]
+        live: dict[bytes, int] = {}
+        meta = _empty_meta()
+        offset = HEADER_SIZE
+        while offset < self._data_end:
+            length, checksum, kind = RECORD.unpack_from(mm, offset)
+            payload = mm[offset + RECORD.size : offset + RECORD.size + length]
+            if len(payload) != length or (
+                kind != INDEX and checksum != _checksum(kind, payload)
+            ):
+                raise VaultError(f"{self.file} is corrupted at offset {offset}")
+            if kind == SERVICE:
+                live[_key_bytes(payload)] = offset
+            elif kind == DELETE:
+                live.pop(payload, None)
+            elif kind == META:
+                meta = json.loads(payload)
+            offset += RECORD.size + length
+        self._rewrite([_record(mm, offset) for offset in sorted(live.values())], meta)
+
+    def _rewrite(self, records: Iterable[tuple[int, bytes]], meta: dict) -> None:
+        # Writes a clean file next to the vault, locks it and swaps it in.
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".vauth-vault-")
+        try:
+            _lock_file(fd)
+            entries = []
+            with os.fdopen(os.dup(fd), "wb") as file:
+                file.write(bytes(HEADER_SIZE))
+                offset = HEADER_SIZE
+                for kind, payload in records:
+                    entries.append((_hash(_key_bytes(payload)), offset))
+                    file.write(_pack_record(kind, payload))
+                    offset += RECORD.size + len(payload)
+                meta_payload = json.dumps(meta, separators=(",", ":")).encode()
+                file.write(_pack_record(META, meta_payload))
+                meta_offset = offset
+                offset += RECORD.size + len(meta_payload)
+                table, slots = _build_table(entries)
+                file.write(RECORD.pack(len(table), 0, INDEX) + table)
+                index = offset
+                offset += RECORD.size + len(table)
+                file.seek(0)
+                count = len(entries)
+                file.write(
+                    HEADER.pack(
+                        MAGIC, VERSION, 0, index, slots, count, count, offset,
+                        meta_offset, 0,
+                    )
+                )
+                file.truncate(offset + GROWTH)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.file)
+        except BaseException:
+            os.close(fd)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+        self._open(fd)
+
+
+def convert(source: Database, target: VaultStorage, batch_size: int = 10_000) -> int:
+    """
+    Copies every user of a SQLite database into a vault file
+
+    Parameters
+    ----------
+    source : Database
+        Database to read, it is not modified
+    target : VaultStorage
+        Empty vault
+    batch_size : int
+        Number of services copied per transaction
+
+    Returns
+    -------
+    int
+        Number of services copied
+
+    Raises
+    ------
+    VaultError
+        If a password change is unfinished, its checkpoint is not copied
+    """
+    count = 0
+    for user_id in source.user_ids():
+        if source.find_rotation(user_id) is not None:
+            raise VaultError(f"finish the password change of {user_id} first")
+        auth = source.find_auth(user_id, "", mode="recovery")
+        codes = source.recovery_codes(user_id)
+        with target.transaction():
+            target.insert_one(
+                {"user_id": user_id, "key": auth.key, "recovery_codes": list(codes)},
+                target.auth_table,
+            )
+            for code_hash, consumed in codes.items():
+                if consumed:
+                    target.consume_recovery_code(user_id, code_hash)
+        for batch in source.iter_services(user_id, batch_size):
+            target.insert_many(batch)
+            count += len(batch)
+    return count
+
+
+def _empty_meta() -> dict:
+    return {"auth": {}, "recovery": {}, "rotations": {}}
+
+
+def _lock_file(fd: int) -> None:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            # The first byte stands for the file, the lock ends with the handle.
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except (BlockingIOError, PermissionError):
+        os.close(fd)
+        raise VaultError("the vault is used by another vauth process")
+
+
+def _key(user_id: str, service: str, username: str) -> bytes:
+    user, name, login = user_id.encode(), service.encode(), username.encode()
+    return KEY.pack(len(user), len(name), len(login)) + user + name + login
+
+
+def _key_bytes(payload: bytes) -> bytes:
+    return payload[: KEY.size + sum(KEY.unpack_from(payload))]
+
+
+def _decode_key(buffer, start: int) -> tuple[str, str, str]:
+    user, name, login = KEY.unpack_from(buffer, start)
+    start += KEY.size
+    return (
+        bytes(buffer[start : start + user]).decode(),
+        bytes(buffer[start + user : start + user + name]).decode(),
+        bytes(buffer[start + user + name : start + user + name + login]).decode(),
+    )
+
+
+def _hash(key: bytes) -> int:
+    # Slots are picked by the low bits, the CRC.
+    return zlib.adler32(key) << 32 | zlib.crc32(key)
+
+
+def _encode_seed(seed: str) -> bytes:
+    try:
+        raw = base64.urlsafe_b64decode(seed)
+    except (binascii.Error, ValueError):
+        raw = None
+    # Only tokens that encode back to the same text are stored decoded.
+    if raw is not None and base64.urlsafe_b64encode(raw).decode() == seed:
+        return bytes((TOKEN,)) + raw
+    return bytes((TEXT,)) + seed.encode()
+
+
+def _seed(mm: mmap.mmap, offset: int) -> str:
+    start = offset + RECORD.size
+    end = start + LENGTH.unpack_from(mm, offset)[0]
+    start += KEY.size + sum(KEY.unpack_from(mm, start))
+    if mm[start] == TOKEN:
+        token = binascii.b2a_base64(mm[start + 1 : end], newline=False)
+        return token.translate(URLSAFE).decode()
+    return mm[start + 1 : end].decode()
+
+
+def _record(mm: mmap.mmap, offset: int) -> tuple[int, bytes]:
+    length, _, kind = RECORD.unpack_from(mm, offset)
+    return kind, mm[offset + RECORD.size : offset + RECORD.size + length]
+
+
+def _pack_record(kind: int, payload: bytes) -> bytes:
+    return RECORD.pack(len(payload), _checksum(kind, payload), kind) + payload
+
+
+def _checksum(kind: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(bytes((kind,))))
+
+
+def _lookup(
+    state: tuple[mmap.mmap, int, int], key: bytes, digest: int
+) -> tuple[int, int, int]:
+    # Linear probing, returns (slot position, record offset) of the key or -1
+    # and the position of the first reusable slot.
+    mm, index, slots = state
+    base = index + RECORD.size
+    mask = slots - 1
+    i = digest & mask
+    free = -1
+    start, end = RECORD.size, RECORD.size + len(key)
+    while True:
+        position = base + i * SLOT.size
+        slot_hash, offset = SLOT.unpack_from(mm, position)
+        if offset == EMPTY:
+            return -1, 0, position if free < 0 else free
+        if offset == DELETED:
+            if free < 0:
+                free = position
+        elif slot_hash == digest and mm[offset + start : offset + end] == key:
+            return position, offset, free
+        i = (i + 1) & mask
+
+
+def _build_table(entries: list[tuple[int, int]]) -> tuple[bytearray, int]:
+    # Sized for a load of at most MAX_LOAD / 2, slots are a power of two.
+    slots = MIN_SLOTS
+    while slots * MAX_LOAD < 2 * len(entries):
+        slots *= 2
+    table = bytearray(slots * SLOT.size)
+    mask = slots - 1
+    for digest, offset in entries:
+        i = digest & mask
+        while SLOT.unpack_from(table, i * SLOT.size)[1] != EMPTY:
+            i = (i + 1) & mask
+        SLOT.pack_into(table, i * SLOT.size, digest, offset)
+    return table, slots
+
+
+def _prefix_keys(keys: list[tuple[str, str]], service: str) -> list[tuple[str, str]]:
+    # Usernames of a service, they are contiguous in the sorted pairs.
+    start = bisect.bisect_left(keys, (service,))
+    end = start
+    while end < len(keys) and keys[end][0] == service:
+        end += 1
+    return keys[start:end]
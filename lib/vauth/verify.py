@@ -0,0 +1,240 @@
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vauth.otp import OTPEngine
+
+USAGE = 'expected {"checks": [[user_id, service, username, code], ...]}'
+
+
+class Verifier:
+    """
+    Checks submitted codes against precomputed expected codes.
+    - For every seed, the codes of the time steps within drift of the current
+      one are computed once per time step and kept in a code -> step map.
+    - A code is only accepted once. The last accepted step of every
+      (user_id, service, username) is kept and codes of that step or an
+      older one are rejected, as in RFC 6238 section 5.2.
+    - Replay entries are dropped once their step has left the drift window,
+      the codes they block could not be accepted anymore anyway.
+    - Wrong and replayed codes of a known seed count as failures. After
+      max_failures of them, every code of that key is rejected until lockout
+      seconds pass without a new failure. An accepted code resets the count.
+
+    Methods
+    -------
+    verify_many(checks: list[tuple], drift=1, now=None) -> list[bool]:
+        Verifies a batch of codes
+    clear() -> None:
+        Forgets the expected codes and the replay cache
+    """
+
+    def __init__(self, max_failures: int = 5, lockout: float = 60.0) -> None:
+        self.engine = OTPEngine()
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self._expected: dict[str, tuple[tuple[int, int], dict[str, int]]] = {}
+        self._last_used: dict[tuple[str, str, str], tuple[int, float]] = {}
+        self._failures: dict[tuple[str, str, str], tuple[int, float]] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._last_used)
+
+    def verify_many(
+        self, checks: list[tuple], drift: int = 1, now: float | None = None
+    ) -> list[bool]:
+        """
+        Verifies a batch of codes
+
+        Parameters
+        ----------
+        checks : list[tuple]
+            (key, seed, code) tuples, key is (user_id, service, username).
+            A None seed is rejected.
+        drift : int
+            Number of time steps accepted before and after the current one
+        now : float | None
+            Unix time, defaults to the current time
+
+        Returns
+        -------
+        list[bool]
+            Whether each code is accepted, in the same order
+        """
+        if now is None:
+            now = time.time()
+        results = []
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            for key, seed, code in checks:
+                results.append(self._verify(key, seed, code, drift, now))
+        return results
+
+    def clear(self) -> None:
+        with self._lock:
+            self.engine.clear()
+            self._expected.clear()
+            self._last_used.clear()
+            self._failures.clear()
+
+    def _verify(self, key, seed: str | None, code, drift: int, now: float) -> bool:
+        if seed is None:
+            return False
+        failures = self._failures.get(key)
+        if failures is not None and failures[1] <= now:
+            failures = None
+        if failures is not None and failures[0] >= self.max_failures:
+            # Locked out, the code is neither checked nor consumed.
+            return False
+        if self._check(key, seed, code, drift, now):
+            self._failures.pop(key, None)
+            return True
+        count = 1 if failures is None else failures[0] + 1
+        self._failures[key] = (count, now + self.lockout)
+        return False
+
+    def _check(self, key, seed: str, code, drift: int, now: float) -> bool:
+        if not isinstance(code, str):
+            return False
+        engine = self.engine
+        if seed not in engine:
+            try:
+                engine.add(seed, seed)
+            except (ValueError, TypeError):
+                return False
+        interval = engine.interval(seed)
+        counter = int(now // interval)
+        expected = self._expected.get(seed)
+        if expected is None or expected[0] != (counter, drift):
+            codes = {}
+            # Farthest steps first, so the current step wins a shared code.
+            for distance in range(drift, -1, -1):
+                for step in (counter - distance, counter + distance):
+                    codes[engine.code_at(seed, step)] = step
+            expected = self._expected[seed] = ((counter, drift), codes)
+        step = expected[1].get(code)
+        if step is None:
+            return False
+        last = self._last_used.get(key)
+        if last is not None and step <= last[0]:
+            return False
+        self._last_used[key] = (step, (step + drift + 1) * interval)
+        return True
+
+    def _sweep(self, now: float) -> None:
+        expired = [key for key, (_, until) in self._last_used.items() if until <= now]
+        for key in expired:
+            del self._last_used[key]
+        expired = [key for key, (_, until) in self._failures.items() if until <= now]
+        for key in expired:
+            del self._failures[key]
+        self._next_sweep = now + 1.0
+
+
+def write_token(path: str) -> str:
+    """
+    Creates a random bearer token in a file only the owner can read
+
+    Parameters
+    ----------
+    path : str
+        Token file, replaced when it exists
+
+    Returns
+    -------
+    str
+        The token
+    """
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(token + "\n")
+    return token
+
+
+class VerifyServer(ThreadingHTTPServer):
+    """
+    Local HTTP/JSON front end of Commands.verify.
+
+    POST /verify with {"checks": [[user_id, service, username, code], ...]}
+    answers {"results": [bool, ...]} in the same order. Connections are kept
+    alive, so a client can send batch after batch on one socket.
+    Requests must carry "Authorization: Bearer <token>", others get a 401.
+    Every connection is served by its own thread, so the commands must use a
+    pooled database.
+
+    Methods
+    -------
+    serve_forever() -> None:
+        Serves until shutdown() is called
+    """
+
+    def __init__(
+        self,
+        commands,
+        key: str,
+        address: tuple[str, int],
+        token: str,
+        drift: int = 1,
+    ) -> None:
+        if drift < 0:
+            raise ValueError("drift must not be negative")
+        if not token:
+            raise ValueError("a token is required")
+        self.commands = commands
+        self.key = key
+        self.token = token
+        self.drift = drift
+        super().__init__(address, _VerifyHandler)
+
+
+class _VerifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        if self.path != "/verify":
+            self._reply(404, {"error": "not found"})
+            return
+        server = self.server
+        expected = f"Bearer {server.token}".encode()
+        given = self.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(given, expected):
+            # The body is left unread, so the connection cannot be reused.
+            self.close_connection = True
+            self._reply(401, {"error": "unauthorized"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            checks = json.loads(self.rfile.read(length))["checks"]
+            checks = [tuple(check) for check in checks]
+            if any(len(check) != 4 for check in checks):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {"error": USAGE})
+            return
+        results = server.commands.verify(server.key, checks, server.drift)
+        if not isinstance(results, list):
+            self._reply(500, {"error": "verification failed"})
+            return
+        self._reply(200, {"results": results})
+
+    def _reply(self, status: int, body: dict) -> None:
+        payload = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args) -> None:
+        pass
@@ -11,7 +11,7 @@ setup(
     packages=find_packages("lib"),
     package_dir={"": "lib"},
     include_package_data=True,
-    install_requires=["pyotp", "qrcode", "cryptography", "keyboard"],
+    install_requires=["pyotp", "qrcode", "cryptography"],
     entry_points={"console_scripts": ["vauth = vauth.__main__:main"]},
     url="https://github.com/theofficialvedantjoshi/vAUTH",
     classifiers=[